@@ -1,29 +1,62 @@
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
-from helper.entry import main  # Import the main function
-import asyncio
+from helper.clients import run
+from helper.jobs import create_job, dispatch_job, run_job_invocation, job_status
+# helper.entry pulls in the OpenAI, AWS and imaging SDKs, it is only imported by the paths that analyze frames
 import json
 
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         # Parse query parameters
-        query = urlparse(self.path).query
-        params = parse_qs(query)
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
 
         # Extract parameters
         submission_id = params.get('submission_id', [None])[0]
         assignment_id = params.get('assignment_id', [None])[0]
         user_id = params.get('user_id', [None])[0]
-        # start_no = params.get('start_no', [None])[0]
-        # end_no = params.get('end_no', [None])[0]
+        start_no = params.get('start_no', [None])[0]
+        end_no = params.get('end_no', [None])[0]
+        shards = params.get('shards', [None])[0]
         total_screenshots = params.get('total_screenshots', [None])[0]
+        job_id = params.get('job_id', [None])[0]
         # Execute the `main` function asynchronously
         try:
-            response_message = asyncio.run(
-                self.execute_main(submission_id, assignment_id, user_id, total_screenshots)
-            )
-            status_code = 200  # Success
+            if url.path.rstrip('/').endswith('/status'):
+                # Progress of a job started earlier
+                response_message = job_status(job_id) if job_id else None
+                if response_message is None:
+                    response_message = {"status": "error", "message": f"Unknown job_id: {job_id}"}
+                    status_code = 404
+                else:
+                    status_code = 200
+            elif job_id and params.get('run'):
+                # Worker invocation running one slice of a queued job
+                response_message = run_job_invocation(job_id)
+                status_code = 200
+            elif start_no and end_no:
+                # Worker invocation for one shard of a fanned-out submission
+                from helper.entry import analyze_shard
+
+                response_message = run(analyze_shard(submission_id, start_no, end_no))
+                status_code = 200
+            elif params.get('sync'):
+                # Old behaviour, holds the connection until the analysis is done
+                response_message = run(
+                    self.execute_main(submission_id, assignment_id, user_id, total_screenshots, shards)
+                )
+                status_code = 200  # Success
+            else:
+                # Enqueue the analysis and answer right away
+                job = create_job(submission_id, assignment_id, user_id, total_screenshots, shards)
+                dispatch_job(job)
+                response_message = {
+                    "status": "accepted",
+                    "job_id": job["job_id"],
+                    "status_url": f"/status?job_id={job['job_id']}",
+                }
+                status_code = 202  # Accepted
         except Exception as e:
             response_message = {"status": "error", "message": f"Error occurred: {str(e)}"}
             status_code = 500  # Internal Server Error
@@ -34,13 +67,22 @@ class handler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json.dumps(response_message).encode("utf-8"))
 
-    async def execute_main(self, submission_id, assignment_id, user_id, total_screenshots):
+    async def execute_main(self, submission_id, assignment_id, user_id, total_screenshots, shards=None):
         """
         Executes the `main` function from temp.py and returns a response message.
+        With `shards`, the submission is split across parallel worker invocations instead.
         """
+        from helper.entry import main, coordinate_submission
+
         try:
             # Call the main function with the necessary parameters
-            await main(submission_id, assignment_id, user_id, total_screenshots)
-            return {"status": "success", "message": "Main function executed successfully."}
+            if shards:
+                result = await coordinate_submission(submission_id, assignment_id, user_id, total_screenshots, shards)
+            else:
+                result = await main(submission_id, assignment_id, user_id, total_screenshots)
+            if result["status"] == "partial":
+                # Out of time for this invocation, calling again resumes from the checkpoint
+                return {"message": "Progress checkpointed, call again with the same submission_id to resume.", **result}
+            return {**result, "status": "success", "message": "Main function executed successfully."}
         except Exception as e:
             raise Exception(f"Main function execution failed: {str(e)}")
@@ -0,0 +1,139 @@
+import os
+import json
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Tuple, TYPE_CHECKING
+from helper.clients import get_openai_client
+from helper.log import get_logger
+
+# The SDK is imported on first use by helper.clients
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+logger = get_logger(__name__)
+
+# Where request files are written before they are uploaded
+BATCH_DIR = os.getenv("BATCH_DIR", "/tmp/batches")
+# Limits of a single Batch API input file
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "50000"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(190 * 1024 * 1024)))
+BATCH_COMPLETION_WINDOW = os.getenv("BATCH_COMPLETION_WINDOW", "24h")
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "30"))
+# Points the batch client at scripts/fake_batch_server.py for offline runs
+OPENAI_BATCH_BASE_URL = os.getenv("OPENAI_BATCH_BASE_URL")
+
+CHAT_COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def open_batch_client(api_key: str) -> "AsyncOpenAI":
+    return get_openai_client(api_key, base_url=OPENAI_BATCH_BASE_URL, max_retries=2)
+
+
+class BatchFileWriter:
+    """
+    Writes chat completion requests as Batch API JSONL input files, starting a
+    new part whenever the next request would exceed the request or size limit.
+    """
+
+    def __init__(self, name: str, directory: str = BATCH_DIR,
+                 max_requests: int = BATCH_MAX_REQUESTS, max_bytes: int = BATCH_MAX_BYTES):
+        self.name = name
+        self.directory = directory
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.paths: List[str] = []
+        self.requests = 0
+        self._file = None
+        self._part_requests = 0
+        self._part_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _start_part(self):
+        self.close()
+        path = os.path.join(self.directory, f"{self.name}.{len(self.paths):03d}.jsonl")
+        self._file = open(path, "wb")
+        self.paths.append(path)
+        self._part_requests = 0
+        self._part_bytes = 0
+
+    def add(self, custom_id: str, body: Dict):
+        line = json.dumps(
+            {"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_ENDPOINT, "body": body},
+            separators=(",", ":"),
+        ).encode("utf-8") + b"\n"
+        if (
+            self._file is None
+            or self._part_requests >= self.max_requests
+            or self._part_bytes + len(line) > self.max_bytes
+        ):
+            self._start_part()
+        self._file.write(line)
+        self._part_requests += 1
+        self._part_bytes += len(line)
+        self.requests += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+async def submit_batch_files(client: "AsyncOpenAI", paths: List[str], metadata: Dict = None) -> List[str]:
+    """Upload input files and create one batch per file, returns the batch ids"""
+    batch_ids = []
+    for path in paths:
+        with open(path, "rb") as f:
+            input_file = await client.files.create(file=f, purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=CHAT_COMPLETIONS_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+            metadata=metadata,
+        )
+        logger.info("Submitted batch", path=path, batch_id=batch.id)
+        batch_ids.append(batch.id)
+    return batch_ids
+
+
+async def poll_batches(client: "AsyncOpenAI", batch_ids: List[str], poll_interval: float = BATCH_POLL_INTERVAL,
+                       timeout: Optional[float] = None) -> Tuple[List, bool]:
+    """
+    Poll until every batch reached a terminal status or `timeout` seconds passed.
+    Returns the latest batch objects and whether all of them are finished.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    while True:
+        batches = await asyncio.gather(*(client.batches.retrieve(batch_id) for batch_id in batch_ids))
+        finished = all(batch.status in TERMINAL_STATUSES for batch in batches)
+        logger.info("Batch status", batches={batch.id: batch.status for batch in batches})
+        if finished or (deadline is not None and loop.time() + poll_interval > deadline):
+            return batches, finished
+        await asyncio.sleep(poll_interval)
+
+
+async def iter_batch_results(client: "AsyncOpenAI", batch) -> AsyncIterator[Tuple[str, Optional[Dict], Optional[str]]]:
+    """
+    Yield (custom_id, response body, error) for every request of a finished batch.
+    Requests that failed have no body and an error message.
+    """
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        content = await client.files.content(file_id)
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                error = record.get("error") or response.get("body", {}).get("error") or "request failed"
+                yield record["custom_id"], None, json.dumps(error) if not isinstance(error, str) else error
+            else:
+                yield record["custom_id"], response["body"], None
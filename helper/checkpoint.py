@@ -0,0 +1,255 @@
+import os
+import json
+from datetime import datetime
+from typing import Dict, List, Optional
+from helper.clients import get_boto3_client
+from helper.log import get_logger
+from helper import profiler
+
+logger = get_logger(__name__)
+
+# "local" keeps checkpoints in /tmp, "s3" survives moving to another function instance
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "local")
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "/tmp/checkpoints")
+CHECKPOINT_BUCKET = os.getenv("CHECKPOINT_BUCKET") or os.getenv("BUCKET_NAME")
+CHECKPOINT_PREFIX = os.getenv("CHECKPOINT_PREFIX", "checkpoints")
+# Lets the S3 store point at MinIO or a moto server for local testing
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+# Save progress every CHECKPOINT_EVERY persisted frames
+CHECKPOINT_EVERY = int(os.getenv("CHECKPOINT_EVERY", "50"))
+
+# Pipeline phases in execution order. Prompt merging and the app actions summary run
+# concurrently, so "prompt_merge" covers both until their outputs are in checkpoint["artifacts"].
+PHASES = ["frames", "timeline_analysis", "prompt_merge", "upload", "done"]
+
+
+def new_checkpoint(submission_id: str, results_file: str) -> Dict:
+    return {
+        "submission_id": submission_id,
+        "phase": PHASES[0],
+        "frames_done": 0,
+        "deduplicated_frames": 0,
+        "processing_time": 0.0,
+        "preprocessing": {},
+        "results_file": results_file,
+        "artifacts": {},
+        "profile": {},
+        "memory": {},
+        "run_counters": {},
+        "updated_at": datetime.now().isoformat(),
+    }
+
+
+def phase_reached(checkpoint: Dict, phase: str) -> bool:
+    """True once the checkpoint is at or past `phase`"""
+    return PHASES.index(checkpoint["phase"]) >= PHASES.index(phase)
+
+
+class LocalCheckpointStore:
+    """Checkpoints as JSON files next to the partial results in /tmp"""
+
+    def __init__(self, directory: str = CHECKPOINT_DIR):
+        self.directory = directory
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    def location(self, submission_id: str) -> str:
+        return self._path(submission_id)
+
+    def results_location(self, submission_id: str, results_file: str) -> str:
+        return results_file
+
+    def load_document(self, name: str) -> Optional[Dict]:
+        try:
+            with open(self._path(name), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save_document(self, name: str, document: Dict):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(document, f)
+        os.replace(tmp_path, path)  # Atomic, a crash never leaves a half-written document
+
+    def load(self, submission_id: str) -> Optional[Dict]:
+        return self.load_document(submission_id)
+
+    def save(self, checkpoint: Dict):
+        checkpoint["updated_at"] = datetime.now().isoformat()
+        self.save_document(checkpoint["submission_id"], checkpoint)
+
+    def save_results(self, submission_id: str, results_file: str):
+        pass  # Partial results already live on the local disk
+
+    def restore_results(self, submission_id: str, results_file: str) -> bool:
+        return os.path.exists(results_file)
+
+    def delete(self, submission_id: str):
+        if os.path.exists(self._path(submission_id)):
+            os.remove(self._path(submission_id))
+
+
+class S3CheckpointStore:
+    """
+    Checkpoints and a copy of the partial results log under an S3 prefix.
+
+    The results log only grows, so it is copied as numbered segments holding
+    the lines appended since the previous save, and restored by concatenating
+    them. A log replaced by a new file (adaptive sampling swaps in its
+    timeline, the coordinator writes the merged shards) is copied again from
+    its start.
+    """
+
+    def __init__(self, bucket_name: str = CHECKPOINT_BUCKET, prefix: str = CHECKPOINT_PREFIX, endpoint_url: str = S3_ENDPOINT_URL):
+        self.bucket_name = bucket_name
+        self.prefix = prefix.rstrip("/")
+        self.s3_client = get_boto3_client('s3', endpoint_url=endpoint_url)
+        # Per submission: inode of the local log, bytes of it already in S3 and the number of segments
+        self._uploaded: Dict[str, Dict] = {}
+
+    def _key(self, submission_id, name):
+        return f"{self.prefix}/{submission_id}/{name}"
+
+    def location(self, submission_id: str) -> str:
+        return f"s3://{self.bucket_name}/{self._key(submission_id, 'checkpoint.json')}"
+
+    def results_location(self, submission_id: str, results_file: str) -> str:
+        return f"s3://{self.bucket_name}/{self._key(submission_id, 'results/')}"
+
+    def _segment_key(self, submission_id: str, segment: int) -> str:
+        return self._key(submission_id, f"results/{segment:06d}.ndjson")
+
+    def _segment_keys(self, submission_id: str) -> List[str]:
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        keys = []
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self._key(submission_id, "results/")):
+            keys.extend(item["Key"] for item in page.get("Contents", []))
+        return sorted(keys)
+
+    def _delete_results(self, submission_id: str):
+        # results.ndjson is the single-object copy older versions uploaded
+        for key in self._segment_keys(submission_id) + [self._key(submission_id, "results.ndjson")]:
+            self.s3_client.delete_object(Bucket=self.bucket_name, Key=key)
+
+    def load_document(self, name: str) -> Optional[Dict]:
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self._key(name, "checkpoint.json"))
+            return json.loads(response['Body'].read())
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                logger.warning("Could not load checkpoint", name=name, error=str(e))
+            return None
+
+    def save_document(self, name: str, document: Dict):
+        self.s3_client.put_object(
+            Bucket=self.bucket_name,
+            Key=self._key(name, "checkpoint.json"),
+            Body=json.dumps(document).encode("utf-8"),
+            ContentType="application/json",
+        )
+
+    def load(self, submission_id: str) -> Optional[Dict]:
+        return self.load_document(submission_id)
+
+    def save(self, checkpoint: Dict):
+        checkpoint["updated_at"] = datetime.now().isoformat()
+        self.save_document(checkpoint["submission_id"], checkpoint)
+
+    def save_results(self, submission_id: str, results_file: str):
+        """Upload the lines appended to the results log since the last save as the next segment"""
+        try:
+            stat = os.stat(results_file)
+        except FileNotFoundError:
+            return
+        uploaded = self._uploaded.get(submission_id)
+        if uploaded is None or uploaded["inode"] != stat.st_ino or stat.st_size < uploaded["offset"]:
+            # Not written by this process or replaced since, start the copy over
+            self._delete_results(submission_id)
+            uploaded = {"inode": stat.st_ino, "offset": 0, "segments": 0}
+            self._uploaded[submission_id] = uploaded
+        with open(results_file, 'rb') as f:
+            f.seek(uploaded["offset"])
+            data = f.read(stat.st_size - uploaded["offset"])
+        # A line may be half written while the log is appended to, it goes with the next segment
+        data = data[:data.rfind(b"\n") + 1]
+        if not data:
+            return
+        self.s3_client.put_object(
+            Bucket=self.bucket_name, Key=self._segment_key(submission_id, uploaded["segments"]), Body=data,
+            ContentType="application/x-ndjson",
+        )
+        uploaded["offset"] += len(data)
+        uploaded["segments"] += 1
+        profiler.count("checkpoint.results_bytes", len(data))
+
+    def restore_results(self, submission_id: str, results_file: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        if os.path.exists(results_file):
+            return True
+        keys = self._segment_keys(submission_id) or [self._key(submission_id, "results.ndjson")]
+        os.makedirs(os.path.dirname(results_file), exist_ok=True)
+        tmp_path = f"{results_file}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                for key in keys:
+                    f.write(self.s3_client.get_object(Bucket=self.bucket_name, Key=key)['Body'].read())
+        except ClientError:
+            os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, results_file)
+        stat = os.stat(results_file)
+        if keys[0].endswith("/results.ndjson"):
+            self._uploaded.pop(submission_id, None)  # Copied as segments on the next save
+        else:
+            self._uploaded[submission_id] = {"inode": stat.st_ino, "offset": stat.st_size, "segments": len(keys)}
+        logger.info("Restored partial results", submission_id=submission_id, results_file=results_file, segments=len(keys))
+        return True
+
+    def delete(self, submission_id: str):
+        self._delete_results(submission_id)
+        self._uploaded.pop(submission_id, None)
+        self.s3_client.delete_object(Bucket=self.bucket_name, Key=self._key(submission_id, "checkpoint.json"))
+
+
+_checkpoint_store = None
+
+
+def get_checkpoint_store():
+    """Returns the process-wide checkpoint store for the configured backend"""
+    global _checkpoint_store
+    if _checkpoint_store is None:
+        if CHECKPOINT_BACKEND == "s3" and CHECKPOINT_BUCKET:
+            _checkpoint_store = S3CheckpointStore()
+        else:
+            _checkpoint_store = LocalCheckpointStore()
+    return _checkpoint_store
+
+
+def require_shared_checkpoints(purpose: str):
+    """Fail unless checkpoints live in S3, where every function instance sees them"""
+    if not isinstance(get_checkpoint_store(), S3CheckpointStore):
+        raise ValueError(
+            f"CHECKPOINT_BACKEND=s3 and CHECKPOINT_BUCKET (or BUCKET_NAME) are required {purpose}: "
+            "invocations land on other instances, which cannot see checkpoints in /tmp."
+        )
+
+
+def save_progress(store, checkpoint: Dict):
+    """Persist the checkpoint together with the partial results it points at"""
+    with profiler.span("checkpoint.save"):
+        store.save_results(checkpoint["submission_id"], checkpoint["results_file"])
+        store.save(checkpoint)
+
+
+def advance(store, checkpoint: Dict, phase: str):
+    """Record that every phase before `phase` is complete"""
+    checkpoint["phase"] = phase
+    store.save(checkpoint)
+    logger.info("Checkpoint reached phase", checkpoint=checkpoint["submission_id"], phase=phase)
@@ -0,0 +1,211 @@
+import os
+import ssl
+import atexit
+import asyncio
+import threading
+import contextlib
+from typing import Dict, Optional, TYPE_CHECKING
+from helper.log import get_logger
+
+# The SDKs take most of a cold start to import, they are loaded on first use
+if TYPE_CHECKING:
+    import aioboto3
+    from botocore.config import Config
+    from openai import AsyncOpenAI
+
+logger = get_logger(__name__)
+
+# OpenAI connection pool, sized for the vision fan-out plus the timeline calls
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "64"))
+# Idle connections are dropped before the server's own idle timeout would close them
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "600"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+# Default S3 connection pool per client, callers can ask for a bigger one
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", "5"))
+
+# Long-lived event loop that run() executes coroutines on
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+# Async clients per event loop, their connections cannot move to another loop
+_loop_clients: Dict[asyncio.AbstractEventLoop, "_LoopClients"] = {}
+
+# Loop-independent state, rebuilt after a fork
+_shared = {"pid": None, "ssl_context": None, "aioboto3_session": None, "boto3_session": None, "boto3_clients": {}}
+_shared_lock = threading.Lock()
+
+
+class _LoopClients:
+    def __init__(self):
+        self.clients = {}
+        self.stack = contextlib.AsyncExitStack()
+
+
+def _shared_state() -> Dict:
+    if _shared["pid"] != os.getpid():
+        _shared.update(pid=os.getpid(), ssl_context=None, aioboto3_session=None, boto3_session=None, boto3_clients={})
+    return _shared
+
+
+def _ssl_context() -> ssl.SSLContext:
+    """Loading the CA bundle is the slow part of a new HTTPS client, so it is done once"""
+    import certifi
+
+    with _shared_lock:
+        shared = _shared_state()
+        if shared["ssl_context"] is None:
+            shared["ssl_context"] = ssl.create_default_context(cafile=certifi.where())
+        return shared["ssl_context"]
+
+
+def _aioboto3_session() -> "aioboto3.Session":
+    # The session caches service models and credentials for every client created from it
+    import aioboto3
+
+    with _shared_lock:
+        shared = _shared_state()
+        if shared["aioboto3_session"] is None:
+            shared["aioboto3_session"] = aioboto3.Session()
+        return shared["aioboto3_session"]
+
+
+def _s3_config(max_pool_connections: int, max_attempts: Optional[int] = None) -> "Config":
+    from botocore.config import Config
+
+    options = {"max_pool_connections": max_pool_connections, "tcp_keepalive": True, "connect_timeout": S3_CONNECT_TIMEOUT}
+    if max_attempts is not None:
+        options["retries"] = {"max_attempts": max_attempts}
+    return Config(**options)
+
+
+def _registry() -> _LoopClients:
+    loop = asyncio.get_running_loop()
+    # Forget loops that asyncio.run() already closed, their clients hold references to them
+    for closed in [other for other in _loop_clients if other.is_closed()]:
+        del _loop_clients[closed]
+    if loop not in _loop_clients:
+        _loop_clients[loop] = _LoopClients()
+    return _loop_clients[loop]
+
+
+def get_openai_client(api_key: str = None, base_url: str = None, max_retries: int = 0) -> "AsyncOpenAI":
+    """
+    Pooled AsyncOpenAI client for the running event loop. Retries default to 0
+    because the rate limiter retries 429s and transient errors itself.
+    """
+    # Limits and Timeout come from the HTTP package the SDK is built on (httpx or
+    # httpx2 depending on the version), objects of the other one fail every request
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DEFAULT_CONNECTION_LIMITS, Timeout
+
+    registry = _registry()
+    key = ("openai", api_key, base_url, max_retries)
+    client = registry.clients.get(key)
+    if client is None:
+        http_client = DefaultAsyncHttpxClient(
+            limits=type(DEFAULT_CONNECTION_LIMITS)(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+            ),
+            timeout=Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            verify=_ssl_context(),
+        )
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries, http_client=http_client)
+        registry.stack.push_async_callback(client.close)
+        registry.clients[key] = client
+    return client
+
+
+async def get_s3_client(max_pool_connections: int = S3_MAX_POOL_CONNECTIONS, max_attempts: int = None, **client_kwargs):
+    """
+    Pooled aioboto3 S3 client for the running event loop, opened on first use
+    and kept open until the loop's clients are closed.
+
+    :param max_pool_connections: Size of the connection pool.
+    :param max_attempts: botocore attempts per request, None keeps botocore's default.
+    :param client_kwargs: Passed to Session.client, e.g. region_name or endpoint_url.
+    """
+    registry = _registry()
+    key = ("s3", max_pool_connections, max_attempts, tuple(sorted(client_kwargs.items())))
+    if key not in registry.clients:
+        client = _aioboto3_session().client('s3', config=_s3_config(max_pool_connections, max_attempts), **client_kwargs)
+        # A task, so callers racing for the first client all wait for the same one
+        registry.clients[key] = asyncio.ensure_future(registry.stack.enter_async_context(client))
+    try:
+        return await asyncio.shield(registry.clients[key])
+    except Exception:
+        registry.clients.pop(key, None)
+        raise
+
+
+@contextlib.asynccontextmanager
+async def pooled_s3_client(**options):
+    """`async with` form of get_s3_client, the client stays open for the next caller"""
+    yield await get_s3_client(**options)
+
+
+def get_boto3_client(service: str = 's3', max_pool_connections: int = S3_MAX_POOL_CONNECTIONS, **client_kwargs):
+    """Process-wide boto3 client, these are thread-safe and not tied to an event loop"""
+    import boto3
+
+    key = (service, max_pool_connections, tuple(sorted(client_kwargs.items())))
+    with _shared_lock:
+        shared = _shared_state()
+        if key not in shared["boto3_clients"]:
+            if shared["boto3_session"] is None:
+                shared["boto3_session"] = boto3.session.Session()
+            shared["boto3_clients"][key] = shared["boto3_session"].client(
+                service, config=_s3_config(max_pool_connections), **client_kwargs
+            )
+        return shared["boto3_clients"][key]
+
+
+async def close_clients():
+    """Close the running loop's pooled clients"""
+    registry = _loop_clients.pop(asyncio.get_running_loop(), None)
+    if registry is not None:
+        await registry.stack.aclose()
+
+
+def _shared_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid() or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="shared-event-loop", daemon=True).start()
+            _loop, _loop_pid = loop, os.getpid()
+        return _loop
+
+
+def run(coro):
+    """
+    Run a coroutine to completion like asyncio.run(), but on one event loop
+    shared by every call in this process. Pooled clients belong to the loop
+    they were created on, so a fresh loop per request would throw away their
+    connections; on the shared loop they stay warm across requests and warm
+    invocations.
+    """
+    loop = _shared_loop()
+    if asyncio._get_running_loop() is loop:
+        raise RuntimeError("run() cannot be called from the shared event loop")
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
+
+
+@atexit.register
+def _shutdown():
+    if _loop is None or _loop_pid != os.getpid() or _loop.is_closed():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(close_clients(), _loop).result(timeout=5)
+    except Exception as e:
+        logger.warning("Could not close pooled clients", error=str(e))
+    _loop.call_soon_threadsafe(_loop.stop)
@@ -1,26 +1,125 @@
 import os
 import time
 import base64
-import boto3
 from time import sleep
 import asyncio
 import shutil
 import re
 import json
 from datetime import datetime, timezone, timedelta
-from typing import List, Dict
-from openai import AsyncOpenAI
+from typing import List, Dict, Optional, Tuple, TYPE_CHECKING
+from helper.batch_api import BatchFileWriter, open_batch_client, submit_batch_files, poll_batches, iter_batch_results
+from helper.clients import get_openai_client, get_boto3_client
+from helper.checkpoint import CHECKPOINT_EVERY, get_checkpoint_store, new_checkpoint, phase_reached, save_progress, advance
+from helper.log import get_logger, bind_log_context, log_context
+from helper import profiler
+from helper.frame_manifest import get_frame_manifest, select_frames
+from helper.memory_budget import FRAME_MEMORY_BUDGET, ByteBudget, add_memory_stats, frame_reservation, payload_size
+from helper.pipeline import run_pipeline, ordered_stage
+from helper.preprocess import hamming_distance, preprocess_frame, new_savings, add_savings, savings_report
+from helper.rate_limiter import get_rate_limiter
+from helper.results_log import ResultsLog, count_logged_frames, iter_results_log
+from helper.result_cache import ResultCache, get_result_cache, result_cache_key
+from helper.sampling import SAMPLING_STRIDE, adaptive_sample, settled_frames
+from helper.sharding import (
+    SHARD_DISPATCH, SHARD_POLL_INTERVAL, plan_shards, shard_id, shard_results_file,
+    publish_shard_results, reduce_shards, run_shards, continue_shard,
+)
+from helper.s3_fetcher import S3_FETCH_CONCURRENCY, open_s3_client, fetch_object, read_buffer
 from helper.timeline_analysis import main as timeline_analysis_main
 
+# The SDK is imported on first use by helper.clients
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+logger = get_logger(__name__)
+
+# Per-stage concurrency of the download -> encode -> analyze pipeline
+FETCH_CONCURRENCY = S3_FETCH_CONCURRENCY
+ENCODE_CONCURRENCY = int(os.getenv("ENCODE_CONCURRENCY", "4"))
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "60"))  # Ceiling, the rate limiter adapts below it
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "60"))
+
+# Near-duplicate frame detection, set DEDUP_MAX_DISTANCE=-1 to analyze every frame
+DEDUP_HASH_SIZE = int(os.getenv("DEDUP_HASH_SIZE", "16"))  # dHash grid, gives DEDUP_HASH_SIZE ** 2 bits
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "3"))  # Max Hamming distance to reuse a result
+
+# "dense" analyzes every frame, "adaptive" samples and bisects around activity changes
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "dense")
+
+# Stop taking new frames after this many seconds so progress is checkpointed before maxDuration (60 s)
+FUNCTION_TIME_BUDGET = float(os.getenv("FUNCTION_TIME_BUDGET", "40"))
+# maxDuration of the function in vercel.json, no invocation runs past it
+FUNCTION_MAX_DURATION = float(os.getenv("FUNCTION_MAX_DURATION", "60"))
+# Seconds the timeline phases need; with less left before FUNCTION_MAX_DURATION they wait for the next invocation
+TIMELINE_TIME_BUDGET = float(os.getenv("TIMELINE_TIME_BUDGET", "30"))
+
+VISION_MODEL = "gpt-4o"
+VISION_DETAIL = os.getenv("VISION_DETAIL", "high")  # "low" costs 85 tokens per frame but loses small text
+VISION_MAX_TOKENS = 1000
+# Tokens reserved against the per-minute budget per frame: prompt, high detail image and max_tokens
+VISION_TOKEN_ESTIMATE = int(os.getenv("VISION_TOKEN_ESTIMATE", "2700"))
+# Cascade: a cheap model / low detail pass first, VISION_MODEL at VISION_DETAIL only when that is not good enough
+VISION_CASCADE = os.getenv("VISION_CASCADE", "0") == "1"
+VISION_CHEAP_MODEL = os.getenv("VISION_CHEAP_MODEL", "gpt-4o-mini")
+VISION_CHEAP_DETAIL = os.getenv("VISION_CHEAP_DETAIL", "low")
+VISION_CHEAP_TOKEN_ESTIMATE = int(os.getenv("VISION_CHEAP_TOKEN_ESTIMATE", "1700"))
+VISION_MIN_CONFIDENCE = float(os.getenv("VISION_MIN_CONFIDENCE", "0.7"))
+# Copied prompts have to be exact, frames with these activities always get the full tier
+VISION_ESCALATE_ACTIVITIES = [
+    activity.strip()
+    for activity in os.getenv("VISION_ESCALATE_ACTIVITIES", "Interacting with AI Chatbot,AI Copilot in IDE,Google Search").split(",")
+    if activity.strip()
+]
+
+# Frames packed into one request, 1 sends every frame on its own
+VISION_BATCH_SIZE = int(os.getenv("VISION_BATCH_SIZE", "1"))
+# Seconds a partly filled batch waits for more frames before it is sent
+VISION_BATCH_LINGER = float(os.getenv("VISION_BATCH_LINGER", "0.2"))
+
+VISION_PROMPT = """Create an array of json object
+
+activity: <First, only look at the active window or active tab i.e. where the user's cursor or keyboard typing is active. which one of the following best describes the work user is doing on the active window. Pick any one of the following "Coding", "AI Copilot in IDE" (double check user must be in a code editor (native application), and not on any website that looks like code editor), "Reading Documentation" (must be an official documentation, make a guess based on url if url or page header looks like one for an official documentation), "Reading Web articles/documents" (for articles, blogs, PDFs or report on other webpages), "Reading Stackoverflow", "Watching video tutorial", "Interacting with AI Chatbot" (Select this if user is on an AI website like chatgpt, bolt.new, lovable.dev, claude, gemini, perplexity), "Testing" (select if user is running their code in command line or opening a website created by them for example on localhost, mstunnels, ngrok), "Creating Document" (word, excel, powerpoint), "Reading code in GitHub", "Google Search", "Other". You can pick only one category from double quotes, and do not make a category of your own.>
+open_windows: [
+{
+app: <Find out which app or web app the user is using>,
+action: <What is the user doing on  this app, answer based on what you see the contents of the app, include as many details as you can in 1 line>,
+prompt: <copy paste what user is asking the AI/Search engine to do. Only populate this field if you can see what the user has typed into a text box (and its not a textbox hint like "How can bolt help you today?" or "Edit code (Ctrl+I), @ to mention"). You should be 100% confident that for AI copilots in code editors,  Whatever you are copy pasting here must have been typed into a text box by a human (You know if it was written by human if it starts with small characters, improper grammar or punctuation use).>,
+},
+{...},
+{...}
+]
+
+If the user has multiple windows open with split screen, you can return one object for each window you see. If there's one primary window and others are in background you can skip returning details about the windows in background. Only return multiple when user is using split screen. Ignore the user webcam image overlays if any present."""
+# Appended to VISION_PROMPT for the cheap tier of the cascade
+VISION_CONFIDENCE_INSTRUCTIONS = """Also add a field "confidence": a number from 0 to 1 saying how sure you are about the activity and about any text you copied."""
+# Appended to VISION_PROMPT when several frames are sent in one request
+VISION_BATCH_INSTRUCTIONS = """You are given {count} screenshots, each one preceded by its label "Frame <n>". Analyze every screenshot on its own as described above. Return a JSON object {{"frames": [...]}} with exactly one entry per screenshot, where each entry is the object described above for that screenshot with an added field "frame": <n>."""
+
+VISION_TIERS = {
+    "cheap": {"model": VISION_CHEAP_MODEL, "detail": VISION_CHEAP_DETAIL, "estimated_tokens": VISION_CHEAP_TOKEN_ESTIMATE},
+    "full": {"model": VISION_MODEL, "detail": VISION_DETAIL, "estimated_tokens": VISION_TOKEN_ESTIMATE},
+}
+# Cascade results depend on both tiers and the threshold, so they are cached apart from plain results
+VISION_CACHE_MODEL = (
+    f"{VISION_CHEAP_MODEL}:{VISION_CHEAP_DETAIL}@{VISION_MIN_CONFIDENCE}>{VISION_MODEL}" if VISION_CASCADE else VISION_MODEL
+)
+# Process-wide, like the result cache counters. A batched request sends several frames.
+tier_stats = {
+    tier: {"requests": 0, "frames": 0, "accepted": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "escalations": {}}
+    for tier in VISION_TIERS
+}
+
+
 def delete_folder(folder_path):
     if os.path.exists(folder_path):
         try:
             shutil.rmtree(folder_path)  # Deletes the folder and all its contents
-            print(f"Successfully deleted folder: {folder_path}")
+            logger.debug("Deleted folder", path=folder_path)
         except Exception as e:
-            print(f"Error deleting folder {folder_path}: {e}")
+            logger.warning("Could not delete folder", path=folder_path, error=str(e))
     else:
-        print(f"Folder does not exist: {folder_path}")
+        logger.debug("Folder does not exist", path=folder_path)
 
 def extract_and_convert_to_local(filename, offset_hours, offset_minutes):
     # Define the regex pattern to match the date, time, and milliseconds
@@ -32,9 +131,12 @@ def extract_and_convert_to_local(filename, offset_hours, offset_minutes):
         year, month, day, hour, minute, second, millisecond = map(int, match.groups())
         
         # Create a datetime object in UTC, including milliseconds
-        utc_time = datetime(
-            year, month, day, hour, minute, second, millisecond * 1000, tzinfo=timezone.utc
-        )
+        try:
+            utc_time = datetime(
+                year, month, day, hour, minute, second, millisecond * 1000, tzinfo=timezone.utc
+            )
+        except ValueError:
+            return None  # 17 digits that are not a date
         
         # Convert to the local timezone
         local_offset = timedelta(hours=offset_hours, minutes=offset_minutes)
@@ -92,29 +194,25 @@ def download_images_from_s3(bucket_name: str, folder_path: str, prefix: str, sta
     :param s3_client: S3 client object (optional).
     """
     if s3_client is None:
-        s3_client = boto3.client('s3')  # Initialize the S3 client
+        s3_client = get_boto3_client('s3')
     
-    print(f"Fetching images from bucket: {bucket_name}, prefix: {prefix}")
+    logger.info("Fetching images", bucket=bucket_name, prefix=prefix)
     
+    # Every range is a slice of the cached, fully paginated manifest
     try:
-        # List objects in the bucket with the specified prefix
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
+        frames = get_frame_manifest(bucket_name, prefix, s3_client, expected=end_no)
     except Exception as e:
-        print(f"Error listing objects: {e}")
+        logger.error("Could not list objects", bucket=bucket_name, prefix=prefix, error=str(e))
         return
 
-    if 'Contents' not in response:
-        print(f"No files found with prefix {prefix} in bucket {bucket_name}")
+    if not frames:
+        logger.warning("No files found", bucket=bucket_name, prefix=prefix)
         return
 
-    # Filter only .jpg files and sort by key
-    images = [item['Key'] for item in response['Contents'] if item['Key'].endswith('.jpg') and item['Key'].startswith(prefix)]
-    images.sort()  # Ensure the sequence is consistent with S3 order
-
     # Select the range of images to download
-    selected_images = images[start_no - 1:end_no]  # 1-based index adjustment
+    selected_images = [frame["key"] for frame in select_frames(frames, start_no, end_no)]
     if not selected_images:
-        print(f"No images found in the specified range ({start_no} to {end_no}).")
+        logger.warning("No images found in the range", start_no=start_no, end_no=end_no)
         return
 
     os.makedirs(folder_path, exist_ok=True)
@@ -123,15 +221,96 @@ def download_images_from_s3(bucket_name: str, folder_path: str, prefix: str, sta
         file_name = os.path.join(folder_path, os.path.basename(file_key))
         try:
             s3_client.download_file(bucket_name, file_key, file_name)
-            print(f"Downloaded: {file_name}")
+            logger.debug("Downloaded", path=file_name, sample="download")
         except Exception as e:
-            print(f"Error downloading {file_key}: {e}")
+            logger.warning("Could not download frame", key=file_key, error=str(e), sample="download_error")
+
+
+def encode_bytes(data: bytes) -> str:
+    """Convert raw image bytes to base64 string"""
+    return base64.b64encode(data).decode('utf-8')
 
 
 def encode_image(image_path: str) -> str:
     """Convert image to base64 string"""
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+        return encode_bytes(image_file.read())
+
+
+def make_dedup_stage(max_distance: int = DEDUP_MAX_DISTANCE, budget: ByteBudget = None):
+    """
+    Builds a pipeline stage that marks frames as duplicates of the previously
+    analyzed frame when their hashes are within `max_distance` bits.
+    The memory `budget` reserved for a duplicate is released right away.
+
+    Frames are decided strictly in frame order. Must run with a concurrency of 1.
+    """
+    state = {"anchor_index": None, "anchor_hash": None}
+
+    def dedup(frame):
+        frame_hash = frame.pop("hash", None)
+        if "error" in frame or frame_hash is None:
+            return frame
+        if (
+            max_distance >= 0
+            and state["anchor_hash"] is not None
+            and hamming_distance(frame_hash, state["anchor_hash"]) <= max_distance
+        ):
+            frame.pop("base64_image", None)  # Not needed anymore, free it early
+            if budget is not None:
+                budget.release(frame.pop("reserved", 0))
+            frame["duplicate_of"] = state["anchor_index"]
+        else:
+            frame["anchor"] = True
+            state["anchor_index"] = frame["index"]
+            state["anchor_hash"] = frame_hash
+        return frame
+
+    return ordered_stage(dedup)
+
+
+def make_persist_stage(results_log: ResultsLog, stats: Dict, on_progress=None):
+    """
+    Builds the final pipeline stage, which appends every result to the results
+    log in frame order as soon as all earlier frames are done.
+
+    Frames skipped by the dedup stage are filled in here with the analysis of
+    their anchor, which is always the latest anchor written before them.
+    Preprocessing savings of analyzed frames are added to stats["preprocessing"].
+    `on_progress` is awaited every CHECKPOINT_EVERY frames.
+    Must run with a concurrency of 1.
+    """
+    state = {"anchor": {}}
+
+    async def persist(result):
+        preprocessing = result.pop("preprocessing", None)
+        if preprocessing is not None:
+            add_savings(stats["preprocessing"], preprocessing)
+        if result.pop("anchor", False):
+            state["anchor"] = result
+        anchor_index = result.pop("duplicate_of", None)
+        if anchor_index is not None:
+            for field in ("analysis", "error"):
+                if field in state["anchor"]:
+                    result[field] = state["anchor"][field]
+            result["deduplicated"] = True
+            stats["deduplicated_frames"] += 1
+        result.pop("index")
+        started = result.pop("started", None)
+        with profiler.span("persist"):
+            results_log.append_frame(result)
+        stats["frames"] += 1
+        profiler.count("frames.persisted")
+        if "error" in result:
+            profiler.count("frames.failed")
+        if started is not None:
+            # From download to persisted, including the wait for earlier frames
+            profiler.record("frame", time.perf_counter() - started)
+        if on_progress is not None and stats["frames"] % CHECKPOINT_EVERY == 0:
+            await on_progress()
+        return None
+
+    return ordered_stage(persist)
 
 
 def extract_time_from_filename(filename: str) -> str:
@@ -144,76 +323,210 @@ def extract_time_from_filename(filename: str) -> str:
     return None
 
 
+def vision_request_body(base64_image: str, tier: str = "full", prompt: str = VISION_PROMPT) -> Dict:
+    """Chat completion parameters analyzing one frame with the model and detail of `tier`"""
+    config = VISION_TIERS[tier]
+    return {
+        "model": config["model"],
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{base64_image}",
+                            "detail": config["detail"],
+                        }
+                    }
+                ]
+            }
+        ],
+        "max_tokens": VISION_MAX_TOKENS,
+        "temperature": 0,
+    }
+
+
+async def request_analysis(client: "AsyncOpenAI", base64_image: str, tier: str, prompt: str = VISION_PROMPT) -> str:
+    """One vision request for a frame with the model and detail of `tier`, returns the message content"""
+    config = VISION_TIERS[tier]
+    start_time = time.time()
+    # Throttled requests wait in the limiter and are sent again instead of failing the frame
+    response = await get_rate_limiter(config["model"]).call(
+        lambda: client.chat.completions.with_raw_response.create(**vision_request_body(base64_image, tier, prompt)),
+        estimated_tokens=config["estimated_tokens"],
+    )
+
+    count_tier_request(tier, 1, time.time() - start_time, response.usage)
+    return response.choices[0].message.content
+
+
+def count_tier_request(tier: str, frames: int, seconds: float, usage):
+    stats = tier_stats[tier]
+    stats["requests"] += 1
+    stats["frames"] += frames
+    stats["seconds"] += seconds
+    if usage is not None:
+        stats["prompt_tokens"] += usage.prompt_tokens
+        stats["completion_tokens"] += usage.completion_tokens
+
+
+def escalation_reason(content: str) -> Optional[str]:
+    """Why a cheap-tier answer has to be redone with the full configuration, None if it can be kept"""
+    try:
+        analysis = json.loads(content)
+    except (TypeError, ValueError):
+        return "unparseable"
+    if not isinstance(analysis, dict) or "activity" not in analysis or not isinstance(analysis.get("open_windows"), list):
+        return "unparseable"
+    confidence = analysis.get("confidence")
+    if not isinstance(confidence, (int, float)) or confidence < VISION_MIN_CONFIDENCE:
+        return "low_confidence"
+    if analysis["activity"] in VISION_ESCALATE_ACTIVITIES or any(
+        isinstance(window, dict) and window.get("prompt") for window in analysis["open_windows"]
+    ):
+        return "prompt_activity"
+    return None
+
+
+async def analyze_with_cascade(client: "AsyncOpenAI", base64_image: str) -> Tuple[str, str]:
+    """
+    Analysis of one frame and the tier that produced it. With VISION_CASCADE the
+    cheap tier answers first and the full tier only runs when escalation_reason
+    rejects the cheap answer.
+    """
+    if not VISION_CASCADE:
+        analysis = await request_analysis(client, base64_image, "full")
+        tier_stats["full"]["accepted"] += 1
+        return analysis, "full"
+
+    content = await request_analysis(client, base64_image, "cheap", f"{VISION_PROMPT}\n\n{VISION_CONFIDENCE_INSTRUCTIONS}")
+    reason = escalation_reason(content)
+    if reason is None:
+        return accept_cheap(content), "cheap"
+
+    count_escalation(reason)
+    analysis = await request_analysis(client, base64_image, "full")
+    tier_stats["full"]["accepted"] += 1
+    return analysis, "full"
+
+
+def accept_cheap(content: str) -> str:
+    """A cheap-tier answer escalation_reason kept, in the stored format of both tiers"""
+    tier_stats["cheap"]["accepted"] += 1
+    analysis = json.loads(content)
+    analysis.pop("confidence", None)
+    return json.dumps(analysis)
+
+
+def count_escalation(reason: str):
+    escalations = tier_stats["cheap"]["escalations"]
+    escalations[reason] = escalations.get(reason, 0) + 1
+
+
+def tier_report(counts: Dict = None) -> Dict:
+    """Per-tier requests, frames, acceptance rate, mean latency and tokens, of `counts` or since the process started"""
+    report = {}
+    for tier, stats in (counts if counts is not None else tier_stats).items():
+        report[tier] = {
+            **stats,
+            "model": VISION_TIERS[tier]["model"],
+            "detail": VISION_TIERS[tier]["detail"],
+            "hit_rate": round(stats["accepted"] / stats["frames"], 3) if stats.get("frames") else 0.0,
+            "mean_seconds": round(stats["seconds"] / stats["requests"], 3) if stats["requests"] else 0.0,
+            "seconds": round(stats["seconds"], 2),
+        }
+    return report
+
+
+def run_counters() -> Dict:
+    """
+    Current values of the process-wide counters of the result cache, the vision
+    rate limiter and the vision tiers. A warm instance keeps them across
+    submissions, so runs report the count_difference of two snapshots.
+    """
+    result_cache = get_result_cache()
+    limiter_stats = get_rate_limiter(VISION_MODEL).stats
+    return json.loads(json.dumps({
+        "result_cache": {"hits": result_cache.hits, "misses": result_cache.misses},
+        "rate_limiter": {key: value for key, value in limiter_stats.items() if key not in ("max_limit", "min_limit")},
+        "vision_tiers": tier_stats,
+    }))
+
+
+def count_difference(end: Dict, start: Dict) -> Dict:
+    """What nested counters counted between two run_counters() snapshots"""
+    return {
+        key: count_difference(value, start.get(key, {})) if isinstance(value, dict) else value - start.get(key, 0)
+        for key, value in end.items()
+    }
+
+
+def add_counts(totals: Dict, counts: Dict) -> Dict:
+    """Nested counters over several invocations"""
+    return {
+        **totals,
+        **{
+            key: add_counts(totals.get(key, {}), value) if isinstance(value, dict) else totals.get(key, 0) + value
+            for key, value in counts.items()
+        },
+    }
+
+
 async def analyze_single_image(
-        client: AsyncOpenAI,
+        client: "AsyncOpenAI",
         image_path: str,
         image_file: str,
         semaphore: asyncio.Semaphore,
         delay=0,
+        base64_image: str = None,
+        result_cache: ResultCache = None,
 ) -> Dict:
-    """Analyze a single image using OpenAI API with rate limiting"""
+    """
+    Analyze a single image using OpenAI API with rate limiting.
+    The image is read from `image_path` unless it is already passed in as `base64_image`.
+    Results are looked up in and stored to the shared result cache.
+    """
     #sleep(delay)
     await asyncio.sleep(delay)
 
+    if result_cache is None:
+        result_cache = get_result_cache()
+
     async with semaphore:  # Control concurrent requests
         try:
             time_from_start = extract_and_convert_to_local(image_file, 5, 30)
-            print("1")
-            base64_image = encode_image(image_path)
-            print("2")
-            print(f"Analyzing image: {image_file} at {image_path}")
-            response = await client.chat.completions.create(
-                model="gpt-4o",
-                response_format={"type": "json_object"},
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": """Create an array of json object
+            if base64_image is None:
+                base64_image = encode_image(image_path)
+            # A frame analyzed before with the same prompt and settings costs nothing
+            cache_key = result_cache_key(base64_image, VISION_PROMPT, VISION_CACHE_MODEL, VISION_DETAIL)
+            cached_analysis = await result_cache.get(cache_key)
+            if cached_analysis is not None:
+                return {
+                    "time_from_start": time_from_start,
+                    "analysis": cached_analysis,
+                }
+            analysis, tier = await analyze_with_cascade(client, base64_image)
+            await result_cache.set(cache_key, analysis)
+            logger.debug("Analyzed frame", image_file=image_file, tier=tier, analysis=analysis, sample="frame_analyzed")
 
-activity: <First, only look at the active window or active tab i.e. where the user's cursor or keyboard typing is active. which one of the following best describes the work user is doing on the active window. Pick any one of the following "Coding", "AI Copilot in IDE" (double check user must be in a code editor (native application), and not on any website that looks like code editor), "Reading Documentation" (must be an official documentation, make a guess based on url if url or page header looks like one for an official documentation), "Reading Web articles/documents" (for articles, blogs, PDFs or report on other webpages), "Reading Stackoverflow", "Watching video tutorial", "Interacting with AI Chatbot" (Select this if user is on an AI website like chatgpt, bolt.new, lovable.dev, claude, gemini, perplexity), "Testing" (select if user is running their code in command line or opening a website created by them for example on localhost, mstunnels, ngrok), "Creating Document" (word, excel, powerpoint), "Reading code in GitHub", "Google Search", "Other". You can pick only one category from double quotes, and do not make a category of your own.>
-open_windows: [
-{
-app: <Find out which app or web app the user is using>,
-action: <What is the user doing on  this app, answer based on what you see the contents of the app, include as many details as you can in 1 line>,
-prompt: <copy paste what user is asking the AI/Search engine to do. Only populate this field if you can see what the user has typed into a text box (and its not a textbox hint like "How can bolt help you today?" or "Edit code (Ctrl+I), @ to mention"). You should be 100% confident that for AI copilots in code editors,  Whatever you are copy pasting here must have been typed into a text box by a human (You know if it was written by human if it starts with small characters, improper grammar or punctuation use).>,
-},
-{...},
-{...}
-]
-
-If the user has multiple windows open with split screen, you can return one object for each window you see. If there's one primary window and others are in background you can skip returning details about the windows in background. Only return multiple when user is using split screen. Ignore the user webcam image overlays if any present."""
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}",
-                                    "detail": "high",
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=1000,
-                temperature=0
-            )
-            print("3")
-            analysis = response.choices[0].message.content
-            print("4")
-            print(time_from_start, analysis)
-            print("5")
-
-            return {
+            result = {
                 "time_from_start": time_from_start,
                 "analysis": analysis,
             }
+            if VISION_CASCADE:
+                result["tier"] = tier
+            return result
 
             
 
         except Exception as e:
-            print(f"Error processing {image_file}: {str(e)}")
+            logger.warning("Could not analyze frame", image_file=image_file, error=str(e), sample="frame_error")
             return {
                 "time_from_start": time_from_start,
                 "filename": image_file,
@@ -222,6 +535,226 @@ If the user has multiple windows open with split screen, you can return one obje
             }
 
 
+def parse_batch_analysis(content: str, count: int) -> Dict[int, str]:
+    """
+    Per-frame analyses of a batched response, keyed by frame number.
+    Frames that are missing, duplicated or malformed are left out.
+    """
+    data = json.loads(content)
+    entries = data.get("frames", []) if isinstance(data, dict) else data
+    analyses = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        frame = entry.pop("frame", None)
+        if (
+            isinstance(frame, int)
+            and 0 <= frame < count
+            and frame not in analyses
+            and "activity" in entry
+            and isinstance(entry.get("open_windows"), list)
+        ):
+            analyses[frame] = json.dumps(entry)
+    return analyses
+
+
+async def request_frame_batch(
+        client: "AsyncOpenAI", base64_images: List[str], semaphore: asyncio.Semaphore, tier: str = "full"
+) -> Dict[int, str]:
+    """Analyze several frames with one chat completion of `tier`, see parse_batch_analysis"""
+    config = VISION_TIERS[tier]
+    prompt = f"{VISION_PROMPT}\n\n{VISION_CONFIDENCE_INSTRUCTIONS}" if tier == "cheap" else VISION_PROMPT
+    content = [{"type": "text", "text": f"{prompt}\n\n{VISION_BATCH_INSTRUCTIONS.format(count=len(base64_images))}"}]
+    for frame, base64_image in enumerate(base64_images):
+        content.append({"type": "text", "text": f"Frame {frame}"})
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/jpeg;base64,{base64_image}",
+                "detail": config["detail"],
+            }
+        })
+    async with semaphore:
+        start_time = time.time()
+        response = await get_rate_limiter(config["model"]).call(lambda: client.chat.completions.with_raw_response.create(
+            model=config["model"],
+            response_format={"type": "json_object"},
+            messages=[{"role": "user", "content": content}],
+            max_tokens=VISION_MAX_TOKENS * len(base64_images),
+            temperature=0
+        ), estimated_tokens=config["estimated_tokens"] * len(base64_images))
+    count_tier_request(tier, len(base64_images), time.time() - start_time, response.usage)
+    return parse_batch_analysis(response.choices[0].message.content, len(base64_images))
+
+
+async def analyze_batch_with_cascade(
+        client: "AsyncOpenAI", base64_images: List[str], semaphore: asyncio.Semaphore
+) -> Dict[int, Tuple[str, str]]:
+    """
+    Batched analyze_with_cascade: analysis and tier of every frame the batched
+    response covers, keyed by frame number. With VISION_CASCADE the batch goes
+    to the cheap tier, and the frames escalation_reason rejects are sent again
+    to the full tier, batched when there are several.
+    """
+    if not VISION_CASCADE:
+        analyses = await request_frame_batch(client, base64_images, semaphore, "full")
+        tier_stats["full"]["accepted"] += len(analyses)
+        return {frame: (analysis, "full") for frame, analysis in analyses.items()}
+
+    results = {}
+    escalated = []
+    for frame, content in (await request_frame_batch(client, base64_images, semaphore, "cheap")).items():
+        reason = escalation_reason(content)
+        if reason is None:
+            results[frame] = (accept_cheap(content), "cheap")
+        else:
+            count_escalation(reason)
+            escalated.append(frame)
+
+    full = {}
+    if len(escalated) > 1:
+        try:
+            full = await request_frame_batch(client, [base64_images[frame] for frame in escalated], semaphore, "full")
+        except Exception as e:
+            logger.warning("Escalated batch failed, sending its frames one by one", frames=len(escalated), error=str(e))
+    for position, frame in enumerate(escalated):
+        analysis = full.get(position)
+        if analysis is None:
+            try:
+                async with semaphore:
+                    analysis = await request_analysis(client, base64_images[frame], "full")
+            except Exception as e:
+                # Left out, the caller analyzes it on its own
+                logger.warning("Could not analyze escalated frame", frame=frame, error=str(e), sample="frame_error")
+                continue
+        tier_stats["full"]["accepted"] += 1
+        results[frame] = (analysis, "full")
+    return results
+
+
+async def analyze_image_batch(
+        client: "AsyncOpenAI",
+        frames: List[Dict],
+        semaphore: asyncio.Semaphore,
+        result_cache: ResultCache = None,
+        stats: Dict = None,
+) -> List[Dict]:
+    """
+    Analyze frames ({"image_file", "base64_image"}) with a single request (per
+    cascade tier) and return one result per frame, in order. Cached frames are
+    not sent, and frames the batched response does not cover are analyzed one by one.
+    """
+    if result_cache is None:
+        result_cache = get_result_cache()
+    if stats is None:
+        stats = {}
+
+    results = [None] * len(frames)
+    pending = []
+    for position, frame in enumerate(frames):
+        time_from_start = extract_and_convert_to_local(frame["image_file"], 5, 30)
+        # Same key as analyze_single_image, so both paths (and the fallback below) share cached results
+        cache_key = result_cache_key(frame["base64_image"], VISION_PROMPT, VISION_CACHE_MODEL, VISION_DETAIL)
+        cached_analysis = await result_cache.get(cache_key)
+        if cached_analysis is not None:
+            results[position] = {"time_from_start": time_from_start, "analysis": cached_analysis}
+        else:
+            pending.append((position, time_from_start, cache_key))
+
+    if len(pending) > 1:
+        try:
+            analyses = await analyze_batch_with_cascade(client, [frames[p]["base64_image"] for p, _, _ in pending], semaphore)
+        except Exception as e:
+            logger.warning("Batch failed, analyzing its frames one by one", frames=len(pending), error=str(e))
+            analyses = {}
+        stats["batch_requests"] = stats.get("batch_requests", 0) + 1
+        for frame, (position, time_from_start, cache_key) in enumerate(pending):
+            if frame in analyses:
+                analysis, tier = analyses[frame]
+                await result_cache.set(cache_key, analysis)
+                results[position] = {"time_from_start": time_from_start, "analysis": analysis}
+                if VISION_CASCADE:
+                    results[position]["tier"] = tier
+
+    missing = [position for position, result in enumerate(results) if result is None]
+    stats["batched_frames"] = stats.get("batched_frames", 0) + len(pending) - len(missing)
+    stats["fallback_frames"] = stats.get("fallback_frames", 0) + len(missing)
+    singles = await asyncio.gather(*(
+        analyze_single_image(
+            client, None, frames[position]["image_file"], semaphore,
+            base64_image=frames[position]["base64_image"], result_cache=result_cache,
+        )
+        for position in missing
+    ))
+    for position, result in zip(missing, singles):
+        results[position] = result
+    return results
+
+
+class VisionBatcher:
+    """
+    Groups frames analyzed by concurrent callers into requests of up to
+    `batch_size` frames. A batch is sent once it is full or `linger` seconds
+    after its first frame arrived, whichever comes first.
+
+    Usage: ``result = await batcher.analyze(image_file, base64_image)``
+    """
+
+    def __init__(
+            self,
+            client: "AsyncOpenAI",
+            semaphore: asyncio.Semaphore,
+            batch_size: int = VISION_BATCH_SIZE,
+            linger: float = VISION_BATCH_LINGER,
+            result_cache: ResultCache = None,
+    ):
+        self.client = client
+        self.semaphore = semaphore
+        self.batch_size = batch_size
+        self.linger = linger
+        self.result_cache = result_cache
+        self.stats = {"batch_requests": 0, "batched_frames": 0, "fallback_frames": 0}
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def analyze(self, image_file: str, base64_image: str) -> Dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(({"image_file": image_file, "base64_image": base64_image}, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.linger, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)  # Keep a reference until it is done
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        # Frames arrive roughly in order, send them in time order so the model sees a sequence
+        batch.sort(key=lambda item: item[0]["image_file"])
+        try:
+            results = await analyze_image_batch(
+                self.client, [frame for frame, _ in batch], self.semaphore, self.result_cache, self.stats
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
 async def analyze_screenshots(
     folder_path: str, 
     api_key: str, 
@@ -235,17 +768,16 @@ async def analyze_screenshots(
     Args:
         folder_path (str): Path to the folder containing screenshots
         api_key (str): OpenAI API key
-        results_file (str): Path to save the results JSON file
+        results_file (str): Path of the NDJSON results log to append to
         image_range (List[int]): Range of images to process [start, end]
         max_concurrent (int): Maximum number of concurrent API calls
     """
-    # Initialize OpenAI client
-    client = AsyncOpenAI(api_key=api_key)
+    # Shared OpenAI client
+    client = get_openai_client(api_key)
 
     # Get all jpg files from the folder
     images = [f for f in os.listdir(folder_path) if f.endswith('.jpg')]
     images.sort()
-    print(images)
 
     # Create semaphore for rate limiting
     semaphore = asyncio.Semaphore(max_concurrent)
@@ -269,7 +801,8 @@ async def analyze_screenshots(
 
     # Process images concurrently
     start_time = time.time()
-    print(f"Starting analysis of {len(images)} screenshots...")
+    start_counters = run_counters()
+    logger.info("Starting analysis", frames=len(images))
 
     #results = await asyncio.gather(*tasks)
     results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -278,39 +811,397 @@ async def analyze_screenshots(
     # Sort results by timestamp
     timeline = sorted(results, key=lambda x: x['time_from_start'] if x['time_from_start'] else '')
 
-    new_data = {
-        "timeline": timeline,
-        "total_screenshots": len(images),
-        "processing_time": f"{time.time() - start_time:.2f} seconds",
-        "last_updated": datetime.now().isoformat()
-    }
-    # Save results
-    # with open(results_file, 'w') as f:
-    #     json.dump({
-    #         "timeline": timeline,
-    #         "total_screenshots": len(images),
-    #         "processing_time": f"{time.time() - start_time:.2f} seconds",
-    #         "last_updated": datetime.now().isoformat()
-    #     }, f, indent=4)
-    try:
-        with open(results_file, 'r') as f:
-            existing_data = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        existing_data = [] 
-    
-    existing_data.append(new_data)
-    print(f"this is existing data: {existing_data}")
-    with open(results_file, 'w') as f:
-        json.dump(existing_data, f, indent=4)
+    with ResultsLog(results_file) as results_log:
+        for entry in timeline:
+            results_log.append_frame(entry)
+        write_summary(
+            results_log, len(images), time.time() - start_time, counters=count_difference(run_counters(), start_counters)
+        )
 
-    print(f"\nAnalysis complete in {time.time() - start_time:.2f} seconds")
-    print(f"Results saved to {results_file}")
+    logger.info("Analysis complete", seconds=round(time.time() - start_time, 2), results_file=results_file)
 
     delete_folder(folder_path)
-    print(f"Deleted folder: {folder_path}")
     return timeline
 
 
+def write_summary(results_log: ResultsLog, total_screenshots: int, processing_time: float, deduplicated_frames: int = 0, inferred_frames: int = 0, preprocessing: Dict = None, counters: Dict = None):
+    """
+    Append the summary record of one analysis run to the results log. `counters`
+    is what run_counters() counted during the run, None for a run that sent no
+    vision requests.
+    """
+    if counters is None:
+        current = run_counters()
+        counters = count_difference(current, current)
+    result_cache = counters["result_cache"]
+    lookups = result_cache["hits"] + result_cache["misses"]
+    results_log.append_summary({
+        "total_screenshots": total_screenshots,
+        "deduplicated_frames": deduplicated_frames,
+        "inferred_frames": inferred_frames,
+        "preprocessing": savings_report(preprocessing or new_savings()),
+        "result_cache": {
+            "backend": type(get_result_cache()).__name__,
+            **result_cache,
+            "hit_rate": round(result_cache["hits"] / lookups, 3) if lookups else 0.0,
+        },
+        "rate_limiter": {**get_rate_limiter(VISION_MODEL).snapshot(), **counters["rate_limiter"]},
+        "vision_tiers": tier_report(counters["vision_tiers"]),
+        "processing_time": f"{processing_time:.2f} seconds",
+        "last_updated": datetime.now().isoformat()
+    })
+
+
+async def analyze_frames_pipeline(
+    bucket_name: str,
+    frames: List[Dict],
+    api_key: str,
+    results_file: str,
+    fetch_concurrency: int = FETCH_CONCURRENCY,
+    encode_concurrency: int = ENCODE_CONCURRENCY,
+    max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+    queue_size: int = PIPELINE_QUEUE_SIZE,
+    dedup_distance: int = DEDUP_MAX_DISTANCE,
+    batch_size: int = VISION_BATCH_SIZE,
+    checkpoint: Dict = None,
+    checkpoint_store=None,
+    deadline: float = None,
+    memory_budget: int = FRAME_MEMORY_BUDGET,
+) -> Dict:
+    """
+    Streams frames from S3 through download, hashing/base64 encoding, near-duplicate
+    detection, the vision model and the results log as overlapping stages, each with
+    its own concurrency limit. Results are appended in frame order as they complete,
+    so memory does not grow with the number of frames.
+
+    Args:
+        bucket_name (str): S3 bucket holding the screenshots
+        frames (List[Dict]): Manifest entries of the frames to analyze, in order
+        api_key (str): OpenAI API key
+        results_file (str): Path of the NDJSON results log to append to
+        fetch_concurrency (int): Maximum number of parallel S3 downloads
+        encode_concurrency (int): Maximum number of frames encoded at once
+        max_concurrent (int): Maximum number of concurrent API calls
+        queue_size (int): Maximum number of frames buffered between two stages
+        dedup_distance (int): Max Hamming distance for reusing the previous result, -1 disables dedup
+        batch_size (int): Frames sent to the vision model per request
+        checkpoint (Dict): Job checkpoint, frames before checkpoint["frames_done"] are skipped
+        checkpoint_store: Store the checkpoint is saved to while frames are persisted
+        deadline (float): time.time() after which no new frames are started
+        memory_budget (int): Bytes of frame payload (downloads, base64 strings, request bodies)
+                             in flight at once, new frames are only downloaded while under it
+
+    Returns a dict with the number of frames persisted in this run and whether all frames are done.
+    """
+    client = get_openai_client(api_key)
+    if checkpoint is None:
+        checkpoint = new_checkpoint(None, results_file)
+    start_no = checkpoint["frames_done"]
+    base_deduplicated = checkpoint["deduplicated_frames"]
+    base_processing_time = checkpoint["processing_time"]
+    base_preprocessing = checkpoint.get("preprocessing", new_savings())
+    base_memory = checkpoint.get("memory", {})
+    base_counters = checkpoint.get("run_counters", {})
+    start_counters = run_counters()
+    semaphore = asyncio.Semaphore(max_concurrent)
+    budget = ByteBudget(memory_budget)
+    batcher = VisionBatcher(client, semaphore, batch_size) if batch_size > 1 else None
+
+    def out_of_time():
+        return deadline is not None and time.time() >= deadline
+
+    async def fetch(item):
+        index, frame = item
+        if out_of_time():
+            # Ordered stages only emit up to the first gap, so every later frame
+            # is dropped too and picked up again by the next invocation
+            return None
+        file_key = frame["key"]
+        image_file = os.path.basename(file_key)
+        started = time.perf_counter()
+        # Frames are admitted in order, so the ordered stages never wait on a frame that cannot get in
+        reserved = await budget.acquire(frame_reservation(frame))
+        try:
+            buffer = await fetch_object(s3_client, bucket_name, file_key)
+        except Exception as e:
+            budget.release(reserved)
+            logger.warning("Could not download frame", key=file_key, error=str(e), sample="download_error")
+            # Keep failed frames flowing so the ordered dedup stage never waits on them
+            return {"index": index, "image_file": image_file, "started": started, "error": str(e)}
+        return {"index": index, "image_file": image_file, "started": started, "buffer": buffer, "reserved": reserved}
+
+    async def encode(frame):
+        if "error" in frame:
+            return frame
+        try:
+            with profiler.span("encode"):
+                data = await asyncio.to_thread(read_buffer, frame.pop("buffer"))
+                # Decoding and resizing are CPU-bound, they run on the preprocessing process pool
+                frame.update(await preprocess_frame(data, DEDUP_HASH_SIZE if dedup_distance >= 0 else None, VISION_DETAIL))
+            # The download is gone, from here on the frame holds its base64 string and soon its request
+            frame["reserved"] = budget.resize(frame["reserved"], payload_size(frame["base64_image"]))
+        except Exception as e:
+            logger.warning("Could not encode frame", image_file=frame["image_file"], error=str(e), sample="encode_error")
+            budget.release(frame.pop("reserved", 0))
+            frame["error"] = str(e)
+        return frame
+
+    async def analyze(frame):
+        try:
+            return await analyze_frame(frame)
+        finally:
+            # The request has been answered, its image and body can be collected
+            budget.release(frame.pop("reserved", 0))
+
+    async def analyze_frame(frame):
+        if out_of_time():
+            return None  # Same as in fetch, resumed by the next invocation
+        try:
+            time_from_start = extract_and_convert_to_local(frame["image_file"], 5, 30)
+            preprocessing = frame.pop("preprocessing", None)
+            if "error" in frame:
+                result = {
+                    "time_from_start": time_from_start,
+                    "filename": frame["image_file"],
+                    "error": frame["error"],
+                    "processed_at": datetime.now().isoformat()
+                }
+            elif "duplicate_of" in frame:
+                # Near-identical to the previous analyzed frame, reuse its result later
+                result = {"time_from_start": time_from_start, "duplicate_of": frame["duplicate_of"]}
+            elif batcher is not None:
+                result = await batcher.analyze(frame["image_file"], frame.pop("base64_image"))
+                result["preprocessing"] = preprocessing
+            else:
+                result = await analyze_single_image(
+                    client, None, frame["image_file"], semaphore, base64_image=frame.pop("base64_image")
+                )
+                result["preprocessing"] = preprocessing
+        except Exception as e:
+            # Like in fetch and encode, the frame is persisted as failed instead of leaving a gap
+            logger.warning("Could not analyze frame", image_file=frame["image_file"], error=str(e), sample="analyze_error")
+            result = {
+                "time_from_start": None,
+                "filename": frame["image_file"],
+                "error": str(e),
+                "processed_at": datetime.now().isoformat()
+            }
+        result["index"] = frame["index"]
+        result["started"] = frame["started"]
+        if frame.get("anchor"):
+            result["anchor"] = True
+        return result
+
+    def remaining_frames():
+        for index, frame in enumerate(frames[start_no:]):
+            if out_of_time():
+                logger.info("Time budget reached, pausing", new_frames=index)
+                return
+            yield index, frame
+
+    def update_checkpoint():
+        checkpoint["frames_done"] = start_no + stats["frames"]
+        checkpoint["deduplicated_frames"] = base_deduplicated + stats["deduplicated_frames"]
+        checkpoint["processing_time"] = base_processing_time + time.time() - start_time
+        checkpoint["preprocessing"] = dict(base_preprocessing)
+        add_savings(checkpoint["preprocessing"], stats["preprocessing"])
+        checkpoint["memory"] = add_memory_stats(base_memory, budget.snapshot())
+        checkpoint["run_counters"] = add_counts(base_counters, count_difference(run_counters(), start_counters))
+
+    async def on_progress():
+        update_checkpoint()
+        if checkpoint_store is not None:
+            await asyncio.to_thread(save_progress, checkpoint_store, checkpoint)
+
+    start_time = time.time()
+    logger.info("Starting analysis", frames=len(frames) - start_no, resuming_after=start_no)
+    stats = {"frames": 0, "deduplicated_frames": 0, "preprocessing": new_savings()}
+    # One shared connection pool for all downloads of this submission
+    with ResultsLog(results_file) as results_log:
+        async with open_s3_client(fetch_concurrency) as s3_client:
+            await run_pipeline(
+                remaining_frames(),
+                [
+                    ("fetch", fetch, fetch_concurrency),
+                    ("encode", encode, encode_concurrency),
+                    ("dedup", make_dedup_stage(dedup_distance, budget), 1),
+                    # Enough workers to fill max_concurrent requests of batch_size frames each
+                    ("analyze", analyze, max_concurrent * max(1, batch_size)),
+                    ("persist", make_persist_stage(results_log, stats, on_progress), 1),
+                ],
+                queue_size=queue_size,
+            )
+        update_checkpoint()
+        stats["complete"] = checkpoint["frames_done"] >= len(frames)
+        if stats["complete"]:
+            write_summary(
+                results_log, len(frames), checkpoint["processing_time"], checkpoint["deduplicated_frames"],
+                preprocessing=checkpoint["preprocessing"], counters=checkpoint["run_counters"],
+            )
+
+    report = savings_report(stats["preprocessing"])
+    logger.info(
+        "Analysis finished",
+        frames_done=checkpoint["frames_done"],
+        frames=len(frames),
+        seconds=round(time.time() - start_time, 2),
+        deduplicated_frames=stats["deduplicated_frames"],
+        batching=batcher.stats if batcher is not None else None,
+        memory=budget.snapshot(),
+        bytes_saved=report["bytes_saved"],
+        tokens_saved=report["tokens_saved"],
+        results_file=results_file,
+    )
+    return stats
+
+
+async def analyze_frames_adaptive(
+    bucket_name: str,
+    frames: List[Dict],
+    api_key: str,
+    results_file: str,
+    stride: int = SAMPLING_STRIDE,
+    fetch_concurrency: int = FETCH_CONCURRENCY,
+    max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+    batch_size: int = VISION_BATCH_SIZE,
+    checkpoint: Dict = None,
+    checkpoint_store=None,
+    deadline: float = None,
+    memory_budget: int = FRAME_MEMORY_BUDGET,
+) -> Dict:
+    """
+    Analyze a submission by sampling every `stride`-th frame and bisecting only
+    the intervals where activity or active app changes. Frames in between are
+    filled with inferred copies, so the timeline has one entry per frame.
+
+    Until the walk is done the results log holds one "sample" record per
+    analyzed frame, in the order they finish, and is checkpointed like the
+    dense pipeline's log. A later invocation reads the samples back and carries
+    on with the frames still missing. Once done, the log is replaced by the
+    timeline in frame order and its summary.
+
+    Args:
+        bucket_name (str): S3 bucket holding the screenshots
+        frames (List[Dict]): Manifest entries of the frames to analyze, in order
+        api_key (str): OpenAI API key
+        results_file (str): Path of the NDJSON results log to append to
+        stride (int): Distance between the initial samples
+        fetch_concurrency (int): Maximum number of parallel S3 downloads
+        max_concurrent (int): Maximum number of concurrent API calls
+        batch_size (int): Frames sent to the vision model per request
+        checkpoint (Dict): Job checkpoint, updated with the frames analyzed so far
+        checkpoint_store: Store the checkpoint is saved to while frames are analyzed
+        deadline (float): time.time() after which no new frames are started
+        memory_budget (int): Bytes of frame payload in flight at once
+
+    Returns a dict with the number of frames analyzed in this run and whether the timeline is done.
+    """
+    if checkpoint is None:
+        checkpoint = new_checkpoint(None, results_file)
+    if count_logged_frames(results_file) >= len(frames):
+        return {"frames": 0, "complete": True}  # Finished by an earlier invocation that stopped before advancing
+    analyzed = {}
+    if os.path.exists(results_file):
+        for record in iter_results_log(results_file):
+            if record.get("type") == "sample":
+                analyzed[record.pop("index")] = {key: value for key, value in record.items() if key != "type"}
+    base_processing_time = checkpoint["processing_time"]
+    base_preprocessing = checkpoint.get("preprocessing", new_savings())
+    base_memory = checkpoint.get("memory", {})
+    base_counters = checkpoint.get("run_counters", {})
+    start_counters = run_counters()
+
+    client = get_openai_client(api_key)
+    semaphore = asyncio.Semaphore(max_concurrent)
+    batcher = VisionBatcher(client, semaphore, batch_size) if batch_size > 1 else None
+    fetch_semaphore = asyncio.Semaphore(fetch_concurrency)
+    budget = ByteBudget(memory_budget)
+    preprocessing = new_savings()
+    stats = {"frames": 0}
+
+    def image_file_of(index):
+        return os.path.basename(frames[index]["key"])
+
+    def time_of_frame(index):
+        return extract_and_convert_to_local(image_file_of(index), 5, 30)
+
+    def update_checkpoint():
+        # Against all frames like the dense pipeline, so the job's rate and ETA mean the same in both modes
+        checkpoint["frames_done"] = settled_frames(len(frames), analyzed)
+        checkpoint["processing_time"] = base_processing_time + time.time() - start_time
+        checkpoint["preprocessing"] = dict(base_preprocessing)
+        add_savings(checkpoint["preprocessing"], preprocessing)
+        checkpoint["memory"] = add_memory_stats(base_memory, budget.snapshot())
+        checkpoint["run_counters"] = add_counts(base_counters, count_difference(run_counters(), start_counters))
+
+    async def analyze_and_log(index):
+        result = await analyze_frame(index)
+        samples_log.append({"type": "sample", "index": index, **result})
+        analyzed[index] = result
+        stats["frames"] += 1
+        if checkpoint_store is not None and stats["frames"] % CHECKPOINT_EVERY == 0:
+            update_checkpoint()
+            await asyncio.to_thread(save_progress, checkpoint_store, checkpoint)
+        return result
+
+    async def analyze_frame(index):
+        image_file = image_file_of(index)
+        reserved = await budget.acquire(frame_reservation(frames[index]))
+        try:
+            try:
+                async with fetch_semaphore:
+                    buffer = await fetch_object(s3_client, bucket_name, frames[index]["key"])
+                with profiler.span("encode"):
+                    prepared = await preprocess_frame(await asyncio.to_thread(read_buffer, buffer), detail=VISION_DETAIL)
+            except Exception as e:
+                logger.warning("Could not download frame", image_file=image_file, error=str(e), sample="download_error")
+                return {
+                    "time_from_start": time_of_frame(index),
+                    "filename": image_file,
+                    "error": str(e),
+                    "processed_at": datetime.now().isoformat()
+                }
+            reserved = budget.resize(reserved, payload_size(prepared["base64_image"]))
+            add_savings(preprocessing, prepared["preprocessing"])
+            if batcher is not None:
+                return await batcher.analyze(image_file, prepared.pop("base64_image"))
+            return await analyze_single_image(client, None, image_file, semaphore, base64_image=prepared.pop("base64_image"))
+        finally:
+            budget.release(reserved)
+
+    start_time = time.time()
+    logger.info("Starting adaptive analysis", frames=len(frames), stride=stride, resuming_with=len(analyzed))
+    with ResultsLog(results_file) as samples_log:
+        async with open_s3_client(fetch_concurrency) as s3_client:
+            timeline, inferred_frames = await adaptive_sample(
+                len(frames), analyze_and_log, time_of_frame, stride, analyzed=analyzed, deadline=deadline
+            )
+    update_checkpoint()
+    if timeline is None:
+        logger.info("Time budget reached, pausing", frames_analyzed=len(analyzed), new_frames=stats["frames"])
+        return {"frames": stats["frames"], "complete": False}
+
+    logger.info("Inferred frames without calling the API", inferred_frames=inferred_frames, frames=len(frames), memory=budget.snapshot())
+    # Written next to the samples and swapped in, a crash leaves either the samples or the timeline
+    timeline_file = f"{results_file}.timeline"
+    if os.path.exists(timeline_file):
+        os.remove(timeline_file)
+    with ResultsLog(timeline_file) as results_log:
+        for entry in timeline:
+            results_log.append_frame(entry)
+            profiler.count("frames.persisted")
+            if "error" in entry:
+                profiler.count("frames.failed")
+        write_summary(
+            results_log, len(frames), checkpoint["processing_time"], inferred_frames=inferred_frames,
+            preprocessing=checkpoint["preprocessing"], counters=checkpoint["run_counters"],
+        )
+    os.replace(timeline_file, results_file)
+    checkpoint["frames_done"] = len(frames)
+    logger.info("Analysis complete", seconds=round(time.time() - start_time, 2), results_file=results_file)
+    return {"frames": stats["frames"], "complete": True}
+
+
 async def main(submission_id, assignment_id, user_id, total_screenshots):
     if not submission_id:
         raise ValueError("submission_id is required but not provided.")
@@ -320,46 +1211,356 @@ async def main(submission_id, assignment_id, user_id, total_screenshots):
     except ValueError:
         raise ValueError("total_screenshots  must be valid integers.")
 
-    print(f"This is total screenshots: {total_screenshots}")
     # Configuration
     ASSIGNMENT_ID=submission_id
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")  # Replace with your actual API key
-    SCREENSHOTS_FOLDER = f"/tmp/screenshots/{ASSIGNMENT_ID}"
-    RESULTS_FILE = f"/tmp/analysis/{ASSIGNMENT_ID}.json"
-    IMAGE_RANGE = [0, 2200]  # Specify which images to process (adjust as needed)
-    MAX_CONCURRENT_REQUESTS = 60  # Adjust based on your API limits
+    RESULTS_FILE = f"/tmp/analysis/{ASSIGNMENT_ID}.ndjson"
     PREFIX=f"screenshots/{ASSIGNMENT_ID}"
     BUCKET_NAME = os.getenv("BUCKET_NAME")  # Replace with your S3 bucket name
 
-    os.makedirs(SCREENSHOTS_FOLDER, exist_ok=True)  # Creates /tmp/screenshots/example_assignment if it doesn't exist
     os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)  # Creates /tmp/analysis if it doesn't exist
-    print(f"submission_id: {submission_id}")
-    print(f"SCREENSHOTS_FOLDER: {SCREENSHOTS_FOLDER}")
-    print(f"BUCKET_NAME: {BUCKET_NAME}")
+    bind_log_context(submission_id=submission_id, assignment_id=assignment_id, user_id=user_id)
+    logger.info("Processing submission", total_screenshots=total_screenshots, bucket=BUCKET_NAME)
+
+    # Resume from the last checkpoint of this submission, if any
+    checkpoint_store = get_checkpoint_store()
+    checkpoint = checkpoint_store.load(submission_id) or new_checkpoint(submission_id, RESULTS_FILE)
+    # The profile is kept in the checkpoint, so it covers every invocation of the submission
+    profiler.bind_profile(profiler.Profile(checkpoint.setdefault("profile", {})))
+    started = time.time()
+    deadline = started + FUNCTION_TIME_BUDGET
 
-    # Download images from S3 before starting analysis
-    #download_images_from_s3(BUCKET_NAME, SCREENSHOTS_FOLDER, PREFIX, start_no, end_no)
+    if not phase_reached(checkpoint, "timeline_analysis"):
+        checkpoint_store.restore_results(submission_id, RESULTS_FILE)
+        # The results log is the source of truth for the frames already done
+        checkpoint["frames_done"] = count_logged_frames(RESULTS_FILE)
 
-    batch_size = 3
-    for batch_start in range(1, total_screenshots, batch_size):
-        batch_end = min(batch_start + batch_size, total_screenshots) - 1
-        download_images_from_s3(BUCKET_NAME, SCREENSHOTS_FOLDER, PREFIX, batch_start, batch_end)
+        # List the submission once, then stream every frame through the pipeline
         try:
-            timeline = await analyze_screenshots(
-                SCREENSHOTS_FOLDER,
-                OPENAI_API_KEY,
-                RESULTS_FILE,
-                IMAGE_RANGE,
-                MAX_CONCURRENT_REQUESTS
+            frames = select_frames(get_frame_manifest(BUCKET_NAME, PREFIX, expected=total_screenshots), 1, total_screenshots)
+            analyze_frames = analyze_frames_adaptive if ANALYSIS_MODE == "adaptive" else analyze_frames_pipeline
+            stats = await analyze_frames(
+                BUCKET_NAME, frames, OPENAI_API_KEY, RESULTS_FILE,
+                checkpoint=checkpoint, checkpoint_store=checkpoint_store, deadline=deadline
             )
+            complete = stats["complete"]
         except Exception as e:
-            print(f"Error analyzing screenshots: {e}")
-            timeline = []  # In case of failure, ensure you still return an empty timeline
+            logger.exception("Error analyzing screenshots")
+            complete = False
+
+        save_progress(checkpoint_store, checkpoint)
+        if not complete:
+            return {
+                "status": "partial",
+                "phase": checkpoint["phase"],
+                "frames_done": checkpoint["frames_done"],
+                "checkpoint": checkpoint_store.location(submission_id),
+            }
+        advance(checkpoint_store, checkpoint, "timeline_analysis")
 
+    return await finish_submission(
+        submission_id, assignment_id, user_id, checkpoint, checkpoint_store,
+        invocation_end=started + FUNCTION_MAX_DURATION
+    )
+
+
+async def finish_submission(submission_id, assignment_id, user_id, checkpoint, checkpoint_store, invocation_end=None):
+    """
+    Run the phases after frame analysis and report where the submission stands.
+    When the invocation ends (invocation_end, a timestamp) in less than
+    TIMELINE_TIME_BUDGET, the saved phase is left to the next invocation instead.
+    """
+    remaining = invocation_end - time.time() if invocation_end is not None else None
+    if remaining is not None and remaining < TIMELINE_TIME_BUDGET and not phase_reached(checkpoint, "done"):
+        logger.info("Deferring the timeline phases to the next invocation", phase=checkpoint["phase"], remaining=round(remaining, 1))
+        return {
+            "status": "partial",
+            "phase": checkpoint["phase"],
+            "frames_done": checkpoint["frames_done"],
+            "checkpoint": checkpoint_store.location(submission_id),
+        }
     try:
-        await timeline_analysis_main(submission_id, assignment_id, user_id)
+        await timeline_analysis_main(submission_id, assignment_id, user_id, checkpoint, checkpoint_store)
     except Exception as e:
-        print(f"Error during timeline analysis: {e}")
+        logger.exception("Error during timeline analysis")
+
+    return {
+        "status": "complete" if phase_reached(checkpoint, "done") else "partial",
+        "phase": checkpoint["phase"],
+        "frames_done": checkpoint["frames_done"],
+        "checkpoint": checkpoint_store.location(submission_id),
+    }
+
+
+async def analyze_shard(submission_id, start_no, end_no):
+    """
+    Worker side of a fanned-out submission: analyze frames start_no..end_no
+    (1-based, inclusive) into the shard's own results log and publish it once complete.
+    Shards are checkpointed like submissions, so a partial result means "call again".
+    With SHARD_DISPATCH=http an unfinished shard invokes itself again.
+    """
+    start_no, end_no = int(start_no), int(end_no)
+    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    BUCKET_NAME = os.getenv("BUCKET_NAME")
+    PREFIX = f"screenshots/{submission_id}"
+    SHARD_ID = shard_id(submission_id, start_no, end_no)
+    RESULTS_FILE = shard_results_file(submission_id, start_no, end_no)
+    bind_log_context(submission_id=submission_id, shard=SHARD_ID)
+
+    checkpoint_store = get_checkpoint_store()
+    checkpoint = checkpoint_store.load(SHARD_ID) or new_checkpoint(SHARD_ID, RESULTS_FILE)
+    profiler.bind_profile(profiler.Profile(checkpoint.setdefault("profile", {})))
+    deadline = time.time() + FUNCTION_TIME_BUDGET
+
+    if checkpoint.get("error"):
+        return {"status": "error", "shard": SHARD_ID, "message": checkpoint["error"]}
+    if not phase_reached(checkpoint, "timeline_analysis"):
+        checkpoint_store.restore_results(SHARD_ID, RESULTS_FILE)
+        checkpoint["frames_done"] = count_logged_frames(RESULTS_FILE)
+        try:
+            frames = select_frames(get_frame_manifest(BUCKET_NAME, PREFIX, expected=end_no), start_no, end_no)
+            stats = await analyze_frames_pipeline(
+                BUCKET_NAME, frames, OPENAI_API_KEY, RESULTS_FILE,
+                checkpoint=checkpoint, checkpoint_store=checkpoint_store, deadline=deadline
+            )
+            complete = stats["complete"]
+        except Exception as e:
+            logger.exception("Error analyzing shard")
+            complete = False
+
+        save_progress(checkpoint_store, checkpoint)
+        if not complete:
+            if SHARD_DISPATCH == "http":
+                await continue_shard(checkpoint_store, checkpoint, submission_id, start_no, end_no)
+            return {"status": "partial", "shard": SHARD_ID, "frames_done": checkpoint["frames_done"]}
+        publish_shard_results(submission_id, start_no, end_no)
+        # For a shard, reaching timeline_analysis means its frames are done and published
+        advance(checkpoint_store, checkpoint, "timeline_analysis")
+
+    return {"status": "success", "shard": SHARD_ID, "frames_done": checkpoint["frames_done"]}
+
+
+async def coordinate_submission(submission_id, assignment_id, user_id, total_screenshots, shard_count=None):
+    """
+    Coordinator side of a fanned-out submission: split the frame manifest into
+    shards, analyze them on parallel workers, merge their results logs into the
+    submission's log and run the timeline phases on it.
+
+    Over HTTP the shards run in invocations of their own. This one dispatches
+    them, follows their checkpoints until FUNCTION_TIME_BUDGET runs out and
+    returns a partial result while they are still going; calling again (the
+    job runner does) picks up where they stand.
+    """
+    if not submission_id:
+        raise ValueError("submission_id is required but not provided.")
+    try:
+        total_screenshots = int(total_screenshots)
+        shard_count = int(shard_count) if shard_count else None
+    except ValueError:
+        raise ValueError("total_screenshots and shards must be valid integers.")
+
+    RESULTS_FILE = f"/tmp/analysis/{submission_id}.ndjson"
+    PREFIX = f"screenshots/{submission_id}"
+    BUCKET_NAME = os.getenv("BUCKET_NAME")
+    bind_log_context(submission_id=submission_id, assignment_id=assignment_id, user_id=user_id)
+
+    checkpoint_store = get_checkpoint_store()
+    checkpoint = checkpoint_store.load(submission_id) or new_checkpoint(submission_id, RESULTS_FILE)
+    # Shards profile their own frames in their checkpoints, this one covers listing, fan-out and the timeline
+    profiler.bind_profile(profiler.Profile(checkpoint.setdefault("profile", {})))
+
+    started = time.time()
+    deadline = started + FUNCTION_TIME_BUDGET
+
+    if not phase_reached(checkpoint, "timeline_analysis"):
+        frames = select_frames(get_frame_manifest(BUCKET_NAME, PREFIX, expected=total_screenshots), 1, total_screenshots)
+        ranges = plan_shards(len(frames), shard_count)
+        start_time = time.time()
+        while True:
+            # Dispatches are recorded in the checkpoint, so shards are not dispatched twice across invocations
+            results = await run_shards(submission_id, ranges, dispatches=checkpoint.setdefault("shards", {}))
+            failed = [result for result in results if result.get("status") == "error"]
+            if failed:
+                checkpoint_store.save(checkpoint)
+                raise RuntimeError(f"{len(failed)} of {len(ranges)} shards failed: {failed[0].get('message')}")
+            unfinished = [result for result in results if result.get("status") != "success"]
+            if not unfinished or SHARD_DISPATCH == "process" or time.time() + SHARD_POLL_INTERVAL >= deadline:
+                break
+            await asyncio.sleep(SHARD_POLL_INTERVAL)
+        checkpoint["processing_time"] += time.time() - start_time
+
+        if unfinished:
+            checkpoint["frames_done"] = sum(result.get("frames_done", 0) for result in results)
+            checkpoint_store.save(checkpoint)
+            logger.info("Shards still running", unfinished=len(unfinished), shards=len(ranges), frames_done=checkpoint["frames_done"])
+            return {
+                "status": "partial",
+                "phase": checkpoint["phase"],
+                "frames_done": checkpoint["frames_done"],
+                "shards_done": len(ranges) - len(unfinished),
+                "shards": len(ranges),
+                "checkpoint": checkpoint_store.location(submission_id),
+            }
+
+        reduce_shards(submission_id, ranges, RESULTS_FILE)
+        checkpoint["frames_done"] = len(frames)
+        save_progress(checkpoint_store, checkpoint)
+        advance(checkpoint_store, checkpoint, "timeline_analysis")
+
+    return await finish_submission(
+        submission_id, assignment_id, user_id, checkpoint, checkpoint_store,
+        invocation_end=started + FUNCTION_MAX_DURATION
+    )
+
+
+def _bulk_key(name: str) -> str:
+    return f"bulk-{name}"
+
+
+async def write_bulk_requests(writer: BatchFileWriter, submission_id: str, total_screenshots: int,
+                              fetch_concurrency: int = FETCH_CONCURRENCY, encode_concurrency: int = ENCODE_CONCURRENCY) -> int:
+    """Stream one submission's frames from S3 into Batch API requests, returns the number of frames"""
+    BUCKET_NAME = os.getenv("BUCKET_NAME")
+    frames = select_frames(
+        get_frame_manifest(BUCKET_NAME, f"screenshots/{submission_id}", expected=total_screenshots), 1, total_screenshots
+    )
+
+    async def fetch(item):
+        index, frame = item
+        try:
+            return {"index": index, "buffer": await fetch_object(s3_client, BUCKET_NAME, frame["key"])}
+        except Exception as e:
+            logger.warning("Could not download frame", key=frame["key"], error=str(e), sample="download_error")
+            return {"index": index}
+
+    async def encode(frame):
+        if "buffer" in frame:
+            data = await asyncio.to_thread(read_buffer, frame.pop("buffer"))
+            frame["base64_image"] = (await preprocess_frame(data, detail=VISION_DETAIL))["base64_image"]
+        return frame
+
+    def write(frame):
+        # Frames that could not be fetched get no request and end up as errors when collected
+        if "base64_image" in frame:
+            writer.add(f"{submission_id}:{frame['index']}", vision_request_body(frame["base64_image"]))
+        return None
+
+    async with open_s3_client(fetch_concurrency) as s3_client:
+        await run_pipeline(
+            enumerate(frames),
+            [
+                ("fetch", fetch, fetch_concurrency),
+                ("encode", encode, encode_concurrency),
+                ("write", ordered_stage(write), 1),
+            ],
+        )
+    return len(frames)
+
+
+async def submit_bulk_analysis(name: str, submissions: List[Dict], api_key: str = None) -> Dict:
+    """
+    Offline bulk mode: write every frame of `submissions` ({"submission_id",
+    "assignment_id", "user_id", "total_screenshots"}) as Batch API requests and
+    submit them. Batches cost half and are not bound by the interactive rate
+    limits, but take up to BATCH_COMPLETION_WINDOW. Collect with collect_bulk_analysis(name).
+    """
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    bind_log_context(bulk=name)
+    with BatchFileWriter(name) as writer:
+        for submission in submissions:
+            submission["frames"] = await write_bulk_requests(
+                writer, submission["submission_id"], int(submission["total_screenshots"])
+            )
+            logger.info("Wrote batch requests", submission_id=submission["submission_id"], requests=submission["frames"])
+
+    client = open_batch_client(api_key)
+    state = {
+        "name": name,
+        "submissions": submissions,
+        "requests": writer.requests,
+        "batch_ids": await submit_batch_files(client, writer.paths, {"bulk": name}),
+        "status": "submitted",
+        "submitted_at": datetime.now().isoformat(),
+    }
+    get_checkpoint_store().save_document(_bulk_key(name), state)
+    for path in writer.paths:
+        os.remove(path)
+    return state
+
+
+async def collect_bulk_analysis(name: str, api_key: str = None, wait: bool = False, timeout: float = None) -> Dict:
+    """
+    Check on a bulk run and, once all its batches are finished, write each
+    submission's results log from the batch output and run the timeline phases
+    on it like main() does. With `wait` keeps polling until done or `timeout`.
+    """
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    bind_log_context(bulk=name)
+    checkpoint_store = get_checkpoint_store()
+    state = checkpoint_store.load_document(_bulk_key(name))
+    if state is None:
+        raise ValueError(f"Unknown bulk run: {name}")
+    if state["status"] == "complete":
+        return state
+
+    client = open_batch_client(api_key)
+    batches, finished = await poll_batches(client, state["batch_ids"], timeout=timeout if wait else 0)
+    if not finished:
+        state["batch_status"] = {batch.id: batch.status for batch in batches}
+        return state
+
+    analyses = {}
+    errors = {}
+    for batch in batches:
+        async for custom_id, body, error in iter_batch_results(client, batch):
+            if body is not None:
+                analyses[custom_id] = body["choices"][0]["message"]["content"]
+            else:
+                errors[custom_id] = error
+
+    BUCKET_NAME = os.getenv("BUCKET_NAME")
+    state["results"] = {}
+    for submission in state["submissions"]:
+        submission_id = submission["submission_id"]
+        RESULTS_FILE = f"/tmp/analysis/{submission_id}.ndjson"
+        total_screenshots = int(submission["total_screenshots"])
+        frames = select_frames(
+            get_frame_manifest(BUCKET_NAME, f"screenshots/{submission_id}", expected=total_screenshots), 1, total_screenshots
+        )
+        failed = 0
+        if os.path.exists(RESULTS_FILE):
+            os.remove(RESULTS_FILE)  # Replace whatever an earlier interactive run left behind
+        with ResultsLog(RESULTS_FILE) as results_log:
+            for index, frame in enumerate(frames):
+                image_file = os.path.basename(frame["key"])
+                time_from_start = extract_and_convert_to_local(image_file, 5, 30)
+                custom_id = f"{submission_id}:{index}"
+                if custom_id in analyses:
+                    results_log.append_frame({"time_from_start": time_from_start, "analysis": analyses[custom_id]})
+                else:
+                    failed += 1
+                    results_log.append_frame({
+                        "time_from_start": time_from_start,
+                        "filename": image_file,
+                        "error": errors.get(custom_id, "missing from batch output"),
+                        "processed_at": datetime.now().isoformat()
+                    })
+            write_summary(results_log, len(frames), 0.0)
+
+        checkpoint = new_checkpoint(submission_id, RESULTS_FILE)
+        checkpoint["frames_done"] = len(frames)
+        save_progress(checkpoint_store, checkpoint)
+        advance(checkpoint_store, checkpoint, "timeline_analysis")
+        with log_context(submission_id=submission_id):
+            result = await finish_submission(
+                submission_id, submission.get("assignment_id"), submission.get("user_id"), checkpoint, checkpoint_store
+            )
+        state["results"][submission_id] = {**result, "failed_frames": failed}
+
+    state["status"] = "complete"
+    state["batch_status"] = {batch.id: batch.status for batch in batches}
+    checkpoint_store.save_document(_bulk_key(name), state)
+    return state
 
 
 # if __name__ == "__main__":
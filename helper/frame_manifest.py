@@ -0,0 +1,127 @@
+import os
+import re
+import json
+from datetime import datetime, timezone
+from typing import List, Dict, Optional
+from helper.clients import get_boto3_client
+from helper.log import get_logger
+from helper import profiler
+
+logger = get_logger(__name__)
+
+# Set MANIFEST_CACHE_DIR="" to disable the on-disk copy
+MANIFEST_CACHE_DIR = os.getenv("MANIFEST_CACHE_DIR", "/tmp/manifests")
+
+# In-memory cache, survives between warm invocations of the same function instance
+_manifest_cache: Dict[str, List[Dict]] = {}
+
+_TIMESTAMP_PATTERN = re.compile(r"(\d{4})(\d{2})(\d{2})(\d{2})(\d{2})(\d{2})(\d{3})")
+
+
+def parse_frame_timestamp(file_key: str) -> Optional[str]:
+    """Parse the UTC capture time embedded in a frame key (YYYYMMDDHHMMSSmmm) as an ISO string"""
+    match = _TIMESTAMP_PATTERN.search(os.path.basename(file_key))
+    if not match:
+        return None
+    year, month, day, hour, minute, second, millisecond = map(int, match.groups())
+    try:
+        return datetime(
+            year, month, day, hour, minute, second, millisecond * 1000, tzinfo=timezone.utc
+        ).isoformat()
+    except ValueError:
+        return None
+
+
+def _cache_path(bucket_name: str, prefix: str) -> str:
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{bucket_name}_{prefix}")
+    return os.path.join(MANIFEST_CACHE_DIR, f"{safe_name}.json")
+
+
+def _list_frames(bucket_name: str, prefix: str, s3_client) -> List[Dict]:
+    """List every .jpg under the prefix, following continuation tokens past 1,000 keys"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    frames = []
+    with profiler.span("s3.list", prefix=prefix):
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            profiler.count("s3.list_pages")
+            for item in page.get('Contents', []):
+                file_key = item['Key']
+                if file_key.endswith('.jpg') and file_key.startswith(prefix):
+                    frames.append({
+                        "key": file_key,
+                        "size": item.get('Size', 0),
+                        "timestamp": parse_frame_timestamp(file_key),
+                    })
+    frames.sort(key=lambda frame: frame["key"])  # Keep the sequence consistent with S3 order
+    return frames
+
+
+def get_frame_manifest(bucket_name: str, prefix: str, s3_client=None, refresh: bool = False,
+                       expected: int = 0) -> List[Dict]:
+    """
+    Returns the sorted frame index of a submission, listing S3 only on a cache miss.
+
+    Each entry is a dict with the object `key`, its `size` in bytes and the parsed
+    UTC `timestamp`. Lookups go memory -> /tmp copy -> S3. A cached copy with
+    fewer than `expected` frames was listed while frames were still being
+    uploaded, so it is listed again.
+
+    :param bucket_name: Name of the S3 bucket.
+    :param prefix: Prefix of the submission, e.g. screenshots/{submission_id}.
+    :param s3_client: S3 client object (optional).
+    :param refresh: Ignore cached copies and list the prefix again.
+    :param expected: Number of frames the caller needs, e.g. total_screenshots.
+    """
+    cache_key = f"{bucket_name}/{prefix}"
+    if not refresh and len(_manifest_cache.get(cache_key, ())) >= max(expected, 1):
+        return _manifest_cache[cache_key]
+
+    path = _cache_path(bucket_name, prefix) if MANIFEST_CACHE_DIR else None
+    if not refresh and path and os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                frames = json.load(f)
+            if len(frames) >= max(expected, 1):
+                _manifest_cache[cache_key] = frames
+                return frames
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("Ignoring unreadable manifest cache", path=path, error=str(e))
+
+    if s3_client is None:
+        s3_client = get_boto3_client('s3')
+    frames = _list_frames(bucket_name, prefix, s3_client)
+    logger.info("Listed frames", bucket=bucket_name, prefix=prefix, frames=len(frames))
+    if len(frames) < expected:
+        logger.warning("Fewer frames than expected", bucket=bucket_name, prefix=prefix, frames=len(frames), expected=expected)
+    _manifest_cache[cache_key] = frames
+
+    if path:
+        try:
+            os.makedirs(MANIFEST_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(frames, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write manifest cache", path=path, error=str(e))
+    return frames
+
+
+def select_frames(frames: List[Dict], start_no: int, end_no: int) -> List[Dict]:
+    """Slice a manifest by a 1-based, inclusive range of frame numbers"""
+    return frames[max(start_no, 1) - 1:end_no]
+
+
+def iter_batches(frames: List[Dict], batch_size: int):
+    """Yield consecutive batches of the manifest"""
+    for start in range(0, len(frames), batch_size):
+        yield frames[start:start + batch_size]
+
+
+def invalidate_manifest(bucket_name: str, prefix: str):
+    """Drop the cached manifest of a submission from memory and /tmp"""
+    _manifest_cache.pop(f"{bucket_name}/{prefix}", None)
+    if MANIFEST_CACHE_DIR:
+        path = _cache_path(bucket_name, prefix)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,212 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from helper.checkpoint import get_checkpoint_store, require_shared_checkpoints
+from helper.clients import run
+from helper.log import get_logger, bind_log_context
+from helper.sharding import SELF_URL, invoke_self
+
+logger = get_logger(__name__)
+
+# "http" hands a job to a fresh invocation of this deployment, "thread" runs it
+# in a background thread of the current process (local development only)
+JOB_RUNNER = os.getenv("JOB_RUNNER", "http" if SELF_URL else "thread")
+# Invocations one job may chain through before it is reported as stalled
+JOB_MAX_RUNS = int(os.getenv("JOB_MAX_RUNS", "100"))
+# A dispatched or running job holds a lease this long, past maxDuration (60 s). A job whose
+# lease ran out lost its invocation and is dispatched again by /status
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+# Set by Vercel, where nothing keeps running once the response has been sent
+ON_VERCEL = bool(os.getenv("VERCEL"))
+
+
+def check_job_runner():
+    """Fail on configurations where jobs would silently never finish"""
+    if JOB_RUNNER == "thread":
+        if ON_VERCEL:
+            raise ValueError(
+                "JOB_RUNNER=thread does not work on Vercel, the thread stops with the response. "
+                "Set SELF_URL (or deploy with VERCEL_URL) to run jobs over HTTP."
+            )
+        return
+    if not SELF_URL:
+        raise ValueError("SELF_URL (or VERCEL_URL) is required to run jobs over HTTP.")
+    require_shared_checkpoints("to run jobs over HTTP")
+
+
+def _job_key(job_id: str) -> str:
+    return f"job-{job_id}"
+
+
+def create_job(submission_id, assignment_id, user_id, total_screenshots, shards=None) -> Dict:
+    """Record a new job for a submission and return it"""
+    check_job_runner()
+    if not submission_id:
+        raise ValueError("submission_id is required but not provided.")
+    try:
+        int(total_screenshots)
+    except (TypeError, ValueError):
+        raise ValueError("total_screenshots  must be valid integers.")
+
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "submission_id": submission_id,
+        "assignment_id": assignment_id,
+        "user_id": user_id,
+        "total_screenshots": int(total_screenshots),
+        "shards": shards,
+        "status": "queued",
+        "runs": 0,
+        "dispatches": 0,
+        "message": None,
+        # time.time() until which the job's current dispatch or run owns it, see JOB_LEASE_SECONDS
+        "lease_until": None,
+        "running_since": None,
+        "created_at": datetime.now().isoformat(),
+        "updated_at": datetime.now().isoformat(),
+    }
+    save_job(job)
+    return job
+
+
+def load_job(job_id: str) -> Optional[Dict]:
+    return get_checkpoint_store().load_document(_job_key(job_id))
+
+
+def save_job(job: Dict):
+    job["updated_at"] = datetime.now().isoformat()
+    get_checkpoint_store().save_document(_job_key(job["job_id"]), job)
+
+
+async def run_job(job: Dict) -> Dict:
+    """
+    Run one invocation's worth of a job. Returns the job, whose status is
+    "running" again if it needs another invocation to finish.
+    """
+    # Imported here, helper.entry is heavy and only needed by the worker
+    from helper.entry import main, coordinate_submission
+
+    bind_log_context(job_id=job["job_id"], submission_id=job["submission_id"])
+    job["status"] = "running"
+    job["runs"] += 1
+    job["running_since"] = time.time()
+    job["lease_until"] = time.time() + JOB_LEASE_SECONDS
+    save_job(job)
+    try:
+        if job["shards"]:
+            result = await coordinate_submission(
+                job["submission_id"], job["assignment_id"], job["user_id"], job["total_screenshots"], job["shards"]
+            )
+        else:
+            result = await main(job["submission_id"], job["assignment_id"], job["user_id"], job["total_screenshots"])
+        if result["status"] == "complete":
+            job["status"] = "complete"
+        elif job["runs"] >= JOB_MAX_RUNS:
+            job["status"] = "error"
+            job["message"] = f"Gave up after {job['runs']} invocations"
+        else:
+            job["status"] = "running"
+    except Exception as e:
+        logger.exception("Job failed", run=job["runs"])
+        job["status"] = "error"
+        job["message"] = str(e)
+    job["running_since"] = None
+    save_job(job)
+    return job
+
+
+def _run_in_thread(job: Dict):
+    while job["status"] in ("queued", "running"):
+        job = run(run_job(job))
+
+
+def dispatch_job(job: Dict) -> Dict:
+    """
+    Start working on a job without waiting for it. A dispatch that cannot be
+    delivered is logged and left to /status, which dispatches the job again
+    once its lease has run out.
+    """
+    job["dispatches"] = job.get("dispatches", 0) + 1
+    job["lease_until"] = time.time() + JOB_LEASE_SECONDS
+    job["running_since"] = None  # Whatever ran it before is done or gone
+    save_job(job)
+    if JOB_RUNNER != "http":
+        threading.Thread(target=_run_in_thread, args=(job,), daemon=True).start()
+        return job
+    try:
+        run(invoke_self({"job_id": job["job_id"], "run": 1}))
+    except Exception as e:
+        logger.warning("Could not dispatch job", job_id=job["job_id"], error=str(e))
+        job["lease_until"] = time.time()  # Stale right away
+        save_job(job)
+    return job
+
+
+def is_stale(job: Dict) -> bool:
+    """True for an unfinished job whose dispatch or run stopped without handing it on"""
+    return job["status"] in ("queued", "running") and time.time() >= (job.get("lease_until") or 0)
+
+
+def run_job_invocation(job_id: str) -> Dict:
+    """Worker side of JOB_RUNNER=http: run the job once and hand it on if unfinished"""
+    job = load_job(job_id)
+    if job is None:
+        raise ValueError(f"Unknown job_id: {job_id}")
+    if job["status"] in ("complete", "error"):
+        return job
+    if job.get("running_since") and not is_stale(job):
+        return job  # Another invocation is running it, e.g. a late duplicate dispatch
+    job = run(run_job(job))
+    if job["status"] == "running":
+        job = dispatch_job(job)
+    return job
+
+
+def job_status(job_id: str) -> Optional[Dict]:
+    """Phase, throughput, ETA and output locations of a job, None if it does not exist"""
+    job = load_job(job_id)
+    if job is None:
+        return None
+    if is_stale(job):
+        # The invocation that had it was killed (e.g. at maxDuration) before handing it on
+        logger.warning("Job stalled, dispatching again", job_id=job_id, status=job["status"], dispatches=job.get("dispatches"))
+        job = dispatch_job(job)
+
+    store = get_checkpoint_store()
+    submission_id = job["submission_id"]
+    checkpoint = store.load(submission_id) or {}
+    results_file = checkpoint.get("results_file", f"/tmp/analysis/{submission_id}.ndjson")
+    frames_done = checkpoint.get("frames_done", 0)
+    processing_time = checkpoint.get("processing_time", 0.0)
+    frames_per_second = frames_done / processing_time if processing_time else None
+
+    eta_seconds = None
+    if checkpoint.get("phase", "frames") == "frames" and frames_per_second:
+        eta_seconds = round((job["total_screenshots"] - frames_done) / frames_per_second, 1)
+
+    return {
+        "job_id": job_id,
+        "submission_id": submission_id,
+        "status": job["status"],
+        "message": job["message"],
+        "phase": checkpoint.get("phase", "frames"),
+        "frames_done": frames_done,
+        "total_frames": job["total_screenshots"],
+        "frames_per_second": round(frames_per_second, 2) if frames_per_second else None,
+        "eta_seconds": eta_seconds,
+        # Peak bytes of frame payload held at once, against the FRAME_MEMORY_BUDGET ceiling
+        "memory": checkpoint.get("memory") or None,
+        "outputs": {
+            "checkpoint": store.location(submission_id),
+            "results_log": store.results_location(submission_id, results_file),
+            "artifacts": sorted(checkpoint.get("artifacts", {})),
+        },
+        "runs": job["runs"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "checked_at": datetime.now().isoformat(),
+    }
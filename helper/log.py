@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import logging
+import contextlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict
+
+# Logging configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" for one object per line, "text" for local runs
+# Longer messages and fields are cut, so a record costs the same however big the payload is
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "1000"))
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "300"))
+# Sampled events (one per frame) are logged for the first LOG_SAMPLE_FIRST occurrences, then every LOG_SAMPLE_EVERY-th
+LOG_SAMPLE_FIRST = int(os.getenv("LOG_SAMPLE_FIRST", "5"))
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "100"))
+
+ROOT_LOGGER = "helper"
+
+# Fields added to every record, e.g. the submission being processed. Follows asyncio tasks.
+_context: ContextVar[Dict] = ContextVar("log_context", default={})
+# Occurrences per sampled event, kept per log_context so every submission starts over
+_sample_counts: ContextVar[Dict] = ContextVar("log_sample_counts", default=None)
+_process_sample_counts: Dict[str, int] = {}
+
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def truncate(value, limit: int = LOG_MAX_FIELD_CHARS):
+    """Value as it goes into a record: short JSON values stay as they are, anything else becomes a cut-off string"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if not isinstance(value, str):
+        try:
+            text = json.dumps(value, default=str)
+        except (TypeError, ValueError):
+            text = repr(value)
+        if len(text) <= limit:
+            return value
+        value = text
+    if len(value) <= limit:
+        return value
+    return f"{value[:limit]}...(+{len(value) - limit} chars)"
+
+
+def sampled(event: str) -> bool:
+    """Whether this occurrence of a high-volume event should be logged"""
+    counts = _sample_counts.get()
+    if counts is None:
+        counts = _process_sample_counts
+    count = counts.get(event, 0) + 1
+    counts[event] = count
+    return count <= LOG_SAMPLE_FIRST or count % LOG_SAMPLE_EVERY == 0
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """Add fields to every record logged inside the block, including from tasks it starts"""
+    context_token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    counts_token = _sample_counts.set({})
+    try:
+        yield
+    finally:
+        _sample_counts.reset(counts_token)
+        _context.reset(context_token)
+
+
+def bind_log_context(**fields):
+    """
+    Add fields to every later record of the current asyncio task and the tasks it
+    starts. Tasks run in a copy of their parent's context, so this never leaks
+    into other requests.
+    """
+    _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    _sample_counts.set({})
+
+
+def _fields(record: logging.LogRecord) -> Dict:
+    fields = {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+    return {key: truncate(value) for key, value in {**_context.get(), **fields}.items()}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        document = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": truncate(record.getMessage(), LOG_MAX_MESSAGE_CHARS),
+            **_fields(record),
+        }
+        if record.exc_info:
+            document["exception"] = truncate(self.formatException(record.exc_info), LOG_MAX_MESSAGE_CHARS)
+        return json.dumps(document, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = " ".join(f"{key}={value}" for key, value in _fields(record).items())
+        line = f"{record.levelname} {record.name}: {truncate(record.getMessage(), LOG_MAX_MESSAGE_CHARS)}"
+        if fields:
+            line = f"{line} [{fields}]"
+        if record.exc_info:
+            line = f"{line}\n{truncate(self.formatException(record.exc_info), LOG_MAX_MESSAGE_CHARS)}"
+        return line
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """
+    Logger taking fields as keyword arguments: logger.info("Uploaded", key=key, bytes=size).
+    With sample="event", the record is only built for the occurrences sampled() lets through.
+    """
+
+    def log(self, level, msg, *args, sample: str = None, **kwargs):
+        if not self.isEnabledFor(level):
+            return
+        if sample is not None and not sampled(sample):
+            return
+        msg, kwargs = self.process(msg, kwargs)
+        self.logger.log(level, msg, *args, **kwargs)
+
+    def process(self, msg, kwargs):
+        options = {key: kwargs.pop(key) for key in ("exc_info", "stack_info", "stacklevel") if key in kwargs}
+        fields = {**(kwargs.pop("extra", None) or {}), **kwargs}
+        # LogRecord refuses extra keys that shadow its own attributes, e.g. "filename"
+        extra = {f"{key}_" if key in _RECORD_ATTRIBUTES else key: value for key, value in fields.items()}
+        return msg, {**options, "extra": extra}
+
+
+def _configure():
+    logger = logging.getLogger(ROOT_LOGGER)
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+def get_logger(name: str) -> StructuredLogger:
+    _configure()
+    return StructuredLogger(logging.getLogger(name), {})
@@ -0,0 +1,116 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Dict
+from helper import profiler
+
+# Ceiling for the payload of the frames in flight: downloaded JPEGs, base64 strings and request bodies
+FRAME_MEMORY_BUDGET = int(os.getenv("FRAME_MEMORY_BUDGET", str(256 * 1024 * 1024)))
+# Bytes reserved per byte of downloaded JPEG until the frame is encoded and its real payload is known
+FRAME_MEMORY_FACTOR = float(os.getenv("FRAME_MEMORY_FACTOR", "3"))
+# Reserved for frames whose size is not in the manifest
+FRAME_MEMORY_DEFAULT_SIZE = 1024 * 1024
+
+
+class ByteBudget:
+    """
+    Admission control by bytes for the frames in flight.
+
+    acquire() waits until a reservation fits under the limit. Waiters are
+    admitted strictly in arrival order, so frames enter in frame order and the
+    ordered stages downstream never wait on a frame that cannot get in. A
+    reservation larger than the whole budget is admitted once nothing else is
+    in flight. resize() and release() never wait, so admitted frames always
+    make progress.
+    """
+
+    def __init__(self, limit: int = FRAME_MEMORY_BUDGET):
+        self.limit = limit
+        self.in_flight = 0
+        self.high_water = 0
+        self.stats = {"admitted": 0, "waits": 0, "wait_seconds": 0.0}
+        self._waiters = deque()
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.in_flight == 0 or self.in_flight + nbytes <= self.limit
+
+    def _take(self, nbytes: int):
+        self.in_flight += nbytes
+        self.high_water = max(self.high_water, self.in_flight)
+        self.stats["admitted"] += 1
+
+    def _wake(self):
+        while self._waiters:
+            nbytes, future = self._waiters[0]
+            if future.done():  # Cancelled while waiting
+                self._waiters.popleft()
+                continue
+            if not self._fits(nbytes):
+                return
+            self._waiters.popleft()
+            self._take(nbytes)
+            future.set_result(None)
+
+    async def acquire(self, nbytes: int) -> int:
+        """Wait until `nbytes` fit, returns the reservation to resize or release later"""
+        if not self._waiters and self._fits(nbytes):
+            self._take(nbytes)
+            return nbytes
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((nbytes, future))
+        self.stats["waits"] += 1
+        start = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(nbytes)  # Admitted just before the cancellation
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.stats["wait_seconds"] += waited
+            profiler.record("memory.wait", waited)
+        return nbytes
+
+    def resize(self, reserved: int, nbytes: int) -> int:
+        """Replace an admitted reservation by the bytes actually held, without waiting"""
+        self.in_flight += nbytes - reserved
+        self.high_water = max(self.high_water, self.in_flight)
+        if nbytes < reserved:
+            self._wake()
+        return nbytes
+
+    def release(self, reserved: int):
+        if reserved:
+            self.in_flight -= reserved
+            self._wake()
+
+    def snapshot(self) -> Dict:
+        return {
+            "budget_bytes": self.limit,
+            "high_water_bytes": self.high_water,
+            "in_flight_bytes": self.in_flight,
+            **self.stats,
+            "wait_seconds": round(self.stats["wait_seconds"], 3),
+        }
+
+
+def frame_reservation(frame: Dict, factor: float = FRAME_MEMORY_FACTOR) -> int:
+    """Bytes to reserve for a manifest entry before it is downloaded"""
+    return int((frame.get("size") or FRAME_MEMORY_DEFAULT_SIZE) * factor)
+
+
+def payload_size(base64_image: str) -> int:
+    """Bytes an encoded frame holds until its request is answered: the base64 string and the request body"""
+    return 2 * len(base64_image)
+
+
+def add_memory_stats(totals: Dict, snapshot: Dict) -> Dict:
+    """Memory stats over several invocations: the highest high-water mark and the summed waits"""
+    return {
+        "budget_bytes": snapshot["budget_bytes"],
+        "high_water_bytes": max(totals.get("high_water_bytes", 0), snapshot["high_water_bytes"]),
+        "waits": totals.get("waits", 0) + snapshot["waits"],
+        "wait_seconds": round(totals.get("wait_seconds", 0.0) + snapshot["wait_seconds"], 3),
+    }
@@ -0,0 +1,142 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple
+from helper.log import get_logger
+
+logger = get_logger(__name__)
+
+# Marker pushed through a queue once the stage feeding it has finished
+_DONE = object()
+
+Stage = Tuple[str, Callable[[object], Awaitable[object]], int]
+
+
+async def _feed(items: Iterable, queue: asyncio.Queue):
+    for item in items:
+        await queue.put(item)  # Blocks while the first stage is saturated
+    await queue.put(_DONE)
+
+
+async def _run_stage(name: str, worker, concurrency: int, in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+    async def _loop():
+        while True:
+            item = await in_queue.get()
+            if item is _DONE:
+                # Put the marker back so sibling workers of this stage stop too
+                await in_queue.put(_DONE)
+                return
+            try:
+                result = await worker(item)
+            except Exception as e:
+                logger.warning("Error in pipeline stage", stage=name, error=str(e), sample=f"stage_error:{name}")
+                if not (isinstance(item, dict) and "index" in item):
+                    continue
+                # Ordered stages downstream wait for every index, so the failure goes on in the item's place
+                result = {"index": item["index"], "error": str(e)}
+            if result is None:
+                continue
+            # A list lets a stage emit several items at once (e.g. after reordering)
+            for output in (result if isinstance(result, list) else [result]):
+                await out_queue.put(output)
+
+    await asyncio.gather(*(_loop() for _ in range(max(1, concurrency))))
+    await out_queue.put(_DONE)
+
+
+def ordered_stage(handle, start: int = 0, key: str = "index"):
+    """
+    Wraps `handle` into a stage worker that sees items strictly in `key` order.
+
+    Items arriving early are held back until every item before them has been
+    handled. `handle` may be sync or async and returns the item to emit or None.
+    The resulting stage must run with a concurrency of 1, and upstream stages
+    must not drop items or the stage waits for them forever. A worker raising
+    on an item with a `key` is not a drop, run_pipeline forwards
+    {"index": ..., "error": ...} in its place.
+    """
+    pending = {}
+    state = {"next": start}
+
+    async def worker(item):
+        pending[item[key]] = item
+        ready = []
+        while state["next"] in pending:
+            current = pending.pop(state["next"])
+            state["next"] += 1
+            result = handle(current)
+            if asyncio.iscoroutine(result):
+                result = await result
+            if result is not None:
+                ready.append(result)
+        return ready
+
+    return worker
+
+
+async def run_pipeline(items: Iterable, stages: List[Stage], queue_size: int = 60) -> List:
+    """
+    Streams items through a chain of concurrent stages connected by bounded queues.
+
+    Every stage runs its own pool of workers, so a slow stage only holds back
+    the stages feeding it once the queue in front of it is full (backpressure).
+
+    :param items: Inputs fed to the first stage.
+    :param stages: List of (name, worker, concurrency) tuples. A worker is an async
+                   callable taking one item and returning the item for the next
+                   stage, a list of items to emit several, or None to drop it.
+    :param queue_size: Maximum number of items waiting in front of each stage.
+    :return: Outputs of the last stage, in completion order.
+    """
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    # The final queue is drained concurrently below, so it never blocks the last stage
+    tasks = [asyncio.create_task(_feed(items, queues[0]))]
+    for index, (name, worker, concurrency) in enumerate(stages):
+        tasks.append(asyncio.create_task(
+            _run_stage(name, worker, concurrency, queues[index], queues[index + 1])
+        ))
+
+    results = []
+    try:
+        while True:
+            item = await queues[-1].get()
+            if item is _DONE:
+                break
+            results.append(item)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return results
+
+
+async def run_graph(steps: Dict[str, Tuple[List[str], Callable[..., Awaitable[object]]]]) -> Dict[str, object]:
+    """
+    Runs a small dependency graph of async steps, each one as soon as the steps
+    it depends on are done, so independent steps overlap.
+
+    :param steps: Maps a step name to (dependencies, func). func is awaited with
+                  the results of its dependencies as keyword arguments.
+    :return: Result of every step by name, or the exception it (or one of its
+             dependencies) raised.
+    """
+    tasks = {}
+
+    def schedule(name):
+        if name not in tasks:
+            dependencies, func = steps[name]
+            upstream = {dependency: schedule(dependency) for dependency in dependencies}
+
+            async def run():
+                values = {dependency: await task for dependency, task in upstream.items()}
+                return await func(**values)
+
+            tasks[name] = asyncio.ensure_future(run())
+        return tasks[name]
+
+    for name in steps:
+        schedule(name)
+    outcomes = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    results = dict(zip(tasks, outcomes))
+    for name, result in results.items():
+        if isinstance(result, Exception):
+            logger.error("Error in step", step=name, error=str(result))
+    return results
@@ -0,0 +1,202 @@
+import io
+import os
+import math
+import base64
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from PIL import Image, ImageDraw
+from helper.log import get_logger
+
+logger = get_logger(__name__)
+
+# Set PREPROCESS_IMAGES=0 to send the original JPEGs unchanged
+PREPROCESS_IMAGES = os.getenv("PREPROCESS_IMAGES", "1") == "1"
+# OpenAI scales high detail images to fit 2048x2048 and then to 768 px on the shortest
+# side, low detail ones to 512x512, so anything larger is only upload bytes
+PREPROCESS_MAX_LONG_SIDE = int(os.getenv("PREPROCESS_MAX_LONG_SIDE", "2048"))
+PREPROCESS_MAX_SHORT_SIDE = int(os.getenv("PREPROCESS_MAX_SHORT_SIDE", "768"))
+PREPROCESS_JPEG_QUALITY = int(os.getenv("PREPROCESS_JPEG_QUALITY", "80"))
+# Part of the frame to keep, "left,top,right,bottom" as fractions of width/height
+PREPROCESS_CROP = os.getenv("PREPROCESS_CROP", "")
+# Overlays to black out, e.g. the webcam bubble: "left,top,right,bottom" fractions separated by ";"
+PREPROCESS_OVERLAY_REGIONS = os.getenv("PREPROCESS_OVERLAY_REGIONS", "")
+# "process" keeps CPU-bound decoding off the event loop's GIL, "thread" where processes are unavailable
+PREPROCESS_EXECUTOR = os.getenv("PREPROCESS_EXECUTOR", "process")
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(os.cpu_count() or 1)))
+
+Box = Tuple[float, float, float, float]
+
+
+def parse_boxes(value: str) -> List[Box]:
+    """Parse "l,t,r,b;l,t,r,b" into fractional boxes"""
+    boxes = []
+    for part in value.split(";"):
+        if part.strip():
+            left, top, right, bottom = (float(number) for number in part.split(","))
+            boxes.append((left, top, right, bottom))
+    return boxes
+
+
+def _scale_box(box: Box, width: int, height: int) -> Tuple[int, int, int, int]:
+    left, top, right, bottom = box
+    return round(left * width), round(top * height), round(right * width), round(bottom * height)
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Vision input tokens of an image, following OpenAI's published tile formula"""
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 170 * math.ceil(width / 512) * math.ceil(height / 512) + 85
+
+
+def dhash_image(image: Image.Image, hash_size: int) -> int:
+    """Difference hash of an already opened image"""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def dhash(data: bytes, hash_size: int = 16) -> int:
+    """Difference hash of an image, computed on a downscaled grayscale copy"""
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("L", (hash_size * 8, hash_size * 8))  # Let the JPEG decoder downscale cheaply
+        return dhash_image(image, hash_size)
+
+
+def hamming_distance(hash1: int, hash2: int) -> int:
+    return bin(hash1 ^ hash2).count("1")
+
+
+def target_size(width: int, height: int, max_long_side: int, max_short_side: int) -> Tuple[int, int]:
+    """Largest size within both side limits, never upscaled"""
+    scale = min(1.0, max_long_side / max(width, height), max_short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def prepare_frame(data: bytes, hash_size: Optional[int] = None, detail: str = "high") -> Dict:
+    """
+    Crop, mask, downscale and recompress one frame. Runs in a worker process.
+    A frame none of these change, or that only got bigger by resizing, is sent
+    as the original JPEG.
+
+    Returns the base64 JPEG to send, the frame's dHash (when `hash_size` is given,
+    computed after overlays are masked so a moving webcam does not break dedup)
+    and the bytes and estimated vision tokens before and after.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        original_width, original_height = image.size
+        savings = {
+            "original_bytes": len(data),
+            "original_tokens": estimate_image_tokens(original_width, original_height, "high"),
+        }
+        if not PREPROCESS_IMAGES:
+            frame_hash = dhash(data, hash_size) if hash_size else None
+            return {
+                "hash": frame_hash,
+                "base64_image": base64.b64encode(data).decode('utf-8'),
+                "preprocessing": {
+                    **savings,
+                    "bytes": len(data),
+                    "tokens": estimate_image_tokens(original_width, original_height, detail),
+                },
+            }
+
+        crop = parse_boxes(PREPROCESS_CROP)
+        crop_box = crop[0] if crop else (0.0, 0.0, 1.0, 1.0)
+        max_short_side = PREPROCESS_MAX_SHORT_SIDE if detail != "low" else min(PREPROCESS_MAX_SHORT_SIDE, 512)
+        cropped_width = original_width * (crop_box[2] - crop_box[0])
+        cropped_height = original_height * (crop_box[3] - crop_box[1])
+        width, height = target_size(cropped_width, cropped_height, PREPROCESS_MAX_LONG_SIDE, max_short_side)
+        # Let the JPEG decoder skip the resolution we throw away anyway
+        image.draft("RGB", (
+            math.ceil(width * original_width / cropped_width),
+            math.ceil(height * original_height / cropped_height),
+        ))
+        frame = image.convert("RGB")
+
+    if crop:
+        frame = frame.crop(_scale_box(crop_box, *frame.size))
+    overlays = parse_boxes(PREPROCESS_OVERLAY_REGIONS)
+    if overlays:
+        draw = ImageDraw.Draw(frame)
+        for box in overlays:
+            draw.rectangle(_scale_box(box, *frame.size), fill=(0, 0, 0))
+    resized = frame.size != (width, height)
+    if resized:
+        frame = frame.resize((width, height), Image.LANCZOS)
+    frame_hash = dhash_image(frame, hash_size) if hash_size else None
+
+    jpeg, tokens = data, estimate_image_tokens(original_width, original_height, detail)
+    if crop or overlays or resized:
+        output = io.BytesIO()
+        frame.save(output, format="JPEG", quality=PREPROCESS_JPEG_QUALITY, optimize=True)
+        resized_tokens = estimate_image_tokens(width, height, detail)
+        # A small or low quality source can come out bigger, it is only worth it when content or tokens change
+        if crop or overlays or len(output.getvalue()) < len(data) or resized_tokens < tokens:
+            jpeg, tokens = output.getvalue(), resized_tokens
+    return {
+        "hash": frame_hash,
+        "base64_image": base64.b64encode(jpeg).decode('utf-8'),
+        "preprocessing": {**savings, "bytes": len(jpeg), "tokens": tokens},
+    }
+
+
+def new_savings() -> Dict:
+    return {"original_bytes": 0, "bytes": 0, "original_tokens": 0, "tokens": 0}
+
+
+def add_savings(totals: Dict, savings: Dict):
+    for field in new_savings():
+        totals[field] = totals.get(field, 0) + savings.get(field, 0)
+
+
+def savings_report(totals: Dict) -> Dict:
+    """Totals plus the bytes and tokens saved, as reported in the run summary"""
+    return {
+        **totals,
+        "bytes_saved": totals["original_bytes"] - totals["bytes"],
+        "tokens_saved": totals["original_tokens"] - totals["tokens"],
+    }
+
+
+_executor: Optional[Executor] = None
+
+
+def get_preprocess_executor() -> Executor:
+    """Process-wide pool, created on first use and kept across invocations"""
+    global _executor
+    if _executor is None:
+        if PREPROCESS_EXECUTOR == "process":
+            try:
+                _executor = ProcessPoolExecutor(max_workers=PREPROCESS_WORKERS)
+            except (OSError, NotImplementedError) as e:
+                # Runtimes without /dev/shm cannot create the pool's semaphores
+                logger.warning("Process pool unavailable, preprocessing in threads", error=str(e))
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS)
+    return _executor
+
+
+def shutdown_preprocess_executor():
+    """Stop the pool's workers, a process exiting with live workers waits for them forever"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+async def preprocess_frame(data: bytes, hash_size: Optional[int] = None, detail: str = "high") -> Dict:
+    """prepare_frame on the preprocessing pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_preprocess_executor(), prepare_frame, data, hash_size, detail)
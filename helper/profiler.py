@@ -0,0 +1,139 @@
+import os
+import math
+import time
+import contextlib
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Optional
+
+# Set PROFILE_OTEL=1 to also emit every span through OpenTelemetry (needs opentelemetry-api and an SDK)
+PROFILE_OTEL = os.getenv("PROFILE_OTEL", "0") == "1"
+# Durations are counted in buckets growing by a factor of 2 ** (1 / PROFILE_BUCKETS_PER_DOUBLING) from
+# PROFILE_MIN_BUCKET seconds up, so profiles from several invocations can be added up and stay small
+# enough to live in the checkpoint. Percentiles are accurate to one bucket, about 19%.
+PROFILE_MIN_BUCKET = 0.001
+PROFILE_BUCKETS_PER_DOUBLING = 4
+PROFILE_BUCKETS = 96  # 1 ms .. ~2.3 hours
+
+try:
+    if PROFILE_OTEL:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer("helper")
+    else:
+        _tracer = None
+except ImportError:  # Optional, only needed for PROFILE_OTEL=1
+    _tracer = None
+
+_current: ContextVar[Optional["Profile"]] = ContextVar("profile", default=None)
+
+
+def _bucket(seconds: float) -> int:
+    if seconds <= PROFILE_MIN_BUCKET:
+        return 0
+    return min(PROFILE_BUCKETS - 1, int(math.log2(seconds / PROFILE_MIN_BUCKET) * PROFILE_BUCKETS_PER_DOUBLING) + 1)
+
+
+def _percentile(buckets, count: int, fraction: float) -> float:
+    """Upper bound of the bucket holding the given fraction of the samples"""
+    rank = fraction * count
+    seen = 0
+    for index, bucket_count in enumerate(buckets):
+        seen += bucket_count
+        if seen >= rank:
+            break
+    return PROFILE_MIN_BUCKET * 2 ** (index / PROFILE_BUCKETS_PER_DOUBLING)
+
+
+class Profile:
+    """
+    Wall time per stage and counters (tokens, bytes, requests) of one submission.
+
+    State is a plain dict, usually checkpoint["profile"], so it is saved with
+    every checkpoint and keeps adding up across resumed invocations.
+    """
+
+    def __init__(self, state: Dict = None):
+        self.state = state if state is not None else {}
+        self.state.setdefault("spans", {})
+        self.state.setdefault("counters", {})
+        self.state.setdefault("started_at", datetime.now().isoformat())
+        self.state.setdefault("invocations", 0)
+        self.state["invocations"] += 1
+
+    def record(self, name: str, seconds: float):
+        span = self.state["spans"].get(name)
+        if span is None:
+            span = {"count": 0, "seconds": 0.0, "max": 0.0, "buckets": [0] * PROFILE_BUCKETS}
+            # New names replace the dict instead of growing it, the checkpoint may be
+            # serialized on a worker thread at the same time
+            self.state["spans"] = {**self.state["spans"], name: span}
+        span["count"] += 1
+        span["seconds"] += seconds
+        span["max"] = max(span["max"], seconds)
+        span["buckets"][_bucket(seconds)] += 1
+
+    def count(self, name: str, value: float = 1):
+        counters = self.state["counters"]
+        if name in counters:
+            counters[name] += value
+        else:
+            self.state["counters"] = {**counters, name: value}
+
+    def report(self) -> Dict:
+        """Summary for the uploaded profile, with estimated percentiles instead of raw buckets"""
+        spans = {}
+        for name, span in sorted(self.state["spans"].items(), key=lambda item: item[1]["seconds"], reverse=True):
+            spans[name] = {
+                "count": span["count"],
+                "seconds": round(span["seconds"], 3),
+                "mean": round(span["seconds"] / span["count"], 4) if span["count"] else 0.0,
+                "p50": round(min(span["max"], _percentile(span["buckets"], span["count"], 0.5)), 4),
+                "p95": round(min(span["max"], _percentile(span["buckets"], span["count"], 0.95)), 4),
+                "p99": round(min(span["max"], _percentile(span["buckets"], span["count"], 0.99)), 4),
+                "max": round(span["max"], 4),
+            }
+        return {
+            "started_at": self.state["started_at"],
+            "invocations": self.state["invocations"],
+            "spans": spans,
+            "counters": dict(sorted(self.state["counters"].items())),
+        }
+
+
+def bind_profile(profile: Optional[Profile]):
+    """Make `profile` the one spans and counters of the current asyncio task (and its children) go to"""
+    _current.set(profile)
+
+
+def current_profile() -> Optional[Profile]:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Time the block as `name` in the current profile, a no-op without one (except for OpenTelemetry)"""
+    profile = _current.get()
+    otel_span = _tracer.start_as_current_span(name, attributes=attributes) if _tracer is not None else None
+    start = time.perf_counter()
+    try:
+        if otel_span is None:
+            yield
+        else:
+            with otel_span:
+                yield
+    finally:
+        if profile is not None:
+            profile.record(name, time.perf_counter() - start)
+
+
+def record(name: str, seconds: float):
+    """Add a duration measured elsewhere, e.g. time spent waiting for the rate limiter"""
+    profile = _current.get()
+    if profile is not None:
+        profile.record(name, seconds)
+
+
+def count(name: str, value: float = 1):
+    profile = _current.get()
+    if profile is not None:
+        profile.count(name, value)
@@ -0,0 +1,297 @@
+import os
+import re
+import time
+import random
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+from helper.log import get_logger
+from helper import profiler
+
+logger = get_logger(__name__)
+
+# Concurrency starts here and grows additively while OpenAI reports headroom
+RATE_LIMIT_INITIAL_CONCURRENCY = int(os.getenv("RATE_LIMIT_INITIAL_CONCURRENCY", "16"))
+RATE_LIMIT_MIN_CONCURRENCY = int(os.getenv("RATE_LIMIT_MIN_CONCURRENCY", "1"))
+RATE_LIMIT_MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENT_REQUESTS", "60"))
+# Requests / tokens per minute of our tier, 0 means learn them from the response headers
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "0"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "0"))
+# How often a throttled request is queued again before it is given up
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "20"))
+# How often a request failing with a 5xx, 408/409, timeout or connection error is sent again,
+# the SDK's own retries are off so 429s are left to the limiter
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# Backoff before such a retry doubles from here up to OPENAI_RETRY_MAX_DELAY seconds, with jitter
+OPENAI_RETRY_DELAY = float(os.getenv("OPENAI_RETRY_DELAY", "0.5"))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "8"))
+# Below this fraction of remaining requests/tokens concurrency stops growing
+RATE_LIMIT_HEADROOM = float(os.getenv("RATE_LIMIT_HEADROOM", "0.1"))
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset durations such as "20ms", "1s" or "6m0s" into seconds"""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * _DURATION_SECONDS[unit] for number, unit in parts)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Errors the OpenAI SDK would retry itself, other than 429"""
+    from openai import APIConnectionError  # Includes APITimeoutError
+
+    if isinstance(error, APIConnectionError):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code in (408, 409) or (status_code is not None and status_code >= 500)
+
+
+def _header_int(headers, name) -> Optional[int]:
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Delay requested by a 429 response, from retry-after-ms / retry-after / the reset headers"""
+    if headers is None:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    resets = [
+        parse_reset_duration(headers.get("x-ratelimit-reset-requests")),
+        parse_reset_duration(headers.get("x-ratelimit-reset-tokens")),
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+class _Budget:
+    """Per-minute budget refilled continuously, like a token bucket"""
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.per_minute:
+            self.available = min(self.per_minute, self.available + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` fits in the budget, 0 if it fits now or the budget is unknown"""
+        if not self.per_minute:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.per_minute)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) * 60 / self.per_minute
+
+    def take(self, amount: float):
+        if self.per_minute:
+            self._refill()
+            self.available -= amount
+
+    def sync(self, limit: Optional[int], remaining: Optional[int]):
+        """Align the budget with what the API says is left"""
+        if limit and not self.per_minute:
+            # First time the limit is known, start from what is left
+            self.per_minute = limit
+            self.available = float(remaining if remaining is not None else limit)
+            self.updated = time.monotonic()
+            return
+        if limit:
+            self.per_minute = limit
+        if remaining is not None and self.per_minute:
+            self._refill()
+            self.available = min(self.available, remaining)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter for OpenAI calls.
+
+    The number of requests in flight grows by about one per window of successful
+    requests while the x-ratelimit-remaining-* headers show headroom, and halves
+    when the API answers 429. Requests and tokens per minute are budgeted
+    separately, and a throttled request waits for retry-after and is sent again
+    instead of failing.
+    """
+
+    def __init__(
+        self,
+        initial: int = RATE_LIMIT_INITIAL_CONCURRENCY,
+        minimum: int = RATE_LIMIT_MIN_CONCURRENCY,
+        maximum: int = RATE_LIMIT_MAX_CONCURRENCY,
+        requests_per_minute: int = OPENAI_RPM,
+        tokens_per_minute: int = OPENAI_TPM,
+        model: str = None,
+    ):
+        self.model = model
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.in_flight = 0
+        self.requests = _Budget(requests_per_minute)
+        self.tokens = _Budget(tokens_per_minute)
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.stats = {
+            "requests": 0, "throttled": 0, "retries": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "max_limit": self.limit, "min_limit": self.limit,
+        }
+        self._loop = None
+        self._condition_obj = None
+
+    def _condition(self) -> asyncio.Condition:
+        # asyncio.run() creates a new loop per request, primitives must follow it
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._condition_obj = asyncio.Condition()
+        return self._condition_obj
+
+    async def _acquire(self, estimated_tokens: int):
+        condition = self._condition()
+        async with condition:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self.paused_until - now,
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(estimated_tokens),
+                )
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    break
+                try:
+                    await asyncio.wait_for(condition.wait(), timeout=wait if wait > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+            self.in_flight += 1
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+
+    async def _release(self):
+        condition = self._condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def _on_success(self, headers, estimated_tokens: int, used_tokens: Optional[int]):
+        if used_tokens is not None:
+            # Give back what was reserved but not used
+            self.tokens.take(used_tokens - estimated_tokens)
+        if headers is not None:
+            self.requests.sync(
+                _header_int(headers, "x-ratelimit-limit-requests"),
+                _header_int(headers, "x-ratelimit-remaining-requests"),
+            )
+            self.tokens.sync(
+                _header_int(headers, "x-ratelimit-limit-tokens"),
+                _header_int(headers, "x-ratelimit-remaining-tokens"),
+            )
+        if self._has_headroom():
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.stats["max_limit"] = max(self.stats["max_limit"], self.limit)
+
+    def _has_headroom(self) -> bool:
+        for budget in (self.requests, self.tokens):
+            if budget.per_minute and budget.available < budget.per_minute * RATE_LIMIT_HEADROOM:
+                return False
+        return True
+
+    def _on_throttle(self, headers, attempt: int):
+        now = time.monotonic()
+        self.stats["throttled"] += 1
+        # Many in-flight requests fail together, decrease once per burst
+        if now - self.last_decrease > 1.0:
+            self.limit = max(self.minimum, self.limit / 2)
+            self.last_decrease = now
+            self.stats["min_limit"] = min(self.stats["min_limit"], self.limit)
+        delay = retry_after_seconds(headers)
+        if delay is None:
+            delay = min(60.0, 2 ** attempt)
+        delay *= 1 + random.random() * 0.1
+        self.paused_until = max(self.paused_until, now + delay)
+        logger.warning("Rate limited", concurrency=int(self.limit), delay=round(delay, 2), sample="rate_limited")
+
+    async def call(self, request: Callable[[], Awaitable], estimated_tokens: int = 1000):
+        """
+        Run `request` under the limiter and return its parsed result.
+
+        `request` must return an OpenAI raw response (``with_raw_response``), so
+        the rate-limit headers can be read. Throttled requests are retried up to
+        RATE_LIMIT_MAX_RETRIES times, transient errors (5xx, timeouts, dropped
+        connections) up to OPENAI_MAX_RETRIES times with jittered backoff, and
+        anything else is raised.
+        """
+        throttles, errors = 0, 0
+        while True:
+            queued = time.perf_counter()
+            await self._acquire(estimated_tokens)
+            profiler.record("openai.wait", time.perf_counter() - queued)
+            retry_delay = None
+            try:
+                with profiler.span("openai.request", model=self.model or ""):
+                    raw_response = await request()
+            except Exception as e:
+                if getattr(e, "status_code", None) == 429 and throttles < RATE_LIMIT_MAX_RETRIES:
+                    self._on_throttle(getattr(getattr(e, "response", None), "headers", None), throttles)
+                    throttles += 1
+                    self.stats["retries"] += 1
+                    profiler.count(f"openai.throttled.{self.model}")
+                    continue
+                if not is_transient_error(e) or errors >= OPENAI_MAX_RETRIES:
+                    raise
+                # Only this request backs off, the API is not asking everyone to slow down
+                retry_delay = min(OPENAI_RETRY_MAX_DELAY, OPENAI_RETRY_DELAY * 2 ** errors) * (0.75 + random.random() * 0.25)
+                errors += 1
+                self.stats["errors"] += 1
+                profiler.count(f"openai.errors.{self.model}")
+                logger.warning("OpenAI request failed, retrying", error=str(e), delay=round(retry_delay, 2), sample="openai_error")
+            finally:
+                await self._release()
+            if retry_delay is not None:
+                await asyncio.sleep(retry_delay)
+                continue
+
+            response = raw_response.parse()
+            usage = getattr(response, "usage", None)
+            self._on_success(raw_response.headers, estimated_tokens, getattr(usage, "total_tokens", None))
+            self.stats["requests"] += 1
+            self.stats["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            self.stats["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+            profiler.count(f"openai.requests.{self.model}")
+            profiler.count(f"openai.prompt_tokens.{self.model}", getattr(usage, "prompt_tokens", 0) or 0)
+            profiler.count(f"openai.completion_tokens.{self.model}", getattr(usage, "completion_tokens", 0) or 0)
+            return response
+
+    def snapshot(self) -> Dict:
+        return {**self.stats, "limit": round(self.limit, 2), "in_flight": self.in_flight}
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+
+
+def get_rate_limiter(model: str) -> AdaptiveLimiter:
+    """Shared limiter per model, OpenAI enforces rate limits per model"""
+    if model not in _limiters:
+        _limiters[model] = AdaptiveLimiter(model=model)
+    return _limiters[model]
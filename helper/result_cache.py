@@ -0,0 +1,190 @@
+import os
+import time
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from typing import Optional
+
+from botocore.exceptions import ClientError
+from helper.clients import get_s3_client
+from helper.log import get_logger
+
+logger = get_logger(__name__)
+
+# "memory", "sqlite", "s3" or "none"
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "sqlite")
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_SQLITE_PATH = os.getenv("RESULT_CACHE_SQLITE_PATH", "/tmp/vision_cache.sqlite")
+RESULT_CACHE_S3_BUCKET = os.getenv("RESULT_CACHE_S3_BUCKET") or os.getenv("BUCKET_NAME")
+RESULT_CACHE_S3_PREFIX = os.getenv("RESULT_CACHE_S3_PREFIX", "cache/vision")
+
+
+def result_cache_key(base64_image: str, prompt: str, model: str, detail: str) -> str:
+    """Content address of a vision request: same image, prompt, model and detail give the same key"""
+    digest = hashlib.sha256()
+    for part in (model, detail, prompt, base64_image):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Base class of the cache backends, keeps hit/miss counters"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            value = await self._get(key)
+        except Exception as e:
+            logger.warning("Result cache lookup failed", error=str(e), sample="cache_error")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str):
+        try:
+            await self._set(key, value)
+        except Exception as e:
+            logger.warning("Could not store result in cache", error=str(e), sample="cache_error")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    async def _get(self, key: str) -> Optional[str]:
+        return None
+
+    async def _set(self, key: str, value: str):
+        pass
+
+
+class MemoryResultCache(ResultCache):
+    """In-process LRU bounded by the total size of the stored results"""
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+
+    async def _get(self, key):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    async def _set(self, key, value):
+        if key in self._entries:
+            self.size -= len(self._entries.pop(key))
+        self._entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class SqliteResultCache(ResultCache):
+    """SQLite file cache, evicts least recently used rows once over `max_bytes`"""
+
+    def __init__(self, path: str = RESULT_CACHE_SQLITE_PATH, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    async def _get(self, key):
+        row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._db.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+        self._db.commit()
+        return row[0]
+
+    async def _set(self, key, value):
+        self._db.execute(
+            "INSERT OR REPLACE INTO results (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+            (key, value, len(value), time.time()),
+        )
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total > self.max_bytes:
+            # Drop the oldest rows until the remaining ones fit in the budget
+            self._db.execute(
+                "DELETE FROM results WHERE key IN ("
+                " SELECT key FROM ("
+                "  SELECT key, SUM(size) OVER (ORDER BY accessed DESC) AS running FROM results"
+                " ) WHERE running > ?)",
+                (self.max_bytes,),
+            )
+        self._db.commit()
+
+
+class S3ResultCache(ResultCache):
+    """
+    Stores results as objects under an S3 prefix so they are shared across invocations.
+    Size-based eviction is left to a lifecycle rule on the prefix.
+    """
+
+    def __init__(self, bucket_name: str = RESULT_CACHE_S3_BUCKET, prefix: str = RESULT_CACHE_S3_PREFIX):
+        super().__init__()
+        self.bucket_name = bucket_name
+        self.prefix = prefix.rstrip("/")
+
+    def _key(self, key):
+        return f"{self.prefix}/{key[:2]}/{key}.json"
+
+    async def _get(self, key):
+        try:
+            s3_client = await get_s3_client()
+            response = await s3_client.get_object(Bucket=self.bucket_name, Key=self._key(key))
+            async with response['Body'] as stream:
+                return (await stream.read()).decode("utf-8")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                logger.warning("Result cache lookup failed", error=str(e), sample="cache_error")
+            return None
+
+    async def _set(self, key, value):
+        s3_client = await get_s3_client()
+        await s3_client.put_object(
+            Bucket=self.bucket_name,
+            Key=self._key(key),
+            Body=value.encode("utf-8"),
+            ContentType="application/json",
+        )
+
+
+_result_cache = None
+
+
+def get_result_cache() -> ResultCache:
+    """Returns the process-wide cache for the configured backend"""
+    global _result_cache
+    if _result_cache is None:
+        if RESULT_CACHE_BACKEND == "memory":
+            _result_cache = MemoryResultCache()
+        elif RESULT_CACHE_BACKEND == "sqlite":
+            try:
+                _result_cache = SqliteResultCache()
+            except sqlite3.Error as e:
+                logger.warning("Falling back to in-memory result cache", error=str(e))
+                _result_cache = MemoryResultCache()
+        elif RESULT_CACHE_BACKEND == "s3" and RESULT_CACHE_S3_BUCKET:
+            _result_cache = S3ResultCache()
+        else:
+            _result_cache = ResultCache()  # Never hits
+    return _result_cache
@@ -0,0 +1,85 @@
+import os
+import json
+from typing import Dict, Iterator
+from helper.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class ResultsLog:
+    """
+    Append-only NDJSON log of analysis results, one JSON object per line.
+
+    Every record is written with a single write() on a file opened in append
+    mode and flushed right away, so a crash can at most leave one torn line at
+    the end. That line is terminated before appending again and skipped by
+    iter_results_log.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a+b")
+        self._terminate_torn_line()
+
+    def _terminate_torn_line(self):
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() == 0:
+            return
+        self._file.seek(-1, os.SEEK_END)
+        if self._file.read(1) != b"\n":
+            self._file.write(b"\n")
+            self._file.flush()
+
+    def append(self, record: Dict):
+        self._file.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+        self._file.flush()
+
+    def append_frame(self, entry: Dict):
+        self.append({"type": "frame", **entry})
+
+    def append_summary(self, summary: Dict):
+        self.append({"type": "summary", **summary})
+
+    def close(self):
+        if not self._file.closed:
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_results_log(path: str) -> Iterator[Dict]:
+    """
+    Stream the records of a results file.
+
+    NDJSON logs are read line by line; unreadable (torn) lines are skipped.
+    Legacy .json files holding a list of batch objects are still accepted and
+    yielded batch by batch.
+    """
+    if path.endswith(".json"):
+        with open(path, "r") as f:
+            for batch in json.load(f):
+                yield batch
+        return
+
+    with open(path, "rb") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Skipping unreadable line", line=line_number, path=path)
+
+
+def count_logged_frames(path: str) -> int:
+    """Number of frame records already in a results log, 0 if it does not exist"""
+    if not os.path.exists(path):
+        return 0
+    return sum(1 for record in iter_results_log(path) if record.get("type") == "frame")
@@ -0,0 +1,87 @@
+import os
+import random
+import asyncio
+import tempfile
+from botocore.exceptions import ClientError
+from helper.clients import pooled_s3_client
+from helper.log import get_logger
+from helper import profiler
+
+logger = get_logger(__name__)
+
+# Fetcher configuration
+S3_FETCH_CONCURRENCY = int(os.getenv("S3_FETCH_CONCURRENCY", "16"))
+S3_FETCH_RETRIES = int(os.getenv("S3_FETCH_RETRIES", "3"))
+S3_FETCH_BACKOFF = float(os.getenv("S3_FETCH_BACKOFF", "0.5"))  # Base delay in seconds, doubled per attempt
+# Frames larger than this are spooled to /tmp instead of being kept in memory
+S3_SPOOL_THRESHOLD = int(os.getenv("S3_SPOOL_THRESHOLD", str(8 * 1024 * 1024)))
+S3_CHUNK_SIZE = 256 * 1024
+
+# Errors that will not go away by asking again
+NON_RETRYABLE_ERRORS = {"NoSuchKey", "NoSuchBucket", "AccessDenied", "InvalidObjectState"}
+
+
+def open_s3_client(max_pool_connections: int = S3_FETCH_CONCURRENCY):
+    """
+    Returns an async context manager for the pooled S3 client whose connection
+    pool is sized for `max_pool_connections` parallel requests. The client stays
+    open after the block so later batches and warm invocations reuse its connections.
+    """
+    # Retries are handled in fetch_object
+    return pooled_s3_client(max_pool_connections=max_pool_connections, max_attempts=1)
+
+
+async def fetch_object(
+    s3_client,
+    bucket_name: str,
+    file_key: str,
+    retries: int = S3_FETCH_RETRIES,
+    spool_threshold: int = S3_SPOOL_THRESHOLD,
+):
+    """
+    Streams an S3 object into a buffer, retrying transient failures with
+    exponential backoff and jitter.
+
+    :param s3_client: aioboto3 S3 client.
+    :param bucket_name: Name of the S3 bucket.
+    :param file_key: Key of the object to fetch.
+    :param retries: Number of retries after the first attempt.
+    :param spool_threshold: Size in bytes above which the buffer is spooled to disk.
+    :return: A SpooledTemporaryFile positioned at the start of the object body.
+    """
+    for attempt in range(retries + 1):
+        buffer = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+        try:
+            with profiler.span("s3.get"):
+                response = await s3_client.get_object(Bucket=bucket_name, Key=file_key)
+                body = response['Body']
+                # Entering the body yields the raw aiohttp response, whose read() takes no size,
+                # so chunks are read from the StreamingBody and the block only releases the connection
+                async with body:
+                    while True:
+                        chunk = await body.read(S3_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        buffer.write(chunk)
+            profiler.count("s3.get_bytes", buffer.tell())
+            buffer.seek(0)
+            return buffer
+        except Exception as e:
+            buffer.close()
+            if isinstance(e, ClientError) and e.response.get("Error", {}).get("Code") in NON_RETRYABLE_ERRORS:
+                raise
+            if attempt == retries:
+                raise
+            profiler.count("s3.get_retries")
+            delay = S3_FETCH_BACKOFF * (2 ** attempt) * (0.5 + random.random())
+            logger.warning("Retrying download", key=file_key, delay=round(delay, 2), error=str(e), sample="fetch_retry")
+            await asyncio.sleep(delay)
+
+
+def read_buffer(buffer) -> bytes:
+    """Read a fetched buffer and release it (and any spooled file)"""
+    try:
+        buffer.seek(0)
+        return buffer.read()
+    finally:
+        buffer.close()
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from helper.timeline_analysis import clean_json_string
+
+# Analyze every SAMPLING_STRIDE-th frame first, then bisect where the results change
+SAMPLING_STRIDE = int(os.getenv("SAMPLING_STRIDE", "12"))
+
+
+def activity_signature(result: Dict) -> Optional[Tuple[str, str]]:
+    """(activity, active app) of an analyzed frame, None if it has no usable analysis"""
+    try:
+        analysis = json.loads(clean_json_string(result["analysis"]))
+        windows = analysis.get("open_windows") or [{}]
+        return analysis.get("activity"), windows[0].get("app", "")
+    except Exception:
+        return None
+
+
+def _same_activity(left: Dict, right: Dict) -> bool:
+    left_signature = activity_signature(left)
+    return left_signature is not None and left_signature == activity_signature(right)
+
+
+def _usable(result: Dict) -> bool:
+    """Failed frames say nothing about the activity, nothing is inferred from them"""
+    return activity_signature(result) is not None
+
+
+def _probe_order(left: int, right: int):
+    """Frames strictly between left and right, from the middle outwards"""
+    middle = (left + right) // 2
+    yield middle
+    for distance in range(1, right - left):
+        for index in (middle - distance, middle + distance):
+            if left < index < right:
+                yield index
+
+
+def settled_frames(frame_count: int, analyzed: Dict[int, Dict]) -> int:
+    """
+    Frames of the sequence whose timeline entry is known so far: the analyzed
+    ones and the frames between two neighbouring usable results that agree,
+    which will be inferred. Progress of adaptive_sample against all frames.
+    """
+    usable = sorted(index for index, result in analyzed.items() if _usable(result))
+    settled = len(analyzed)
+    for left, right in zip(usable, usable[1:]):
+        if _same_activity(analyzed[left], analyzed[right]):
+            settled += right - left - 1 - sum(1 for index in range(left + 1, right) if index in analyzed)
+    return min(settled, frame_count)
+
+
+async def adaptive_sample(
+    frame_count: int,
+    analyze_frame: Callable[[int], Awaitable[Dict]],
+    time_of_frame: Callable[[int], Optional[str]],
+    stride: int = SAMPLING_STRIDE,
+    analyzed: Dict[int, Dict] = None,
+    deadline: float = None,
+) -> Tuple[Optional[List[Dict]], int]:
+    """
+    Analyzes a sequence of frames by sampling and change-point bisection.
+
+    Every `stride`-th frame (plus the last one) is analyzed first. Whenever two
+    neighbouring analyzed frames disagree on activity or active app, the frame
+    halfway between them is analyzed and both halves are refined the same way,
+    until the change point sits between two adjacent frames. Frames inside
+    stable stretches are filled with a copy of the preceding analyzed result,
+    marked with "inferred": True.
+
+    Frames that failed (no usable analysis) are kept as they are and skipped:
+    the neighbours around them are compared instead, a failed midpoint is
+    replaced by the nearest frame that can be analyzed, and nothing is copied
+    from them.
+
+    The walk is deterministic, so it can be resumed: frames already in
+    `analyzed` are not analyzed again, and every new result is added to it.
+    Once `deadline` (time.time()) has passed no new frame is started and
+    (None, 0) is returned; calling again with the same `analyzed` continues.
+
+    :param frame_count: Number of frames in the sequence.
+    :param analyze_frame: Async callable analyzing the frame at an index, returning a timeline entry.
+    :param time_of_frame: Callable returning the time_from_start of the frame at an index.
+    :param stride: Distance between the initial samples.
+    :param analyzed: Results of earlier calls by frame index, updated in place.
+    :param deadline: time.time() after which no new frames are analyzed.
+    :return: Timeline entries for every frame in order, and the number of inferred entries.
+    """
+    if frame_count == 0:
+        return [], 0
+
+    analyzed = analyzed if analyzed is not None else {}
+    state = {"out_of_time": False}
+
+    async def analyze(index: int) -> bool:
+        if index in analyzed:
+            return True
+        if deadline is not None and time.time() >= deadline:
+            state["out_of_time"] = True
+            return False
+        analyzed[index] = await analyze_frame(index)
+        return True
+
+    samples = sorted(set(range(0, frame_count, max(1, stride))) | {frame_count - 1})
+    await asyncio.gather(*(analyze(index) for index in samples))
+    if state["out_of_time"]:
+        return None, 0
+
+    async def refine(left: int, right: int):
+        # Both ends are usable results
+        if right - left <= 1 or _same_activity(analyzed[left], analyzed[right]):
+            return
+        for middle in _probe_order(left, right):
+            if not await analyze(middle):
+                return
+            if _usable(analyzed[middle]):
+                await asyncio.gather(refine(left, middle), refine(middle, right))
+                return
+        # Every frame in between failed, they stay failed
+
+    usable = [index for index in samples if _usable(analyzed[index])]
+    await asyncio.gather(*(refine(left, right) for left, right in zip(usable, usable[1:])))
+    if state["out_of_time"]:
+        return None, 0
+
+    timeline = []
+    inferred = 0
+    usable = [index for index in sorted(analyzed) if _usable(analyzed[index])]
+    # Before the first usable result, frames are inferred from it instead of the preceding one
+    last_result = analyzed[usable[0]] if usable else None
+    for index in range(frame_count):
+        if index in analyzed:
+            if _usable(analyzed[index]):
+                last_result = analyzed[index]
+            timeline.append(analyzed[index])
+            continue
+        if last_result is None:
+            # Not one frame could be analyzed, there is nothing to infer from
+            timeline.append({"time_from_start": time_of_frame(index), "error": "Not analyzed, no frame to infer from"})
+            continue
+        entry = {key: value for key, value in last_result.items() if key not in ("time_from_start", "filename")}
+        entry["time_from_start"] = time_of_frame(index)
+        entry["inferred"] = True
+        timeline.append(entry)
+        inferred += 1
+    return timeline, inferred
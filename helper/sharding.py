@@ -0,0 +1,227 @@
+import os
+import math
+import shutil
+import asyncio
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from helper.checkpoint import get_checkpoint_store, phase_reached, require_shared_checkpoints
+from helper.clients import get_boto3_client, run
+from helper.log import get_logger
+
+logger = get_logger(__name__)
+
+# Fan-out configuration
+SHARD_SIZE = int(os.getenv("SHARD_SIZE", "300"))  # Frames per worker when no shard count is given
+SHARD_MAX_ATTEMPTS = int(os.getenv("SHARD_MAX_ATTEMPTS", "10"))  # Invocations per shard before giving up
+# A dispatched shard whose checkpoint has not moved for this long (past maxDuration) lost its
+# invocation chain and is dispatched again
+SHARD_STALE_SECONDS = float(os.getenv("SHARD_STALE_SECONDS", "120"))
+# Seconds between the coordinator's looks at the shards while it waits for them
+SHARD_POLL_INTERVAL = float(os.getenv("SHARD_POLL_INTERVAL", "5"))
+# "http" re-invokes this deployment, "process" runs shards in a local process pool (tests)
+SHARD_DISPATCH = os.getenv("SHARD_DISPATCH", "http")
+# "s3" shares shard outputs between function instances, "local" keeps them in /tmp
+SHARD_STORE = os.getenv("SHARD_STORE", "s3" if SHARD_DISPATCH == "http" else "local")
+SHARD_DIR = "/tmp/shards"
+SHARD_PREFIX = os.getenv("SHARD_PREFIX", "shards")
+SHARD_BUCKET = os.getenv("BUCKET_NAME")
+SELF_URL = os.getenv("SELF_URL") or (f"https://{os.getenv('VERCEL_URL')}" if os.getenv("VERCEL_URL") else None)
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+
+
+def plan_shards(frame_count: int, shard_count: int = None, shard_size: int = SHARD_SIZE) -> List[Tuple[int, int]]:
+    """Split frames 1..frame_count into contiguous, 1-based inclusive (start_no, end_no) ranges"""
+    if frame_count <= 0:
+        return []
+    if not shard_count:
+        shard_count = math.ceil(frame_count / shard_size)
+    size = math.ceil(frame_count / min(shard_count, frame_count))
+    return [(start, min(start + size - 1, frame_count)) for start in range(1, frame_count + 1, size)]
+
+
+def shard_id(submission_id: str, start_no: int, end_no: int) -> str:
+    """Id a shard is checkpointed under"""
+    return f"{submission_id}__{start_no:06d}-{end_no:06d}"
+
+
+def shard_results_file(submission_id: str, start_no: int, end_no: int) -> str:
+    return os.path.join(SHARD_DIR, submission_id, f"{start_no:06d}-{end_no:06d}.ndjson")
+
+
+def _shard_key(submission_id, start_no, end_no):
+    return f"{SHARD_PREFIX}/{submission_id}/{start_no:06d}-{end_no:06d}.ndjson"
+
+
+def publish_shard_results(submission_id: str, start_no: int, end_no: int):
+    """Make a finished shard's results log available to the coordinator"""
+    if SHARD_STORE == "s3":
+        get_boto3_client('s3', endpoint_url=S3_ENDPOINT_URL).upload_file(
+            shard_results_file(submission_id, start_no, end_no), SHARD_BUCKET, _shard_key(submission_id, start_no, end_no)
+        )
+
+
+def fetch_shard_results(submission_id: str, start_no: int, end_no: int) -> Optional[str]:
+    """Local path of a published shard results log, None if the shard has not finished"""
+    from botocore.exceptions import ClientError
+
+    path = shard_results_file(submission_id, start_no, end_no)
+    if SHARD_STORE != "s3":
+        return path if os.path.exists(path) else None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        get_boto3_client('s3', endpoint_url=S3_ENDPOINT_URL).download_file(
+            SHARD_BUCKET, _shard_key(submission_id, start_no, end_no), path
+        )
+        return path
+    except ClientError:
+        return None
+
+
+def reduce_shards(submission_id: str, ranges: List[Tuple[int, int]], results_file: str):
+    """
+    Concatenate shard results logs in frame order into the submission's results log.
+    Each shard ends with its own summary record, which the timeline analysis adds up.
+    """
+    os.makedirs(os.path.dirname(results_file), exist_ok=True)
+    with open(results_file, 'wb') as output:
+        for start_no, end_no in ranges:
+            path = fetch_shard_results(submission_id, start_no, end_no)
+            if path is None:
+                raise RuntimeError(f"Results of shard {start_no}-{end_no} are missing")
+            with open(path, 'rb') as shard_file:
+                shutil.copyfileobj(shard_file, output)
+    shutil.rmtree(os.path.join(SHARD_DIR, submission_id), ignore_errors=True)
+    logger.info("Merged shards", shards=len(ranges), results_file=results_file)
+
+
+async def invoke_self(params: Dict):
+    """
+    Call this deployment's /api with `params` and only wait until the request is
+    delivered, the invocation it starts outlives this call. Raises if the
+    request could not be delivered.
+    """
+    import httpx
+
+    if not SELF_URL:
+        raise ValueError("SELF_URL (or VERCEL_URL) is required to invoke this deployment.")
+    try:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=1.0)) as client:
+            await client.get(f"{SELF_URL}/api", params=params)
+    except httpx.ReadTimeout:
+        pass
+
+
+def shard_params(submission_id: str, start_no: int, end_no: int) -> Dict:
+    return {"submission_id": submission_id, "start_no": start_no, "end_no": end_no}
+
+
+def _last_activity(checkpoint: Optional[Dict], dispatched: Dict) -> float:
+    """time.time() of the latest dispatch or checkpoint save of a shard"""
+    last = dispatched.get("at", 0.0)
+    if checkpoint and checkpoint.get("updated_at"):
+        last = max(last, datetime.fromisoformat(checkpoint["updated_at"]).timestamp())
+    return last
+
+
+async def _dispatch_http(submission_id: str, start_no: int, end_no: int, dispatched: Dict) -> Dict:
+    """
+    State of one shard from its checkpoint, (re)dispatching it when it has not
+    been dispatched yet or its invocation chain went stale. `dispatched` is the
+    coordinator's record of the shard's dispatches and is updated in place.
+    """
+    checkpoint = await asyncio.to_thread(get_checkpoint_store().load, shard_id(submission_id, start_no, end_no))
+    if checkpoint is not None and phase_reached(checkpoint, "timeline_analysis"):
+        return {"status": "success", "frames_done": checkpoint["frames_done"]}
+    if checkpoint is not None and checkpoint.get("error"):
+        return {"status": "error", "message": checkpoint["error"]}
+    frames_done = checkpoint["frames_done"] if checkpoint else 0
+
+    if dispatched and time.time() - _last_activity(checkpoint, dispatched) < SHARD_STALE_SECONDS:
+        return {"status": "running", "frames_done": frames_done}
+    if dispatched.get("count", 0) >= SHARD_MAX_ATTEMPTS:
+        return {"status": "error", "message": f"Shard {start_no}-{end_no} stalled after {dispatched['count']} dispatches"}
+    if dispatched:
+        logger.warning("Shard stalled, dispatching again", start_no=start_no, end_no=end_no, dispatches=dispatched["count"])
+    try:
+        await invoke_self(shard_params(submission_id, start_no, end_no))
+    except Exception as e:
+        # Counted as a dispatch all the same, the shard is retried once it is stale
+        logger.warning("Could not dispatch shard", start_no=start_no, end_no=end_no, error=str(e))
+    dispatched.update(at=time.time(), count=dispatched.get("count", 0) + 1)
+    return {"status": "running", "frames_done": frames_done}
+
+
+async def continue_shard(store, checkpoint: Dict, submission_id: str, start_no: int, end_no: int):
+    """Hand an unfinished shard on to its next invocation, or give up after SHARD_MAX_ATTEMPTS"""
+    checkpoint["runs"] = checkpoint.get("runs", 0) + 1
+    if checkpoint["runs"] >= SHARD_MAX_ATTEMPTS:
+        checkpoint["error"] = f"Shard {start_no}-{end_no} gave up after {checkpoint['runs']} invocations"
+        logger.error("Shard gave up", start_no=start_no, end_no=end_no, runs=checkpoint["runs"])
+    store.save(checkpoint)
+    if checkpoint.get("error"):
+        return
+    try:
+        await invoke_self(shard_params(submission_id, start_no, end_no))
+    except Exception as e:
+        # The coordinator dispatches the shard again once its checkpoint is stale
+        logger.warning("Could not continue shard", start_no=start_no, end_no=end_no, error=str(e))
+
+
+def _run_shard_in_process(submission_id: str, start_no: int, end_no: int) -> Dict:
+    # Imported here, helper.entry depends on this module
+    from helper.entry import analyze_shard
+    from helper.preprocess import shutdown_preprocess_executor
+
+    result = {"status": "error", "message": "not run"}
+    try:
+        for _ in range(SHARD_MAX_ATTEMPTS):
+            result = run(analyze_shard(submission_id, start_no, end_no))
+            if result["status"] == "success":
+                break
+    finally:
+        # The pool reuses this worker for the next shard, but its exit would join the idle preprocessing workers
+        shutdown_preprocess_executor()
+    return result
+
+
+async def run_shards(
+    submission_id: str, ranges: List[Tuple[int, int]], dispatch: str = SHARD_DISPATCH, dispatches: Dict = None
+) -> List[Dict]:
+    """
+    Get every shard going and return one result dict per range, in order, with
+    a status of "success", "running" (or "partial") or "error".
+
+    With SHARD_DISPATCH=http the shards are fired off as separate invocations of
+    this deployment and this only reports where they stand: each shard chains
+    its own invocations until it is done, and is dispatched again when its chain
+    goes stale. `dispatches` records the dispatches per shard between calls and
+    belongs in the coordinator's checkpoint. SHARD_DISPATCH=process runs the
+    pending shards to completion in a local process pool.
+    """
+    if dispatch != "process":
+        require_shared_checkpoints("to dispatch shards over HTTP")
+        dispatches = dispatches if dispatches is not None else {}
+        return list(await asyncio.gather(*(
+            _dispatch_http(submission_id, start_no, end_no, dispatches.setdefault(f"{start_no}-{end_no}", {}))
+            for start_no, end_no in ranges
+        )))
+
+    pending = [r for r in ranges if fetch_shard_results(submission_id, *r) is None]
+    logger.info("Running shards", pending=len(pending), shards=len(ranges), dispatch=dispatch)
+    results = {r: {"status": "success", "message": "already done"} for r in ranges if r not in pending}
+
+    loop = asyncio.get_running_loop()
+    # Spawned, a worker forked from the thread running the shared event loop inherits
+    # its locks held and deadlocks in the preprocessing pool it forks in turn
+    spawn = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max(1, len(pending)), mp_context=spawn) as pool:
+        outcomes = await asyncio.gather(*(
+            loop.run_in_executor(pool, _run_shard_in_process, submission_id, start_no, end_no)
+            for start_no, end_no in pending
+        ))
+
+    results.update(zip(pending, outcomes))
+    return [results[r] for r in ranges]
@@ -2,25 +2,52 @@ import os
 import json
 from collections import Counter
 import asyncio
-from openai import AsyncOpenAI
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 
 
-from helper.upload_to_S3 import main as upload_to_S3_main  # Import the function from upload.py
+from helper.clients import get_openai_client
+from helper.log import get_logger, bind_log_context
+from helper import profiler
+from helper.checkpoint import get_checkpoint_store, new_checkpoint, phase_reached, advance
+from helper.rate_limiter import get_rate_limiter
+from helper.results_log import iter_results_log
+from helper.pipeline import run_graph
+from helper.upload_to_S3 import open_upload_client, upload_json_to_s3, artifact_key, delete_local_json_files
+
+logger = get_logger(__name__)
+
+# Long sessions are merged and summarized in windows of this many seconds, processed in parallel
+TIMELINE_WINDOW_SECONDS = int(os.getenv("TIMELINE_WINDOW_SECONDS", "1800"))
+# Context each window also sees from its neighbours, so boundary-crossing prompts can be stitched
+TIMELINE_WINDOW_OVERLAP_SECONDS = int(os.getenv("TIMELINE_WINDOW_OVERLAP_SECONDS", "120"))
 
 
 def merge_timelines(data):
-    # Combine multiple timeline entries into a single object
+    # Combine a stream of results records into a single object. Records are
+    # either single frames and run summaries from the NDJSON log, or legacy
+    # batch objects holding a whole "timeline" list.
     merged_timeline = []
     total_screenshots = 0
+    deduplicated_frames = 0
+    inferred_frames = 0
     processing_time = "0 seconds"
     last_updated = None
 
     for entry in data:
+        if entry.get("type") == "frame":
+            frame = dict(entry)
+            del frame["type"]
+            merged_timeline.append(frame)
+            continue
         # Add all timeline objects to the merged timeline
         merged_timeline.extend(entry.get("timeline", []))
         # Accumulate total screenshots
         total_screenshots += entry.get("total_screenshots", 0)
+        # Frames whose result was reused from a near-identical previous frame
+        deduplicated_frames += entry.get("deduplicated_frames", 0)
+        # Frames filled in by adaptive sampling instead of being analyzed
+        inferred_frames += entry.get("inferred_frames", 0)
         # Use the latest processing time and last_updated timestamp
         processing_time = entry.get("processing_time", processing_time)
         last_updated = entry.get("last_updated", last_updated)
@@ -28,6 +55,8 @@ def merge_timelines(data):
     return {
         "timeline": merged_timeline,
         "total_screenshots": total_screenshots,
+        "deduplicated_frames": deduplicated_frames,
+        "inferred_frames": inferred_frames,
         "processing_time": processing_time,
         "last_updated": last_updated
     }
@@ -42,109 +71,135 @@ def clean_json_string(json_str):
     return json_str
 
 
-def analyze_timeline_file(file_path):
-    # Read the JSON file
-    print(f"Analyzing file path : {file_path}")
-    with open(file_path, 'r') as file:
-        data = json.load(file)
-        print(f"Data in json file of timeline : {data}")
-        singleData = merge_timelines(data)
-        print("z")
-        print(f"single data {singleData}")
-        timeline_data = singleData.get("timeline", [])  # Get timeline as list, empty list if not found
-        print("x")
-    # Calculate time interval from first two entries
-    time_interval = 5  # default fallback value
-    if len(timeline_data) >= 2:
-        try:
-            time1 = int(timeline_data[0]["time_from_start"][-2:])
-            time2 = int(timeline_data[1]["time_from_start"][-2:])
-            time_interval = time2 - time1
-            print(f"Detected time interval between entries: {time_interval} seconds")
-        except (KeyError, TypeError) as e:
-            print(f"Warning: Could not calculate time interval, using default - {str(e)}")
-    print("c")
-    # Initialize counters and lists
-    activities = []
-    prompts_with_time = []
-    print(f"timeline_data : {timeline_data}")
-    # Process each timeline entry
-    for entry in timeline_data:
+class TimelineAccumulator:
+    """
+    Builds every derived timeline output in a single pass over the results.
+
+    Each frame's analysis is parsed once and feeds the activity counts, the
+    prompts timeline and the de-duplicated app/action timeline together, so
+    memory only grows with the size of those outputs, not with the number of frames.
+    """
+
+    def __init__(self):
+        self.activity_counts = Counter()
+        self.prompts_with_time = []
+        self.app_actions_timeline = []
+        self.previous_app_action = None
+        self.first_times = []
+        self.frames = 0
+        self.total_screenshots = 0
+        self.deduplicated_frames = 0
+        self.inferred_frames = 0
+        self.preprocessing = Counter()
+        self.processing_time = "0 seconds"
+        self.last_updated = None
+
+    def add_record(self, record):
+        """Add one record of the results log (frame, run summary or legacy batch object)"""
+        if record.get("type") == "frame":
+            self.add_entry(record)
+            return
+        for entry in record.get("timeline", []):
+            self.add_entry(entry)
+        self.total_screenshots += record.get("total_screenshots", 0)
+        self.deduplicated_frames += record.get("deduplicated_frames", 0)
+        self.inferred_frames += record.get("inferred_frames", 0)
+        self.preprocessing.update(record.get("preprocessing", {}))
+        self.processing_time = record.get("processing_time", self.processing_time)
+        self.last_updated = record.get("last_updated", self.last_updated)
+
+    def add_entry(self, entry):
+        """Add one timeline entry"""
+        self.frames += 1
+        if len(self.first_times) < 2:
+            self.first_times.append(entry.get("time_from_start"))
+
         try:
             # Clean and parse the analysis JSON string
-            analysis_str = clean_json_string(entry["analysis"])
-            analysis = json.loads(analysis_str)
-            print("v")
+            analysis = json.loads(clean_json_string(entry["analysis"]))
+            time_from_start = entry["time_from_start"]
+        except Exception as e:
+            logger.warning("Could not process timeline entry", error=str(e), sample="timeline_entry_error")
+            return
+
+        try:
             # Extract activity for counting
-            activity = analysis["activity"]
-            activities.append(activity)
-            print("b")
+            self.activity_counts[analysis["activity"]] += 1
             # Extract prompts with timestamps
-            time_from_start = entry["time_from_start"]
-            windows = analysis["open_windows"]
-            print("n")
-            for window in windows:
+            for window in analysis["open_windows"]:
                 if "prompt" in window and window["prompt"]:  # Only include non-empty prompts
-                    prompts_with_time.append({
+                    self.prompts_with_time.append({
                         "time_from_start": time_from_start,
                         "prompt": window["prompt"]
                     })
         except Exception as e:
-            print(f"Warning: Error processing entry - {str(e)}")
-            continue
-    print("m")
-    # Count activities and multiply by dynamic time interval
-    activity_durations = {
-        activity: count * time_interval for activity, count in Counter(activities).items()
-    }
-    print("l")
-    # Create final output
-    output = {
-        "activity_durations": activity_durations,
-        "prompts_timeline": prompts_with_time,
-        "metadata": {
-            "total_screenshots": singleData.get("total_screenshots"),
-            "processing_time": singleData.get("processing_time"),
-            "last_updated": singleData.get("last_updated"),
-            "time_interval": time_interval
-        }
-    }
+            logger.warning("Could not process timeline entry", error=str(e), sample="timeline_entry_error")
 
-    return output
+        try:
+            for window in analysis["open_windows"]:
+                current_entry = {
+                    "time": time_from_start,
+                    "app": window.get("app", ""),
+                    "action": window.get("action", "")
+                }
+                # Only add if different from previous entry
+                previous_entry = self.previous_app_action
+                if previous_entry is None or (
+                    previous_entry["app"] != current_entry["app"] or
+                    previous_entry["action"] != current_entry["action"]
+                ):
+                    self.app_actions_timeline.append(current_entry)
+                    self.previous_app_action = current_entry
+        except Exception as e:
+            logger.warning("Could not process timeline entry for app actions", error=str(e), sample="app_action_error")
+
+    def time_interval(self):
+        # Calculate time interval from first two entries
+        time_interval = 5  # default fallback value
+        if len(self.first_times) >= 2:
+            try:
+                time_interval = int(self.first_times[1][-2:]) - int(self.first_times[0][-2:])
+                logger.debug("Detected time interval between entries", seconds=time_interval)
+            except (TypeError, ValueError) as e:
+                logger.warning("Could not calculate time interval, using the default", seconds=time_interval, error=str(e))
+        return time_interval
+
+    def output(self):
+        time_interval = self.time_interval()
+        # Count activities and multiply by dynamic time interval
+        activity_durations = {
+            activity: count * time_interval for activity, count in self.activity_counts.items()
+        }
+        return {
+            "activity_durations": activity_durations,
+            "prompts_timeline": self.prompts_with_time,
+            "app_actions_timeline": self.app_actions_timeline,
+            "metadata": {
+                "total_screenshots": self.total_screenshots,
+                "deduplicated_frames": self.deduplicated_frames,
+                "inferred_frames": self.inferred_frames,
+                "preprocessing": dict(self.preprocessing),
+                "processing_time": self.processing_time,
+                "last_updated": self.last_updated,
+                "time_interval": time_interval
+            }
+        }
 
 
-def save_prompts_timeline(file_path, output):
-    """Save prompts timeline to a separate file with _prompts suffix"""
-    # Get the file name without extension
-    base_name = file_path.rsplit('.', 1)[0]
-    prompts_file = f"{base_name}_prompts.json"
-    
-    # Extract just the prompts timeline
-    prompts_data = {
-        "prompts_timeline": output["prompts_timeline"],
-        "metadata": output["metadata"]
-    }
-    
-    # Save to file
-    with open(prompts_file, 'w') as f:
-        json.dump(prompts_data, f, indent=2)
-    
-    print(f"Prompts timeline saved to {prompts_file}")
+def analyze_timeline_file(file_path):
+    """Stream the results log once and build all timeline outputs from it"""
+    accumulator = TimelineAccumulator()
+    for record in iter_results_log(file_path):
+        accumulator.add_record(record)
+    logger.info("Read timeline entries", path=file_path, entries=accumulator.frames)
+    return accumulator.output()
 
 
-def save_activity_durations(file_path, output, assignment_id, user_id, submission_id):
-    """Save activity durations to a separate file with _activities suffix"""
-    # Print raw data in seconds
-    print("\nRaw activity durations (in seconds):")
+def build_activity_durations(output):
+    """Time spent per activity in minutes, top 5 activities and the rest as "Other" """
     sorted_raw = sorted(output["activity_durations"].items(), key=lambda x: x[1], reverse=True)
-    for activity, duration in sorted_raw:
-        print(f"{activity}: {duration} seconds")
-    print()  # Empty line for better readability
-    
-    # Get the file name without extension
-    base_name = file_path.rsplit('.', 1)[0]
-    activities_file = f"/tmp/timeline_analysis/{submission_id}/{assignment_id}_{user_id}_time_spent.json"
-    
+    logger.debug("Raw activity durations in seconds", durations=dict(sorted_raw))
+
     # Convert seconds to minutes for all activities
     activity_minutes = {
         activity: round(duration / 60, 2) 
@@ -169,131 +224,75 @@ def save_activity_durations(file_path, output, assignment_id, user_id, submissio
     
     # Add unit information to metadata
     activity_data["metadata"]["duration_unit"] = "minutes"
-    
-    # Save to file
-    with open(activities_file, 'w') as f:
-        json.dump(activity_data, f, indent=2)
-    
-    print(f"Activity durations saved to {activities_file}")
+    return activity_data
 
 
-def save_raw_prompts(file_path, output, assignment_id, user_id, submission_id):
-    """Save raw prompts timeline without any processing"""
-    base_name = file_path.rsplit('.', 1)[0]
-    raw_prompts_file = f"/tmp/timeline_analysis/{submission_id}/{assignment_id}_{user_id}_raw_prompts.json"
-    
-    # Extract just the prompts timeline without any processing
-    raw_prompts_data = {
+def build_raw_prompts(output):
+    """Raw prompts timeline without any processing"""
+    return {
         "prompts_timeline": output["prompts_timeline"],
         "metadata": output["metadata"]
     }
-    
-    # Save to file
-    with open(raw_prompts_file, 'w') as f:
-        json.dump(raw_prompts_data, f, indent=2)
-    
-    print(f"Raw prompts timeline saved to {raw_prompts_file}")
 
 
-def save_app_actions(file_path, output, assignment_id, user_id, submission_id):
-    """Save app and action timeline without consecutive duplicates"""
-    base_name = file_path.rsplit('.', 1)[0]
-    app_actions_file = f"/tmp/timeline_analysis/{submission_id}/{assignment_id}_{user_id}_app_actions.json"
-    
-    app_actions_timeline = []
-    previous_entry = None
-    print(f"file path : {file_path}")
-    # Read the original timeline data again
-    with open(file_path, 'r') as file:
-        data = json.load(file)
-        print(f"Data in json file of timeline at save_app_actions : {data}")
-        filtered_data = merge_timelines(data)
-        print(f"filtered data : {filtered_data}")
-        timeline_data = filtered_data.get("timeline", [])
-    
-    # Process through the timeline data
-    for entry in timeline_data:
-        try:
-            time = entry["time_from_start"]
-            analysis_str = clean_json_string(entry["analysis"])
-            analysis = json.loads(analysis_str)
-            windows = analysis["open_windows"]
-            
-            for window in windows:
-                current_entry = {
-                    "time": time,
-                    "app": window.get("app", ""),
-                    "action": window.get("action", "")
-                }
-                
-                # Only add if different from previous entry
-                if previous_entry is None or (
-                    previous_entry["app"] != current_entry["app"] or 
-                    previous_entry["action"] != current_entry["action"]
-                ):
-                    app_actions_timeline.append(current_entry)
-                    previous_entry = current_entry
-        except Exception as e:
-            print(f"Warning: Error processing entry for app actions - {str(e)}")
-            continue
-    
-    # Prepare output data
-    app_actions_data = {
-        "app_actions_timeline": app_actions_timeline,
+def build_app_actions(output):
+    """App and action timeline without consecutive duplicates"""
+    return {
+        "app_actions_timeline": output["app_actions_timeline"],
         "metadata": output["metadata"]
     }
-    
-    # Save to file
-    with open(app_actions_file, 'w') as f:
-        json.dump(app_actions_data, f, indent=2)
-    
-    print(f"App actions timeline saved to {app_actions_file}")
+
+
+def artifact_name(assignment_id, user_id, kind):
+    """File name an artifact is uploaded under"""
+    return f"{assignment_id}_{user_id}_{kind}.json"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting, about 4 characters per token"""
+    return len(text) // 4 + 1
 
 
 async def merge_prompts_with_gpt4(prompts_data: dict, api_key: str) -> dict:
-    """Merge similar prompts using GPT-4V API"""
-    client = AsyncOpenAI(api_key=api_key)
+    """Merge similar prompts using GPT-4V API, raises if the request or its JSON fails"""
+    client = get_openai_client(api_key)
     
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            response_format={"type": "json_object"},
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"""Here is a list of prompts user asked AI tools extracted from user's screenshots every 5/10 secs. 
+        content = f"""Here is a list of prompts user asked AI tools extracted from user's screenshots every 5/10 secs. 
                     When we are taking screenshots sometimes we don't see entire text because of limited text box size (text can overflow) 
                     and the user could be editing their prompt in between, your task is to merge such prompts and figure out the prompt 
                     user typed. You also need to mention the time for each prompt, which still keeping all distinct prompts as sperate entries. 
                     Output JSON in same format as input json:
                     
                     {json.dumps(prompts_data, indent=2)}"""
+        response = await get_rate_limiter("gpt-4o").call(lambda: client.chat.completions.with_raw_response.create(
+            model="gpt-4o",
+            response_format={"type": "json_object"},
+            messages=[
+                {
+                    "role": "user",
+                    "content": content
                 }
             ],
             max_tokens=10000,
             temperature=0
-        )
+        ), estimated_tokens=estimate_tokens(content) + 10000)
         
         merged_data = json.loads(response.choices[0].message.content)
-        print ("Merged prompts successfully")
+        logger.info("Merged prompts")
         return merged_data
         
     except Exception as e:
-        print(f"Error in merging prompts: {str(e)}")
-        return prompts_data
+        logger.warning("Could not merge prompts", error=str(e))
+        raise
 
 
 async def analyze_app_actions_with_o1(app_actions_data: dict, api_key: str) -> dict:
-    """Analyze app actions timeline using GPT-4 to merge similar activities"""
-    client = AsyncOpenAI(api_key=api_key)
-    print(f"App actions data: {app_actions_data}")
+    """Analyze app actions timeline using GPT-4 to merge similar activities, raises if the request or its JSON fails"""
+    client = get_openai_client(api_key)
+    logger.debug("Summarizing app actions", actions=len(app_actions_data.get("app_actions_timeline", [])), payload=app_actions_data)
     try:
-        response = await client.chat.completions.create(
-            model="o1-preview",
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"""There's a candidate whose time series activity log is input. Your task is to merge logically similar activties together and output in following format. For coding activities, you can split based on each bug or issue user faced. Fixing each bug/issue may have required the user to do multiple things like search on AI, code, test and then search again, in that case those can be merged because they are for same issue.
+        content = f"""There's a candidate whose time series activity log is input. Your task is to merge logically similar activties together and output in following format. For coding activities, you can split based on each bug or issue user faced. Fixing each bug/issue may have required the user to do multiple things like search on AI, code, test and then search again, in that case those can be merged because they are for same issue.
 
 Output format
 [{{
@@ -304,86 +303,249 @@ details: <Bullet point List of things the user did during this activity>,
 
 Input:
 {json.dumps(app_actions_data, indent=2)}"""
+        response = await get_rate_limiter("o1-preview").call(lambda: client.chat.completions.with_raw_response.create(
+            model="o1-preview",
+            messages=[
+                {
+                    "role": "user",
+                    "content": content
                 }
             ],
-        )
+        ), estimated_tokens=estimate_tokens(content) * 2)
         analyzed_data = json.loads(response.choices[0].message.content[8:-4])
-    
-                
-        print("App actions analysis completed successfully")
+        logger.info("Summarized app actions")
         return analyzed_data
         
     except Exception as e:
-        print(f"Error in analyzing app actions: {str(e)}")
-        return app_actions_data
-
-
-async def main(submission_id, assignment_id, user_id):
-    # Configuration
-    file_path = f"/tmp/analysis/{submission_id}.json"
-    base_name = f"{submission_id}.json"
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+        logger.warning("Could not summarize app actions", error=str(e))
+        raise
 
-    # Create a new folder for the `submission_id`
-    submission_folder = f"/tmp/timeline_analysis/{submission_id}"
-    os.makedirs(submission_folder, exist_ok=True)
 
-    # Analyze the timeline file
+def _clock_seconds(value) -> Optional[int]:
+    """Seconds since midnight of a "HH:MM:SS" time, None if it is not one"""
     try:
-        analysis_output = analyze_timeline_file(file_path)
-        print(f"Timeline analysis completed successfully: {analysis_output}")
-    except Exception as e:
-        print(f"Error analyzing timeline file: {str(e)}")
-        return
+        hours, minutes, seconds = (int(part) for part in str(value).split(":"))
+    except ValueError:
+        return None
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def _session_seconds(value, reference: float) -> Optional[float]:
+    """Seconds into the session of a clock time, on the day closest to `reference`"""
+    seconds = _clock_seconds(value)
+    if seconds is None:
+        return None
+    day = round((reference - seconds) / 86400)
+    return seconds + day * 86400
+
+
+def split_windows(entries: List[Dict], time_field: str, window: float = TIMELINE_WINDOW_SECONDS,
+                  overlap: float = TIMELINE_WINDOW_OVERLAP_SECONDS) -> List[Tuple[float, float, List[Dict]]]:
+    """
+    Split a timeline into consecutive windows of `window` seconds.
+
+    Returns (start, end, entries) per window, where entries also include the
+    `overlap` seconds on either side so the model sees prompts and activities
+    that cross the boundary. Results are later kept only by the window whose
+    [start, end) range they start in.
+    """
+    times = []
+    previous = None
+    for entry in entries:
+        seconds = _clock_seconds(entry.get(time_field))
+        if seconds is None:
+            seconds = previous if previous is not None else 0
+        elif previous is not None:
+            seconds = _session_seconds(entry.get(time_field), previous)  # Sessions may cross midnight
+        times.append(seconds)
+        previous = seconds
+    if not times:
+        return []
+
+    windows = []
+    start = times[0]
+    while start <= times[-1]:
+        end = start + window
+        window_entries = [
+            entry for entry, seconds in zip(entries, times) if start - overlap <= seconds < end + overlap
+        ]
+        if any(start <= seconds < end for seconds in times):
+            windows.append((start, end, window_entries))
+        start = end
+    # The last window owns everything after it
+    start, _, window_entries = windows[-1]
+    windows[-1] = (start, float("inf"), window_entries)
+    return windows
+
+
+def _owned(value, start: float, end: float) -> bool:
+    seconds = _session_seconds(value, start)
+    return seconds is None or start <= seconds < end
+
+
+def _normalized_prompt(prompt) -> str:
+    return " ".join(str(prompt).lower().split())
+
+
+def stitch_prompts(merged: List[Dict], window_prompts: List[Dict]) -> List[Dict]:
+    """
+    Append a window's prompts to the merged ones. A prompt typed across the
+    boundary shows up at the end of one window and the start of the next,
+    once partially, so the longer version is kept at the earlier time.
+    """
+    if merged and window_prompts:
+        left, right = merged[-1], window_prompts[0]
+        left_text, right_text = _normalized_prompt(left.get("prompt", "")), _normalized_prompt(right.get("prompt", ""))
+        if left_text and right_text and (left_text.startswith(right_text) or right_text.startswith(left_text)):
+            longer = left if len(left_text) >= len(right_text) else right
+            merged[-1] = {**longer, "time_from_start": left.get("time_from_start", longer.get("time_from_start"))}
+            window_prompts = window_prompts[1:]
+    return merged + window_prompts
+
+
+async def merge_prompts_map_reduce(prompts_data: dict, api_key: str) -> dict:
+    """
+    merge_prompts_with_gpt4 over overlapping time windows in parallel, so
+    latency and request size are bounded by one window instead of the session.
+    Raises if any window fails, so the step is retried instead of saved unmerged.
+    """
+    timeline = prompts_data.get("prompts_timeline", [])
+    windows = split_windows(timeline, "time_from_start")
+    if len(windows) <= 1:
+        return await merge_prompts_with_gpt4(prompts_data, api_key)
+
+    logger.info("Merging prompts in windows", prompts=len(timeline), windows=len(windows))
+    results = await asyncio.gather(*(
+        merge_prompts_with_gpt4({"prompts_timeline": entries, "metadata": prompts_data.get("metadata", {})}, api_key)
+        for _, _, entries in windows
+    ))
+    merged = []
+    for (start, end, _), result in zip(windows, results):
+        prompts = result.get("prompts_timeline") if isinstance(result, dict) else result
+        if not isinstance(prompts, list):
+            raise ValueError(f"Unexpected merge result for the window starting at {start}")
+        merged = stitch_prompts(merged, [
+            prompt for prompt in prompts if isinstance(prompt, dict) and _owned(prompt.get("time_from_start"), start, end)
+        ])
+    return {"prompts_timeline": merged, "metadata": {**prompts_data.get("metadata", {}), "windows": len(windows)}}
+
+
+async def analyze_app_actions_map_reduce(app_actions_data: dict, api_key: str):
+    """
+    analyze_app_actions_with_o1 over overlapping time windows in parallel.
+    Each window keeps the activities that start inside it. Raises if any
+    window fails, so the step is retried instead of saved unsummarized.
+    """
+    timeline = app_actions_data.get("app_actions_timeline", [])
+    windows = split_windows(timeline, "time")
+    if len(windows) <= 1:
+        return await analyze_app_actions_with_o1(app_actions_data, api_key)
+
+    logger.info("Summarizing app actions in windows", actions=len(timeline), windows=len(windows))
+    results = await asyncio.gather(*(
+        analyze_app_actions_with_o1({"app_actions_timeline": entries, "metadata": app_actions_data.get("metadata", {})}, api_key)
+        for _, _, entries in windows
+    ))
+    summary = []
+    for (start, end, _), result in zip(windows, results):
+        if not isinstance(result, list):
+            raise ValueError(f"Unexpected app actions summary for the window starting at {start}")
+        summary.extend(
+            activity for activity in result if isinstance(activity, dict) and _owned(activity.get("time"), start, end)
+        )
+    return summary
 
-    # Save processed outputs
-    save_prompts_timeline(file_path, analysis_output)
-    save_activity_durations(file_path, analysis_output, assignment_id, user_id, submission_id)
-    save_raw_prompts(file_path, analysis_output, assignment_id, user_id, submission_id)
-    save_app_actions(file_path, analysis_output, assignment_id, user_id, submission_id)
 
-    # Merge prompts using GPT-4 API
-    try:
-        prompts_file_path = f"{submission_folder}/{assignment_id}_{user_id}_raw_prompts.json"
-        with open(prompts_file_path, "r") as f:
-            raw_prompts_data = json.load(f)
-        
-        merged_prompts = await merge_prompts_with_gpt4(raw_prompts_data, OPENAI_API_KEY)
-        
-        # Save merged prompts
-        merged_prompts_file = f"{submission_folder}/{assignment_id}_{user_id}_ai_prompts.json"
-        with open(merged_prompts_file, "w") as f:
-            json.dump(merged_prompts, f, indent=2)
-        print(f"Merged prompts saved to {merged_prompts_file}")
-    except Exception as e:
-        print(f"Error merging prompts: {str(e)}")
+async def main(submission_id, assignment_id, user_id, checkpoint=None, checkpoint_store=None):
+    """
+    Post-processing of an analyzed submission, run as a dependency graph:
 
-    # Analyze app actions timeline using GPT
-    try:
-        app_actions_file_path = f"{submission_folder}/{assignment_id}_{user_id}_app_actions.json"
-        with open(app_actions_file_path, "r") as f:
-            app_actions_data = json.load(f)
-
-        analyzed_app_actions = await analyze_app_actions_with_o1(app_actions_data, OPENAI_API_KEY)
-        print(f"App actions analysis completed successfully: {analyzed_app_actions}")
-        # Save analyzed app actions
-        analyzed_app_actions_file = f"{submission_folder}/{assignment_id}_{user_id}_timeline_summary.json"
-        with open(analyzed_app_actions_file, "w") as f:
-            json.dump(analyzed_app_actions, f, indent=2)
-            
-        with open(analyzed_app_actions_file, "r") as f:
-            actual_data = json.load(f)
-            print(f"Data in analyzed app actions file : {actual_data}")
-        print(f"Analyzed app actions saved to {analyzed_app_actions_file}")
-    except Exception as e:
-        print(f"Error analyzing app actions: {str(e)}")
+        timeline -> time_spent, raw_prompts, app_actions  -> uploaded right away
+                 -> ai_prompts (prompt merging)            -> uploaded when ready
+                 -> timeline_summary (app actions summary) -> uploaded when ready
 
-    # Upload all results to S3
-    try:
-        await upload_to_S3_main(submission_id)
-        print(f"All results uploaded to S3 from {submission_folder}")
-    except Exception as e:
-        print(f"Error uploading results to S3: {str(e)}")
+    The two LLM steps run concurrently and all data is passed in memory. LLM
+    outputs are kept in the checkpoint, so a re-invocation only redoes what is
+    missing.
+    """
+    # Configuration
+    file_path = f"/tmp/analysis/{submission_id}.ndjson"
+    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    bind_log_context(submission_id=submission_id)
+
+    if checkpoint_store is None:
+        checkpoint_store = get_checkpoint_store()
+    if checkpoint is None:
+        checkpoint = checkpoint_store.load(submission_id) or new_checkpoint(submission_id, file_path)
+    if phase_reached(checkpoint, "done"):
+        logger.info("Submission was already fully processed")
+        return
+    if profiler.current_profile() is None:
+        profiler.bind_profile(profiler.Profile(checkpoint.setdefault("profile", {})))
+    checkpoint_store.restore_results(submission_id, file_path)
+    if not phase_reached(checkpoint, "prompt_merge"):
+        advance(checkpoint_store, checkpoint, "prompt_merge")
+    artifacts = checkpoint["artifacts"]
+
+    async def timeline():
+        with profiler.span("timeline.analyze"):
+            analysis_output = await asyncio.to_thread(analyze_timeline_file, file_path)
+        logger.info("Timeline analysis completed", metadata=analysis_output["metadata"])
+        # Built in this order on purpose, the activity durations add duration_unit to the shared metadata
+        return {
+            "time_spent": build_activity_durations(analysis_output),
+            "raw_prompts": build_raw_prompts(analysis_output),
+            "app_actions": build_app_actions(analysis_output),
+        }
+
+    async def ai_prompts(timeline):
+        if "ai_prompts" not in artifacts:
+            with profiler.span("timeline.merge_prompts"):
+                artifacts["ai_prompts"] = await merge_prompts_map_reduce(timeline["raw_prompts"], OPENAI_API_KEY)
+            checkpoint_store.save(checkpoint)
+        return artifacts["ai_prompts"]
+
+    async def timeline_summary(timeline):
+        if "timeline_summary" not in artifacts:
+            with profiler.span("timeline.summary"):
+                artifacts["timeline_summary"] = await analyze_app_actions_map_reduce(timeline["app_actions"], OPENAI_API_KEY)
+            checkpoint_store.save(checkpoint)
+        return artifacts["timeline_summary"]
+
+    def upload(kind, source=None):
+        async def step(**results):
+            data = results[source] if source else results["timeline"][kind]
+            with profiler.span("upload.artifact", kind=kind):
+                await upload_json_to_s3(s3_client, data, artifact_key(artifact_name(assignment_id, user_id, kind)))
+        return step
+
+    steps = {
+        "timeline": ([], timeline),
+        "ai_prompts": (["timeline"], ai_prompts),
+        "timeline_summary": (["timeline"], timeline_summary),
+        "upload_time_spent": (["timeline"], upload("time_spent")),
+        "upload_raw_prompts": (["timeline"], upload("raw_prompts")),
+        "upload_app_actions": (["timeline"], upload("app_actions")),
+        "upload_ai_prompts": (["ai_prompts"], upload("ai_prompts", "ai_prompts")),
+        "upload_timeline_summary": (["timeline_summary"], upload("timeline_summary", "timeline_summary")),
+    }
+    async with open_upload_client() as s3_client:
+        results = await run_graph(steps)
+        # Uploaded on every invocation, so partial runs can be profiled too
+        try:
+            await upload_json_to_s3(
+                s3_client, profiler.current_profile().report(), artifact_key(artifact_name(assignment_id, user_id, "profile"))
+            )
+        except Exception as e:
+            logger.warning("Could not upload the profile", error=str(e))
 
-    print("Processing completed successfully.")
+    if "ai_prompts" in artifacts and "timeline_summary" in artifacts and not phase_reached(checkpoint, "upload"):
+        advance(checkpoint_store, checkpoint, "upload")
+    failed = [name for name, result in results.items() if isinstance(result, Exception)]
+    if failed:
+        logger.warning("Post-processing incomplete", failed_steps=failed)
+        return
 
+    await delete_local_json_files(submission_id)
+    advance(checkpoint_store, checkpoint, "done")
+    logger.info("Post-processing completed")
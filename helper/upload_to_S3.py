@@ -1,9 +1,17 @@
+import io
 import os
+import json
+import zlib
+import random
 import shutil
-import aiofiles
 import asyncio
-import aioboto3
+import itertools
 from botocore.exceptions import NoCredentialsError, ClientError
+from helper.clients import pooled_s3_client
+from helper.log import get_logger
+from helper import profiler
+
+logger = get_logger(__name__)
 
 # AWS S3 Configuration
 AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
@@ -14,50 +22,218 @@ AWS_REGION = os.getenv("AWS_REGION")
 BUCKET_NAME = os.getenv("BUCKET_NAME") or "authcast-assignments"
 FOLDER_NAME = "analysis"
 
-# Function to upload file to S3
+
+# Uploader configuration
+# "gzip" or "zstd" compress artifacts and set Content-Encoding, readers must decode them
+UPLOAD_COMPRESSION = os.getenv("UPLOAD_COMPRESSION", "none")
+UPLOAD_MULTIPART_THRESHOLD = int(os.getenv("UPLOAD_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+UPLOAD_PART_SIZE = max(5 * 1024 * 1024, int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024))))  # S3 minimum is 5 MB
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "8"))  # Parallel puts/parts per upload
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", "3"))
+UPLOAD_BACKOFF = float(os.getenv("UPLOAD_BACKOFF", "0.5"))  # Base delay in seconds, doubled per attempt
+UPLOAD_READ_SIZE = 1024 * 1024
+
+try:
+    import zstandard
+except ImportError:  # Optional, only needed for UPLOAD_COMPRESSION=zstd
+    zstandard = None
+
+
+def _compressor(compression):
+    """(compress, flush) functions for streaming compression, None for no compression"""
+    if compression == "zstd" and zstandard is None:
+        logger.warning("zstandard is not installed, compressing with gzip instead")
+        compression = "gzip"
+    if compression == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 writes a gzip container
+        return "gzip", compressor.compress, compressor.flush
+    if compression == "zstd":
+        compressor = zstandard.ZstdCompressor().compressobj()
+        return "zstd", compressor.compress, compressor.flush
+    return None, None, None
+
+
+def _as_stream(body):
+    """File-like object for bytes, str, JSON-serializable objects or an existing stream"""
+    if hasattr(body, "read"):
+        return body
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    elif not isinstance(body, (bytes, bytearray)):
+        body = json.dumps(body, indent=2).encode("utf-8")
+    return io.BytesIO(body)
+
+
+def _iter_parts(stream, part_size, compress, flush, totals):
+    """Read, compress and re-chunk a stream into parts of at least part_size bytes (except the last)"""
+    pending = bytearray()
+    while True:
+        chunk = stream.read(UPLOAD_READ_SIZE)
+        if not chunk:
+            break
+        totals["bytes"] += len(chunk)
+        pending += compress(chunk) if compress else chunk
+        while len(pending) >= part_size:
+            yield bytes(pending[:part_size])
+            del pending[:part_size]
+    if flush:
+        pending += flush()
+    yield bytes(pending)
+
+
+async def _with_retries(description, call, retries=UPLOAD_RETRIES):
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = UPLOAD_BACKOFF * (2 ** attempt) * (0.5 + random.random())
+            logger.warning("Retrying upload", upload=description, delay=round(delay, 2), error=str(e))
+            await asyncio.sleep(delay)
+
+
+async def upload_object(
+    s3_client,
+    s3_key,
+    body,
+    content_type="application/json",
+    compression=UPLOAD_COMPRESSION,
+    bucket_name=None,
+    multipart_threshold=UPLOAD_MULTIPART_THRESHOLD,
+    part_size=UPLOAD_PART_SIZE,
+    concurrency=UPLOAD_CONCURRENCY,
+):
+    """
+    Upload an in-memory object or a byte stream without touching the local disk.
+
+    :param body: bytes, str, a JSON-serializable object or a file-like object opened in binary mode.
+    :param compression: "gzip", "zstd" or "none"; sets the matching Content-Encoding.
+    :param multipart_threshold: Bodies larger than this (after compression) are sent
+                                as a multipart upload with `concurrency` parts in flight.
+    :return: Dict with the key, bytes read, bytes sent, number of parts and encoding.
+    """
+    bucket_name = bucket_name or BUCKET_NAME
+    encoding, compress, flush = _compressor(compression)
+    extra = {"ContentType": content_type}
+    if encoding:
+        extra["ContentEncoding"] = encoding
+    totals = {"bytes": 0}
+    parts = _iter_parts(_as_stream(body), part_size, compress, flush, totals)
+
+    # Read up to the threshold to decide between a single put and a multipart upload
+    head = []
+    for data in parts:
+        head.append(data)
+        if sum(len(part) for part in head) > multipart_threshold:
+            break
+    else:
+        data = b"".join(head)
+        with profiler.span("s3.put"):
+            await _with_retries(s3_key, lambda: s3_client.put_object(Bucket=bucket_name, Key=s3_key, Body=data, **extra))
+        profiler.count("s3.put_bytes", len(data))
+        logger.info("Uploaded", bucket=bucket_name, key=s3_key, bytes=len(data))
+        return {"key": s3_key, "bytes": totals["bytes"], "uploaded_bytes": len(data), "parts": 1, "content_encoding": encoding}
+
+    upload = await s3_client.create_multipart_upload(Bucket=bucket_name, Key=s3_key, **extra)
+    upload_id = upload["UploadId"]
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = []
+    uploaded_bytes = 0
+
+    async def upload_part(number, data):
+        try:
+            with profiler.span("s3.put_part"):
+                response = await _with_retries(f"{s3_key} part {number}", lambda: s3_client.upload_part(
+                    Bucket=bucket_name, Key=s3_key, UploadId=upload_id, PartNumber=number, Body=data
+                ))
+            profiler.count("s3.put_bytes", len(data))
+            return {"PartNumber": number, "ETag": response["ETag"]}
+        finally:
+            semaphore.release()
+
+    try:
+        for number, data in enumerate(itertools.chain(head, parts), 1):
+            if not data:
+                continue  # Empty tail after an exact multiple of the part size
+            # Only read the next part once a slot is free, so at most `concurrency` parts are in memory
+            await semaphore.acquire()
+            uploaded_bytes += len(data)
+            tasks.append(asyncio.ensure_future(upload_part(number, data)))
+        completed = await asyncio.gather(*tasks)
+        await _with_retries(f"{s3_key} completion", lambda: s3_client.complete_multipart_upload(
+            Bucket=bucket_name, Key=s3_key, UploadId=upload_id, MultipartUpload={"Parts": completed}
+        ))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await s3_client.abort_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
+        raise
+    logger.info("Uploaded", bucket=bucket_name, key=s3_key, bytes=uploaded_bytes, parts=len(completed))
+    return {"key": s3_key, "bytes": totals["bytes"], "uploaded_bytes": uploaded_bytes, "parts": len(completed), "content_encoding": encoding}
+
+
+async def upload_objects(s3_client, objects, concurrency=UPLOAD_CONCURRENCY, **options):
+    """Upload {s3_key: body} with at most `concurrency` objects in flight, returns the results by key"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def upload(s3_key, body):
+        async with semaphore:
+            return await upload_object(s3_client, s3_key, body, **options)
+
+    results = await asyncio.gather(*(upload(key, body) for key, body in objects.items()))
+    return dict(zip(objects, results))
+
+
+def open_upload_client():
+    """Pooled S3 client for uploading results, use as an async context manager"""
+    return pooled_s3_client(
+        aws_access_key_id=AWS_ACCESS_KEY,
+        aws_secret_access_key=AWS_SECRET_KEY,
+        region_name=AWS_REGION
+    )
+
+
+def artifact_key(file_name):
+    return f"{FOLDER_NAME}/{file_name}"
+
+
+# Function to upload an in-memory artifact to S3 as JSON, errors are raised so the caller can retry
+async def upload_json_to_s3(s3_client, data, s3_key):
+    return await upload_object(s3_client, s3_key, data)
+
+
+# Function to upload file to S3, streamed from disk without reading it all into memory
 async def upload_file_to_s3(s3_client, local_file_path, s3_key):
     try:
-        print(f"local file path : {local_file_path}")
-        print(f"bucekt : {BUCKET_NAME}")
-        print(f"folder : {FOLDER_NAME}")
-        # Open file asynchronously using aiofiles
         with open(local_file_path, 'rb') as file:
-            # Upload the file asynchronously
-            print("saurabh xyz")
-            print(f" S3 key : {s3_key}")
-            print(f" S3 bucket name : {BUCKET_NAME}")
-            await s3_client.put_object(Bucket=BUCKET_NAME, Key=s3_key, Body=file)
-            print(f"Uploaded: {local_file_path} -> s3://{BUCKET_NAME}/{s3_key}")
+            await upload_object(s3_client, s3_key, file)
     except ClientError as e:
-        print(f"Failed to upload {local_file_path} to s3://{BUCKET_NAME}/{s3_key}: {e}")
+        logger.error("Failed to upload", path=local_file_path, bucket=BUCKET_NAME, key=s3_key, error=str(e))
     except Exception as e:
-        print(f"An error occurred during upload of {local_file_path}: {e}")
+        logger.exception("Error during upload", path=local_file_path)
 
 
 # Function to upload multiple files asynchronously
 async def upload_files_to_s3(submission_id):
     LOCAL_FOLDER = f"/tmp/timeline_analysis/{submission_id}"
-    print(f"Submission ID: {submission_id}")
-    print(f"Local folder: {LOCAL_FOLDER}")
+    logger.debug("Uploading local results", submission_id=submission_id, folder=LOCAL_FOLDER)
 
     try:
-        # Create an S3 client asynchronously with aioboto3
-        async with aioboto3.Session().client(
-            's3',
-            aws_access_key_id=AWS_ACCESS_KEY,
-            aws_secret_access_key=AWS_SECRET_KEY,
-            region_name=AWS_REGION
-        ) as s3_client:
+        # Shared S3 client, kept open for the next upload
+        async with open_upload_client() as s3_client:
+            semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+            async def upload(local_file_path, s3_key):
+                async with semaphore:
+                    await upload_file_to_s3(s3_client, local_file_path, s3_key)
+
             tasks = []
-            
             # Iterate through all files in the local folder
             for root, dirs, files in os.walk(LOCAL_FOLDER):
                 for file in files:
                     if file.endswith(".json"):
-                        local_file_path = os.path.join(root, file)
-                        s3_key = f"{FOLDER_NAME}/{file}"
-                        # Schedule the upload task
-                        tasks.append(upload_file_to_s3(s3_client, local_file_path, s3_key))
+                        tasks.append(upload(os.path.join(root, file), artifact_key(file)))
 
             # Execute all tasks asynchronously
             if tasks:
@@ -67,9 +243,9 @@ async def upload_files_to_s3(submission_id):
         await delete_local_json_files(submission_id)
 
     except NoCredentialsError:
-        print("AWS credentials not found. Please configure them correctly.")
+        logger.error("AWS credentials not found. Please configure them correctly.")
     except Exception as e:
-        print(f"An error occurred during S3 upload: {e}")
+        logger.exception("Error during S3 upload")
 
 # Function to delete local JSON files after upload
 async def delete_local_json_files(submission_id):
@@ -77,7 +253,7 @@ async def delete_local_json_files(submission_id):
         f"/tmp/screenshots/{submission_id}",
         f"/tmp/timeline_analysis/{submission_id}",
     ]
-    file_to_delete = f"/tmp/analysis/{submission_id}.json"
+    file_to_delete = f"/tmp/analysis/{submission_id}.ndjson"
 
     try:
         # Delete files in directories
@@ -89,29 +265,28 @@ async def delete_local_json_files(submission_id):
                             file_path = os.path.join(root, file)
                             try:
                                 os.remove(file_path)
-                                print(f"Deleted: {file_path}")
+                                logger.debug("Deleted", path=file_path, sample="delete_file")
                             except Exception as e:
-                                print(f"Failed to delete {file_path}: {e}")
+                                logger.warning("Failed to delete", path=file_path, error=str(e))
                 # Remove the directory if empty
                 try:
                     shutil.rmtree(dir_path)
-                    print(f"Removed directory: {dir_path}")
+                    logger.debug("Removed directory", path=dir_path)
                 except Exception as e:
-                    print(f"Failed to remove directory {dir_path}: {e}")
+                    logger.warning("Failed to remove directory", path=dir_path, error=str(e))
 
-        # Delete the single JSON file
+        # Delete the results log
         if os.path.exists(file_to_delete):
             os.remove(file_to_delete)
-            print(f"Deleted: {file_to_delete}")
+            logger.debug("Deleted", path=file_to_delete)
         else:
-            print(f"File {file_to_delete} does not exist.")
+            logger.debug("File does not exist", path=file_to_delete)
 
     except Exception as e:
-        print(f"An error occurred during file deletion: {e}")
+        logger.exception("Error during file deletion")
 
 # Main entry point to start the process
 async def main(submission_id):
-    print(f"Submission ID in main of upload_to_S3: {submission_id}")
     await upload_files_to_s3(submission_id)
 
 # Example of how to call the main function with a specific submission_id:
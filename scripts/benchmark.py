@@ -0,0 +1,427 @@
+"""
+End-to-end throughput benchmark against local stand-ins for S3 and OpenAI.
+
+    pip install "moto[server]"
+    python scripts/benchmark.py                                          # 100, 1k and 5k frames through main()
+    python scripts/benchmark.py --frames 1000 --entry handler --latency 1.0 --jitter 0.5 --throttle-rate 0.05
+    python scripts/benchmark.py --s3-endpoint http://127.0.0.1:9000     # MinIO (or any S3) instead of moto
+    python scripts/benchmark.py --compare benchmark_results/<earlier run>.json
+
+Seeds a bucket with synthetic screenshots/{submission_id}/<timestamp>.jpg frames,
+starts scripts/fake_openai_server.py in-process and analyzes the first N frames
+of the submission once per frame count, each run in a fresh interpreter with its
+own checkpoint and result cache. `--entry main` calls helper.entry.main(), `--entry
+handler` serves api/index.py's handler and calls it with sync=1. Partial results
+are resumed like the job runner does, until the submission is complete.
+
+Per run it reports frames/sec, p50/p99 latency of a frame from download to
+persisted (from the uploaded profile, see helper/profiler.py), peak RSS of the
+function process and of its preprocessing workers, bytes transferred to and from
+S3 and OpenAI, and tokens. Results are written to --output-dir as JSON. The
+script exits with status 1 when a run did not analyze every frame without
+errors or made no successful OpenAI request, and with --compare when throughput
+dropped by more than --tolerance against an earlier file.
+"""
+import io
+import os
+import sys
+import json
+import gzip
+import time
+import random
+import functools
+import socket
+import logging
+import argparse
+import resource
+import statistics
+import subprocess
+import threading
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BUCKET = "benchmark-frames"
+FRAME_INTERVAL = timedelta(seconds=5)
+FIRST_FRAME = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_moto() -> str:
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        raise SystemExit("The local S3 needs moto: pip install \"moto[server]\", or pass --s3-endpoint")
+    # One log line per request would bury the results
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    port = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    return f"http://127.0.0.1:{port}"
+
+
+def synthetic_frame(index: int, width: int, height: int, change_every: int) -> bytes:
+    """A screenshot-like JPEG, the layout changes every `change_every` frames"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(index // change_every)
+    image = Image.new("RGB", (width, height), tuple(rng.randrange(200, 256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):  # Windows and panels
+        left, top = rng.randrange(width), rng.randrange(height)
+        right, bottom = min(width, left + rng.randrange(width // 8, width // 2)), min(height, top + rng.randrange(height // 8, height // 2))
+        draw.rectangle((left, top, right, bottom), fill=tuple(rng.randrange(256) for _ in range(3)))
+    for line in range(height // 24):  # Lines of text, the expensive part to compress
+        draw.text((rng.randrange(width // 4), line * 24), "".join(rng.choice("abcdefghij (){};= ") for _ in range(rng.randrange(20, 120))), fill=(0, 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def frame_key(submission_id: str, index: int) -> str:
+    timestamp = FIRST_FRAME + FRAME_INTERVAL * index
+    return f"screenshots/{submission_id}/{timestamp.strftime('%Y%m%d%H%M%S')}{timestamp.microsecond // 1000:03d}.jpg"
+
+
+def seed_frames(s3, submission_id: str, count: int, width: int, height: int, change_every: int):
+    """Upload frames 0..count-1 of the submission, keeping frames seeded by an earlier run"""
+    try:
+        s3.create_bucket(Bucket=BUCKET)
+    except s3.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] not in ("BucketAlreadyOwnedByYou", "BucketAlreadyExists"):
+            raise
+    existing = set()
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=BUCKET, Prefix=f"screenshots/{submission_id}/"):
+        existing.update(item["Key"] for item in page.get("Contents", []))
+    missing = [index for index in range(count) if frame_key(submission_id, index) not in existing]
+    if not missing:
+        return
+
+    def upload(index, data):
+        s3.put_object(Bucket=BUCKET, Key=frame_key(submission_id, index), Body=data)
+
+    print(f"Seeding {len(missing)} frames of {width}x{height} into s3://{BUCKET}/screenshots/{submission_id}/")
+    start_time = time.perf_counter()
+    # Drawing and encoding is CPU-bound, uploading is not
+    render = functools.partial(synthetic_frame, width=width, height=height, change_every=change_every)
+    with ProcessPoolExecutor() as renderers, ThreadPoolExecutor(max_workers=16) as uploaders:
+        uploads = [uploaders.submit(upload, index, data) for index, data in zip(missing, renderers.map(render, missing, chunksize=8))]
+        for future in uploads:
+            future.result()
+    print(f"Seeded in {time.perf_counter() - start_time:.1f}s")
+
+
+def read_profile(s3, key: str):
+    try:
+        response = s3.get_object(Bucket=BUCKET, Key=key)
+    except s3.exceptions.NoSuchKey:
+        return None
+    body = response["Body"].read()
+    if response.get("ContentEncoding") == "gzip":
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+
+def fake_openai_request(url: str, method: str = "GET"):
+    request = urllib.request.Request(url, method=method, data=b"" if method == "POST" else None)
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+def run_worker(spec: dict, env: dict) -> dict:
+    """Run one benchmark in a fresh interpreter and return what it measured"""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as output:
+        spec = {**spec, "output": output.name}
+    try:
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", json.dumps(spec)],
+            cwd=ROOT, env=env, check=True,
+        )
+        with open(spec["output"]) as f:
+            return json.load(f)
+    finally:
+        os.remove(spec["output"])
+
+
+def worker(spec: dict):
+    """Function side of a run: analyze the submission until it is complete"""
+    from helper.checkpoint import get_checkpoint_store
+    from helper.clients import run
+    from helper.preprocess import get_preprocess_executor
+
+    # A leftover results log would count as frames already done
+    results_file = f"/tmp/analysis/{spec['submission_id']}.ndjson"
+    if os.path.exists(results_file):
+        os.remove(results_file)
+    params = {
+        "submission_id": spec["submission_id"],
+        "assignment_id": spec["assignment_id"],
+        "user_id": spec["user_id"],
+        "total_screenshots": spec["frames"],
+    }
+
+    if spec["entry"] == "handler":
+        from http.server import ThreadingHTTPServer
+        from api.index import handler
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/api?{urllib.parse.urlencode({**params, 'sync': 1})}"
+
+        def invoke():
+            try:
+                with urllib.request.urlopen(url) as response:
+                    return json.load(response)
+            except urllib.error.HTTPError as e:
+                return json.load(e)
+    else:
+        from helper.entry import main
+
+        def invoke():
+            return run(main(**params))
+
+    invocations = []
+    start_time = time.perf_counter()
+    while len(invocations) < spec["max_invocations"]:
+        invocation_start = time.perf_counter()
+        result = invoke()
+        invocations.append({"status": result.get("status"), "seconds": round(time.perf_counter() - invocation_start, 3)})
+        if result.get("status") != "partial":
+            break
+    seconds = time.perf_counter() - start_time
+
+    # Preprocessing workers only count towards RUSAGE_CHILDREN once they have exited
+    get_preprocess_executor().shutdown(wait=True)
+    memory = (get_checkpoint_store().load(spec["submission_id"]) or {}).get("memory") or {}
+    with open(spec["output"], "w") as f:
+        json.dump({
+            "status": result.get("status"),
+            "message": result.get("message"),
+            "frames_done": result.get("frames_done"),
+            "seconds": seconds,
+            "invocations": invocations,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "peak_child_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+            "payload_high_water_bytes": memory.get("high_water_bytes"),
+        }, f)
+
+
+def run_failures(result: dict) -> list:
+    """Why a run does not count: timings of frames that errored or were never sent say nothing"""
+    failures = []
+    if result["status"] != "complete":
+        failures.append(f"ended {result['status']}")
+    if result["frames_analyzed"] != result["frames"]:
+        failures.append(f"{result['frames_analyzed']} of {result['frames']} frames analyzed")
+    if result["frame_errors"]:
+        failures.append(f"{result['frame_errors']} frames failed, see the warnings of the function above")
+    if result["openai_requests"] == 0:
+        failures.append("no OpenAI request succeeded")
+    return failures
+
+
+def benchmark(args, frames: int, repeat: int, s3, env: dict, openai_url: str) -> dict:
+    run_id = f"{frames}-{repeat}-{int(time.time())}"
+    spec = {
+        "entry": args.entry,
+        "submission_id": args.submission_id,
+        "assignment_id": f"benchmark-{run_id}",
+        "user_id": "benchmark",
+        "frames": frames,
+        "max_invocations": args.max_invocations,
+    }
+    with tempfile.TemporaryDirectory() as state_dir:
+        # Fresh checkpoints and result cache, so every run does the full work
+        run_env = {
+            **env,
+            "CHECKPOINT_BACKEND": "local",
+            "CHECKPOINT_DIR": os.path.join(state_dir, "checkpoints"),
+            "RESULT_CACHE_SQLITE_PATH": os.path.join(state_dir, "vision_cache.sqlite"),
+        }
+        fake_openai_request(f"{openai_url}/stats/reset", "POST")
+        measured = run_worker(spec, run_env)
+    openai = fake_openai_request(f"{openai_url}/stats")
+    profile = read_profile(s3, f"analysis/{spec['assignment_id']}_{spec['user_id']}_profile.json") or {}
+    spans, counters = profile.get("spans", {}), profile.get("counters", {})
+    frame_span = spans.get("frame", {})
+
+    return {
+        "frames": frames,
+        "entry": args.entry,
+        "status": measured["status"],
+        "frames_done": measured["frames_done"],
+        # The results log is gone once the submission is done, the profile counted its frames
+        "frames_analyzed": counters.get("frames.persisted", 0),
+        "frame_errors": counters.get("frames.failed", 0),
+        "invocations": len(measured["invocations"]),
+        "seconds": round(measured["seconds"], 2),
+        "frames_per_second": round(frames / measured["seconds"], 2),
+        "frame_p50_seconds": frame_span.get("p50"),
+        "frame_p99_seconds": frame_span.get("p99"),
+        "peak_rss_mb": round(measured["peak_rss_mb"], 1),
+        "peak_child_rss_mb": round(measured["peak_child_rss_mb"], 1),
+        "payload_high_water_bytes": measured["payload_high_water_bytes"],
+        "s3_get_bytes": counters.get("s3.get_bytes", 0),
+        "s3_put_bytes": counters.get("s3.put_bytes", 0),
+        "openai_sent_bytes": openai["request_bytes"],
+        "openai_received_bytes": openai["response_bytes"],
+        "openai_requests": openai["requests"],
+        "openai_throttled": openai["throttled"],
+        "prompt_tokens": openai["prompt_tokens"],
+        "completion_tokens": openai["completion_tokens"],
+        "stages_seconds": {name: span["seconds"] for name, span in spans.items()},
+    }
+
+
+def summarize(runs):
+    """Median of the repeats per frame count"""
+    by_frames = {}
+    for result in runs:
+        by_frames.setdefault(result["frames"], []).append(result)
+    return {
+        str(frames): {
+            field: round(statistics.median(result[field] for result in results if result[field] is not None), 4)
+            for field in (
+                "frames_per_second", "frame_p50_seconds", "frame_p99_seconds", "peak_rss_mb",
+                "payload_high_water_bytes", "s3_get_bytes", "openai_sent_bytes",
+            )
+            if any(result[field] is not None for result in results)
+        }
+        for frames, results in sorted(by_frames.items())
+    }
+
+
+def compare(summary, baseline_path: str, tolerance: float):
+    """Print the change against an earlier result file, returns the regressions"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["summary"]
+    regressions = []
+    print(f"\nCompared to {baseline_path}:")
+    for frames, current in summary.items():
+        before = baseline.get(frames)
+        if before is None:
+            continue
+        changes = []
+        for field, value in current.items():
+            if before.get(field):
+                changes.append(f"{field} {(value - before[field]) / before[field]:+.1%}")
+        print(f"  {frames:>6} frames: {', '.join(changes)}")
+        if before.get("frames_per_second") and current["frames_per_second"] < before["frames_per_second"] * (1 - tolerance):
+            regressions.append(f"{frames} frames: {current['frames_per_second']} frames/s, was {before['frames_per_second']}")
+    return regressions
+
+
+def git_commit():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", default="100,1000,5000", help="Comma-separated frame counts, one run each")
+    parser.add_argument("--entry", choices=["main", "handler"], default="main")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per frame count, the summary takes the median")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--change-every", type=int, default=1, help="Frames per distinct screen, >1 exercises deduplication")
+    parser.add_argument("--s3-endpoint", help="Existing S3-compatible endpoint, e.g. MinIO, instead of starting moto")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per OpenAI request")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Up to this many seconds added per request")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of OpenAI requests answered with a 429")
+    parser.add_argument("--rpm", type=int, default=0, help="OpenAI requests per minute, 0 for no limit")
+    parser.add_argument("--tpm", type=int, default=0, help="OpenAI tokens per minute, 0 for no limit")
+    parser.add_argument("--max-invocations", type=int, default=50, help="Resumes before a run is given up")
+    parser.add_argument("--log-level", default="WARNING", help="LOG_LEVEL of the function process")
+    parser.add_argument("--output-dir", default=os.path.join(ROOT, "benchmark_results"))
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed drop in frames/sec for --compare")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(json.loads(args.worker))
+
+    import boto3
+    from fake_openai_server import serve
+
+    frame_counts = [int(count) for count in args.frames.split(",") if count]
+    args.submission_id = f"benchmark-{args.width}x{args.height}-{args.change_every}"
+    credentials = {
+        "AWS_ACCESS_KEY_ID": os.getenv("AWS_ACCESS_KEY_ID", "benchmark"),
+        "AWS_SECRET_ACCESS_KEY": os.getenv("AWS_SECRET_ACCESS_KEY", "benchmark"),
+        "AWS_REGION": os.getenv("AWS_REGION", "us-east-1"),
+        "AWS_DEFAULT_REGION": os.getenv("AWS_REGION", "us-east-1"),
+    }
+    os.environ.update(credentials)
+    s3_endpoint = args.s3_endpoint or start_moto()
+    s3 = boto3.client("s3", endpoint_url=s3_endpoint)
+    seed_frames(s3, args.submission_id, max(frame_counts), args.width, args.height, args.change_every)
+
+    openai_server = serve(0, args.latency, args.jitter, args.throttle_rate, args.rpm, args.tpm)
+    openai_url = f"http://127.0.0.1:{openai_server.server_address[1]}/v1"
+    env = {
+        **os.environ,
+        **credentials,
+        "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.getenv("PYTHONPATH")])),
+        # Every SDK client of the function talks to the stand-ins
+        "AWS_ENDPOINT_URL": s3_endpoint,
+        "S3_ENDPOINT_URL": s3_endpoint,
+        "BUCKET_NAME": BUCKET,
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_KEY": "benchmark",
+        "MANIFEST_CACHE_DIR": "",
+        "RESULT_CACHE_BACKEND": "sqlite",
+        "LOG_LEVEL": args.log_level,
+    }
+
+    runs, failures = [], []
+    for frames in frame_counts:
+        for repeat in range(args.repeat):
+            result = benchmark(args, frames, repeat, s3, env, openai_url)
+            runs.append(result)
+            print(
+                f"{frames:>6} frames via {args.entry}: {result['status']} in {result['seconds']}s "
+                f"({result['invocations']} invocations), {result['frames_per_second']} frames/s, "
+                f"frame p50 {result['frame_p50_seconds'] or '-'}s p99 {result['frame_p99_seconds'] or '-'}s, "
+                f"peak RSS {result['peak_rss_mb']} MB (largest worker {result['peak_child_rss_mb']} MB, "
+                f"frame payload {(result['payload_high_water_bytes'] or 0) / 1e6:.1f} MB), "
+                f"S3 {result['s3_get_bytes'] / 1e6:.1f} MB in, OpenAI {result['openai_sent_bytes'] / 1e6:.1f} MB out, "
+                f"{result['openai_requests']} requests, {result['openai_throttled']} throttled"
+            )
+            failures.extend(f"{frames} frames: {failure}" for failure in run_failures(result))
+
+    summary = summarize(runs)
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "git_commit": git_commit(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("worker", "compare", "output_dir")},
+        "summary": summary,
+        "runs": runs,
+    }
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{report['git_commit'] or 'nogit'}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {path}")
+
+    regressions = compare(summary, args.compare, args.tolerance) if args.compare else []
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if regressions or failures else 0)
+
+
+if __name__ == "__main__":
+    main()
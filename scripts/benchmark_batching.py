@@ -0,0 +1,98 @@
+"""
+Compare per-frame and batched vision requests on a folder of screenshots.
+
+    OPENAI_API_KEY=... python scripts/benchmark_batching.py /path/to/screenshots --frames 40 --batch-size 4
+
+Screenshots must be named like the uploaded frames (<timestamp>.jpg). Both runs
+bypass the result cache, so every frame is actually sent. Prices are per million
+tokens and default to gpt-4o's list prices.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import AsyncOpenAI
+from helper.entry import VISION_MODEL, VISION_DETAIL, MAX_CONCURRENT_REQUESTS, VisionBatcher, analyze_single_image
+from helper.preprocess import prepare_frame
+from helper.rate_limiter import get_rate_limiter
+from helper.result_cache import ResultCache
+
+
+def load_frames(folder, count):
+    frames = []
+    for image_file in sorted(os.listdir(folder))[:count]:
+        with open(os.path.join(folder, image_file), "rb") as f:
+            frames.append({"image_file": image_file, "base64_image": prepare_frame(f.read(), detail=VISION_DETAIL)["base64_image"]})
+    return frames
+
+
+async def run(frames, api_key, batch_size, max_concurrent):
+    client = AsyncOpenAI(api_key=api_key, max_retries=0)
+    semaphore = asyncio.Semaphore(max_concurrent)
+    limiter = get_rate_limiter(VISION_MODEL)
+    before = dict(limiter.stats)
+    batcher = VisionBatcher(client, semaphore, batch_size, result_cache=ResultCache()) if batch_size > 1 else None
+
+    async def analyze(frame):
+        if batcher is not None:
+            return await batcher.analyze(frame["image_file"], frame["base64_image"])
+        return await analyze_single_image(
+            client, None, frame["image_file"], semaphore, base64_image=frame["base64_image"], result_cache=ResultCache()
+        )
+
+    start_time = time.time()
+    results = await asyncio.gather(*(analyze(frame) for frame in frames))
+    elapsed = time.time() - start_time
+    report = {field: limiter.stats[field] - before[field] for field in ("requests", "prompt_tokens", "completion_tokens", "throttled")}
+    report.update({
+        "batch_size": batch_size,
+        "frames": len(frames),
+        "errors": sum(1 for result in results if "error" in result),
+        "seconds": round(elapsed, 2),
+        "frames_per_second": round(len(frames) / elapsed, 2),
+    })
+    if batcher is not None:
+        report.update(batcher.stats)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder")
+    parser.add_argument("--frames", type=int, default=40)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--max-concurrent", type=int, default=MAX_CONCURRENT_REQUESTS)
+    parser.add_argument("--input-price", type=float, default=2.5, help="USD per 1M prompt tokens")
+    parser.add_argument("--output-price", type=float, default=10.0, help="USD per 1M completion tokens")
+    parser.add_argument("--output", help="Write the reports to this JSON file")
+    args = parser.parse_args()
+
+    frames = load_frames(args.folder, args.frames)
+    reports = []
+    for batch_size in (1, args.batch_size):
+        report = asyncio.run(run(frames, os.environ["OPENAI_API_KEY"], batch_size, args.max_concurrent))
+        report["cost_usd"] = round(
+            (report["prompt_tokens"] * args.input_price + report["completion_tokens"] * args.output_price) / 1_000_000, 4
+        )
+        print(json.dumps(report))
+        reports.append(report)
+
+    single, batched = reports
+    print(
+        f"Batches of {args.batch_size}: {single['requests'] / max(1, batched['requests']):.1f}x fewer requests, "
+        f"{single['prompt_tokens'] / max(1, batched['prompt_tokens']):.2f}x fewer prompt tokens, "
+        f"{batched['frames_per_second'] / single['frames_per_second']:.2f}x throughput, "
+        f"cost ${single['cost_usd']} -> ${batched['cost_usd']}"
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Re-analyze submissions offline through the OpenAI Batch API.
+
+    python scripts/bulk_analyze.py submit backlog-2024-06 SUBMISSION_ID:TOTAL_SCREENSHOTS[:ASSIGNMENT_ID:USER_ID] ...
+    python scripts/bulk_analyze.py collect backlog-2024-06 [--wait] [--timeout SECONDS]
+
+`collect` writes each submission's results log and runs the timeline analysis
+and upload once every batch has finished. Run it again until it reports
+"complete". Set OPENAI_BATCH_BASE_URL to use scripts/fake_batch_server.py.
+"""
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helper.clients import run
+from helper.entry import submit_bulk_analysis, collect_bulk_analysis
+
+
+def parse_submission(value):
+    submission_id, total_screenshots, *rest = value.split(":")
+    assignment_id, user_id = (rest + [None, None])[:2]
+    return {
+        "submission_id": submission_id,
+        "total_screenshots": int(total_screenshots),
+        "assignment_id": assignment_id,
+        "user_id": user_id,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit = commands.add_parser("submit")
+    submit.add_argument("name")
+    submit.add_argument("submissions", nargs="+", type=parse_submission)
+    collect = commands.add_parser("collect")
+    collect.add_argument("name")
+    collect.add_argument("--wait", action="store_true", help="Keep polling until the batches finish")
+    collect.add_argument("--timeout", type=float, help="Stop waiting after this many seconds")
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        state = run(submit_bulk_analysis(args.name, args.submissions))
+    else:
+        state = run(collect_bulk_analysis(args.name, wait=args.wait, timeout=args.timeout))
+    print(json.dumps(state, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Import-time budget for cold starts.
+
+    python scripts/check_import_time.py                      # api/index.py against the default budget
+    python scripts/check_import_time.py helper.entry --budget-ms 1500 --forbid ""
+
+Imports each module in fresh interpreters with `python -X importtime`, prints
+the median cold import time, the slowest modules and the time per top-level
+package, and exits with status 1 when the budget is exceeded or one of the
+`--forbid` packages was imported (they are meant to load on first use).
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "250"))
+# SDKs the entry point must not import before a request needs them
+FORBIDDEN = "openai,aioboto3,aiobotocore,aiohttp,boto3,botocore,httpx,PIL"
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure(module):
+    """One cold import of `module`: {name: (self_us, cumulative_us)} and the module's own cumulative time"""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.getenv("PYTHONPATH")]))}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr}")
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return modules, modules[module][1]
+
+
+def breakdown(modules, top):
+    by_package = defaultdict(int)
+    for name, (self_us, _) in modules.items():
+        by_package[name.split(".")[0]] += self_us
+    slowest = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)[:top]
+    return {
+        "slowest_ms": {name: round(cumulative / 1000, 1) for name, (_, cumulative) in slowest},
+        "packages_ms": {
+            name: round(self_us / 1000, 1)
+            for name, self_us in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=["api.index"])
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS, help="Maximum median import time")
+    parser.add_argument("--forbid", default=FORBIDDEN, help="Comma-separated packages that must not be imported")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module, the median is compared")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    args = parser.parse_args()
+    forbidden = {name for name in args.forbid.split(",") if name}
+
+    report, failures = {}, []
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.runs)]
+        total_ms = statistics.median(cumulative for _, cumulative in runs) / 1000
+        modules = runs[-1][0]
+        imported = sorted(forbidden & {name.split(".")[0] for name in modules})
+        report[module] = {"median_ms": round(total_ms, 1), "budget_ms": args.budget_ms,
+                          "forbidden_imports": imported, **breakdown(modules, args.top)}
+
+        print(f"{module}: {total_ms:.1f} ms median of {args.runs} cold imports (budget {args.budget_ms:.0f} ms)")
+        print("  slowest modules (cumulative ms):")
+        for name, ms in report[module]["slowest_ms"].items():
+            print(f"    {ms:8.1f}  {name}")
+        print("  per package (self ms):")
+        for name, ms in report[module]["packages_ms"].items():
+            print(f"    {ms:8.1f}  {name}")
+
+        if total_ms > args.budget_ms:
+            failures.append(f"{module} takes {total_ms:.1f} ms to import, over the {args.budget_ms:.0f} ms budget")
+        if imported:
+            failures.append(f"{module} imports {', '.join(imported)} at startup, import them on first use instead")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Tune the vision cascade against a labelled set of local screenshots.
+
+    OPENAI_API_KEY=... python scripts/evaluate_cascade.py /path/to/screenshots labels.json
+
+labels.json maps screenshot file names to the expected activity, e.g.
+{"20240101120000000.jpg": "Coding"}. Every frame is analyzed once by each tier.
+The cascade is then replayed offline for a range of VISION_MIN_CONFIDENCE
+thresholds, reporting escalation rate, activity accuracy and token cost for each.
+Prices are per million tokens.
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import AsyncOpenAI
+from helper import entry
+from helper.preprocess import prepare_frame
+
+THRESHOLDS = [0.0, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.01]
+
+
+def activity_of(content):
+    try:
+        return json.loads(content).get("activity")
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+async def analyze_both_tiers(client, folder, labels, max_concurrent):
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def analyze(image_file):
+        with open(os.path.join(folder, image_file), "rb") as f:
+            base64_image = prepare_frame(f.read(), detail=entry.VISION_DETAIL)["base64_image"]
+        async with semaphore:
+            cheap = await entry.request_analysis(
+                client, base64_image, "cheap", f"{entry.VISION_PROMPT}\n\n{entry.VISION_CONFIDENCE_INSTRUCTIONS}"
+            )
+            full = await entry.request_analysis(client, base64_image, "full")
+        return {"image_file": image_file, "label": labels[image_file], "cheap": cheap, "full": full}
+
+    return await asyncio.gather(*(analyze(image_file) for image_file in sorted(labels)))
+
+
+def replay(frames, threshold):
+    """Cascade outcome for one confidence threshold, without new requests"""
+    entry.VISION_MIN_CONFIDENCE = threshold
+    escalated = correct = 0
+    for frame in frames:
+        reason = entry.escalation_reason(frame["cheap"])
+        answer = frame["cheap"] if reason is None else frame["full"]
+        escalated += reason is not None
+        correct += activity_of(answer) == frame["label"]
+    return escalated, correct
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder")
+    parser.add_argument("labels")
+    parser.add_argument("--max-concurrent", type=int, default=10)
+    parser.add_argument("--cheap-input-price", type=float, default=0.15)
+    parser.add_argument("--cheap-output-price", type=float, default=0.6)
+    parser.add_argument("--full-input-price", type=float, default=2.5)
+    parser.add_argument("--full-output-price", type=float, default=10.0)
+    parser.add_argument("--output", help="Write per-frame answers and the threshold sweep to this JSON file")
+    args = parser.parse_args()
+
+    with open(args.labels) as f:
+        labels = json.load(f)
+    client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"], max_retries=0)
+    frames = asyncio.run(analyze_both_tiers(client, args.folder, labels, args.max_concurrent))
+
+    stats = entry.tier_stats
+    prices = {
+        "cheap": (args.cheap_input_price, args.cheap_output_price),
+        "full": (args.full_input_price, args.full_output_price),
+    }
+    # Mean cost of one request per tier, measured on this set
+    cost_per_request = {
+        tier: (stats[tier]["prompt_tokens"] * prices[tier][0] + stats[tier]["completion_tokens"] * prices[tier][1])
+        / 1_000_000 / max(1, stats[tier]["requests"])
+        for tier in prices
+    }
+    count = len(frames)
+    print(json.dumps(entry.tier_report()))
+    print(f"cheap only: {sum(activity_of(f['cheap']) == f['label'] for f in frames) / count:.1%} correct, "
+          f"full only: {sum(activity_of(f['full']) == f['label'] for f in frames) / count:.1%} correct, "
+          f"${cost_per_request['full'] * count:.4f}")
+
+    sweep = []
+    for threshold in THRESHOLDS:
+        escalated, correct = replay(frames, threshold)
+        cost = count * cost_per_request["cheap"] + escalated * cost_per_request["full"]
+        sweep.append({"threshold": threshold, "escalation_rate": escalated / count, "accuracy": correct / count, "cost_usd": cost})
+        print(f"threshold {threshold:.2f}: escalated {escalated / count:.1%}, {correct / count:.1%} correct, ${cost:.4f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"frames": frames, "sweep": sweep, "tiers": entry.tier_report()}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Local stand-in for the OpenAI Files and Batch APIs, for running bulk mode offline.
+
+    python scripts/fake_batch_server.py --port 8765 --delay 5 --fail-rate 0.05
+    OPENAI_BATCH_BASE_URL=http://localhost:8765/v1 OPENAI_API_KEY=fake python scripts/bulk_analyze.py ...
+
+Batches finish `--delay` seconds after they are created. Every chat completion
+request is answered with a canned analysis, `--fail-rate` of them with an error
+in the error file instead. Everything is kept in memory.
+"""
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ACTIVITIES = ["Coding", "Testing", "Reading Documentation", "Interacting with AI Chatbot"]
+
+files = {}
+batches = {}
+lock = threading.Lock()
+
+
+def new_id(prefix):
+    return f"{prefix}-{uuid.uuid4().hex[:24]}"
+
+
+def store_file(content: bytes, filename: str, purpose: str) -> dict:
+    file_object = {
+        "id": new_id("file"),
+        "object": "file",
+        "bytes": len(content),
+        "created_at": int(time.time()),
+        "filename": filename,
+        "purpose": purpose,
+        "status": "processed",
+    }
+    files[file_object["id"]] = {"object": file_object, "content": content}
+    return file_object
+
+
+def fake_completion(request: dict, index: int) -> dict:
+    images = sum(
+        1 for part in request["body"]["messages"][0]["content"]
+        if isinstance(part, dict) and part.get("type") == "image_url"
+    )
+    analysis = {
+        "activity": ACTIVITIES[index % len(ACTIVITIES)],
+        "open_windows": [{"app": "Fake App", "action": f"Fake action {index // 3}", "prompt": ""}],
+    }
+    return {
+        "id": new_id("chatcmpl"),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request["body"].get("model", "gpt-4o"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": json.dumps(analysis)},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 600 + 1105 * images, "completion_tokens": 60, "total_tokens": 665 + 1105 * images},
+    }
+
+
+def complete_batch(batch: dict, fail_rate: float):
+    output, errors = [], []
+    for index, line in enumerate(files[batch["input_file_id"]]["content"].splitlines()):
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if random.random() < fail_rate:
+            errors.append({
+                "id": new_id("batch_req"),
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 500, "body": {"error": {"message": "fake failure", "type": "server_error"}}},
+                "error": None,
+            })
+        else:
+            output.append({
+                "id": new_id("batch_req"),
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": new_id("req"), "body": fake_completion(request, index)},
+                "error": None,
+            })
+
+    def jsonl(records):
+        return "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+
+    batch["output_file_id"] = store_file(jsonl(output), "output.jsonl", "batch_output")["id"] if output else None
+    batch["error_file_id"] = store_file(jsonl(errors), "errors.jsonl", "batch_output")["id"] if errors else None
+    batch["request_counts"] = {"total": len(output) + len(errors), "completed": len(output), "failed": len(errors)}
+    batch["status"] = "completed"
+    batch["completed_at"] = int(time.time())
+
+
+class Handler(BaseHTTPRequestHandler):
+    delay = 5.0
+    fail_rate = 0.0
+
+    def _send(self, status, payload=None, raw=None):
+        body = raw if raw is not None else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream" if raw is not None else "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        if self.path == "/v1/files":
+            header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+            message = BytesParser(policy=HTTP).parsebytes(header + self._body())
+            fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+            upload = fields["file"]
+            with lock:
+                file_object = store_file(
+                    upload.get_payload(decode=True), upload.get_filename() or "input.jsonl",
+                    fields["purpose"].get_payload(decode=True).decode("utf-8"),
+                )
+            return self._send(200, file_object)
+
+        if self.path == "/v1/batches":
+            request = json.loads(self._body())
+            if request["input_file_id"] not in files:
+                return self._send(404, {"error": {"message": "No such file"}})
+            batch = {
+                "id": new_id("batch"),
+                "object": "batch",
+                "endpoint": request["endpoint"],
+                "errors": None,
+                "input_file_id": request["input_file_id"],
+                "completion_window": request["completion_window"],
+                "status": "in_progress",
+                "output_file_id": None,
+                "error_file_id": None,
+                "created_at": int(time.time()),
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                "metadata": request.get("metadata"),
+            }
+            with lock:
+                batches[batch["id"]] = batch
+            return self._send(200, batch)
+
+        self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts[:2] == ["v1", "batches"] and len(parts) == 3 and parts[2] in batches:
+            batch = batches[parts[2]]
+            with lock:
+                if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.delay:
+                    complete_batch(batch, self.fail_rate)
+            return self._send(200, batch)
+        if parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content" and parts[2] in files:
+            return self._send(200, raw=files[parts[2]]["content"])
+        if parts[:2] == ["v1", "files"] and len(parts) == 3 and parts[2] in files:
+            return self._send(200, files[parts[2]]["object"])
+        self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=5.0, help="Seconds until a batch completes")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    args = parser.parse_args()
+
+    Handler.delay = args.delay
+    Handler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    print(f"Fake batch server on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Local stand-in for the OpenAI chat completions API, for load tests and benchmarks.
+
+    python scripts/fake_openai_server.py --port 8766 --latency 0.8 --jitter 0.3 --throttle-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8766/v1 OPENAI_API_KEY=fake python ...
+
+Every request is answered after `--latency` seconds plus up to `--jitter`
+seconds, with a canned vision analysis (one frame or a batch of frames), a
+merged prompts document or an activity summary depending on the request.
+`--throttle-rate` of the requests, and every request over `--rpm`/`--tpm`, get a
+429 with retry-after-ms and the x-ratelimit-* headers the rate limiter reads.
+Tokens are counted like the API would bill them (roughly) and served, together
+with request and byte counts, on GET /v1/stats; POST /v1/stats/reset clears them.
+"""
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from collections import deque
+from typing import Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ACTIVITIES = ["Coding", "Testing", "Reading Documentation", "Interacting with AI Chatbot"]
+# Approximate prompt tokens of one image by detail, see the vision pricing docs
+IMAGE_TOKENS = {"low": 85, "high": 765, "auto": 765}
+
+lock = threading.Lock()
+
+
+def new_stats():
+    return {
+        "requests": 0, "throttled": 0, "prompt_tokens": 0, "completion_tokens": 0, "images": 0,
+        "request_bytes": 0, "response_bytes": 0, "by_model": {},
+    }
+
+
+stats = new_stats()
+# (time, tokens) of the answered requests of the last minute, for --rpm and --tpm
+window = deque()
+
+
+def count_prompt_tokens(messages) -> Tuple[int, int]:
+    """Prompt tokens and images of a request, about 4 characters per text token"""
+    tokens, images = 0, 0
+    for message in messages:
+        content = message.get("content")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+        for part in parts:
+            if part.get("type") == "image_url":
+                images += 1
+                tokens += IMAGE_TOKENS.get(part["image_url"].get("detail", "auto"), 765)
+            else:
+                tokens += len(part.get("text") or "") // 4 + 1
+    return tokens, images
+
+
+def fake_analysis(index: int) -> dict:
+    return {
+        "activity": ACTIVITIES[index % len(ACTIVITIES)],
+        "open_windows": [{"app": "Fake App", "action": f"Fake action {index // 3}", "prompt": ""}],
+        "confidence": 0.9,
+    }
+
+
+def fake_content(request: dict, images: int) -> str:
+    index = random.randrange(1000)
+    if images > 1:
+        # Batched frames, see VISION_BATCH_INSTRUCTIONS
+        return json.dumps({"frames": [{"frame": frame, **fake_analysis(index + frame)} for frame in range(images)]})
+    if images == 1:
+        return json.dumps(fake_analysis(index))
+    if request.get("response_format", {}).get("type") == "json_object":
+        # Prompt merging, nothing to merge
+        return json.dumps({"prompts_timeline": []})
+    # Activity summary, answered in a ```json fence like the reasoning models do
+    return "```json\n" + json.dumps([{"activity": "Fake activity", "time": "00:00:00", "details": ["Fake detail"]}]) + "\n```"
+
+
+class Handler(BaseHTTPRequestHandler):
+    latency = 0.5
+    jitter = 0.0
+    throttle_rate = 0.0
+    rpm = 0
+    tpm = 0
+
+    def log_message(self, format, *args):
+        pass  # One line per request drowns the benchmark output
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def _rate_limit_headers(self, now):
+        while window and now - window[0][0] > 60:
+            window.popleft()
+        used_tokens = sum(tokens for _, tokens in window)
+        return {
+            "x-ratelimit-limit-requests": self.rpm or 10000,
+            "x-ratelimit-remaining-requests": max(0, (self.rpm or 10000) - len(window)),
+            "x-ratelimit-limit-tokens": self.tpm or 30000000,
+            "x-ratelimit-remaining-tokens": max(0, (self.tpm or 30000000) - used_tokens),
+            "x-ratelimit-reset-requests": "1s",
+            "x-ratelimit-reset-tokens": "1s",
+        }
+
+    def do_GET(self):
+        if self.path == "/v1/stats":
+            with lock:
+                return self._send(200, stats)
+        self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        global stats
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/v1/stats/reset":
+            with lock:
+                stats = new_stats()
+                window.clear()
+            return self._send(200, stats)
+        if self.path != "/v1/chat/completions":
+            return self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        request = json.loads(raw)
+        model = request.get("model", "gpt-4o")
+        prompt_tokens, images = count_prompt_tokens(request.get("messages", []))
+        time.sleep(self.latency + random.random() * self.jitter)
+
+        now = time.time()
+        with lock:
+            stats["request_bytes"] += len(raw)
+            headers = self._rate_limit_headers(now)
+            over_budget = (self.rpm and headers["x-ratelimit-remaining-requests"] < 1) or (
+                self.tpm and headers["x-ratelimit-remaining-tokens"] < prompt_tokens
+            )
+            throttled = over_budget or random.random() < self.throttle_rate
+            if throttled:
+                stats["throttled"] += 1
+            else:
+                window.append((now, prompt_tokens))
+        if throttled:
+            headers["retry-after-ms"] = int(200 + random.random() * 800)
+            sent = self._send(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}, headers)
+            with lock:
+                stats["response_bytes"] += sent
+            return
+
+        content = fake_content(request, images)
+        completion_tokens = len(content) // 4 + 1
+        sent = self._send(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(now),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }, headers)
+        with lock:
+            stats["requests"] += 1
+            stats["images"] += images
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["response_bytes"] += sent
+            model_stats = stats["by_model"].setdefault(model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            model_stats["requests"] += 1
+            model_stats["prompt_tokens"] += prompt_tokens
+            model_stats["completion_tokens"] += completion_tokens
+
+
+def serve(port: int = 8766, latency: float = 0.5, jitter: float = 0.0, throttle_rate: float = 0.0, rpm: int = 0, tpm: int = 0):
+    """Start the server on a background thread and return it, port 0 picks a free port"""
+    Handler.latency, Handler.jitter, Handler.throttle_rate = latency, jitter, throttle_rate
+    Handler.rpm, Handler.tpm = rpm, tpm
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds every request takes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many seconds are added at random")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with a 429")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before answering 429, 0 for no limit")
+    parser.add_argument("--tpm", type=int, default=0, help="Prompt tokens per minute before answering 429, 0 for no limit")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency, args.jitter, args.throttle_rate, args.rpm, args.tpm)
+    print(f"Fake OpenAI server on http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()